@@ -0,0 +1,108 @@
+import numpy as np
+from scipy.ndimage import uniform_filter
+
+# Batched SSIM / MSE scores for stacks of small images (edge strips, rows, columns).
+# batch_ssim follows skimage.metrics.structural_similarity with its defaults
+# (uniform window, K1=0.01, K2=0.03, sample covariance, border cropped before
+# the mean) and agrees with it to floating point precision, see
+# tests/test_batch_similarity.py.
+
+K1 = 0.01
+K2 = 0.03
+GRAY_WEIGHTS = np.array([0.2989, 0.5870, 0.1140])
+
+
+def batch_ssim(images_1, images_2, win_size=7, data_range=None):
+    """
+    Mean SSIM of each image pair in two stacks.
+
+    Parameters:
+    images_1 (numpy.ndarray): Stack of shape (N, ...) with one or more spatial axes.
+    images_2 (numpy.ndarray): Stack of the same shape.
+    win_size (int): Odd side length of the uniform window.
+    data_range (float): Value range of the images; defaults to the integer dtype range (255 for uint8).
+
+    Returns:
+    numpy.ndarray: float64 array of shape (N,).
+    """
+    images_1 = np.asarray(images_1)
+    images_2 = np.asarray(images_2)
+    if images_1.shape != images_2.shape:
+        raise ValueError("images should be the same size")
+    spatial_shape = images_1.shape[1:]
+    if any(size < win_size for size in spatial_shape):
+        raise ValueError(f"win_size {win_size} exceeds image extent {spatial_shape}")
+    if win_size % 2 != 1:
+        raise ValueError("Window size must be odd.")
+    if data_range is None:
+        if not np.issubdtype(images_1.dtype, np.integer):
+            raise ValueError("data_range must be given for floating point images")
+        info = np.iinfo(images_1.dtype)
+        data_range = info.max - info.min
+
+    x = images_1.astype(np.float64)
+    y = images_2.astype(np.float64)
+    # window of 1 along the batch axis, so images never mix
+    size = (1,) + (win_size,) * len(spatial_shape)
+    window_pixels = win_size ** len(spatial_shape)
+    cov_norm = window_pixels / (window_pixels - 1)
+
+    ux = uniform_filter(x, size=size)
+    uy = uniform_filter(y, size=size)
+    uxx = uniform_filter(x * x, size=size)
+    uyy = uniform_filter(y * y, size=size)
+    uxy = uniform_filter(x * y, size=size)
+    vx = cov_norm * (uxx - ux * ux)
+    vy = cov_norm * (uyy - uy * uy)
+    vxy = cov_norm * (uxy - ux * uy)
+
+    c1 = (K1 * data_range) ** 2
+    c2 = (K2 * data_range) ** 2
+    ssim_map = ((2 * ux * uy + c1) * (2 * vxy + c2)) / ((ux ** 2 + uy ** 2 + c1) * (vx + vy + c2))
+
+    pad = (win_size - 1) // 2
+    inner = (slice(None),) + tuple(slice(pad, size - pad) for size in spatial_shape)
+    return ssim_map[inner].reshape(len(ssim_map), -1).mean(axis=1)
+
+def batch_mse_similarity(images_1, images_2):
+    """
+    The FindConnectivity mse() score, 1 - sum of squared differences / (rows * cols) / 255, for each pair.
+
+    Parameters:
+    images_1 (numpy.ndarray): Stack of shape (N, rows, cols).
+    images_2 (numpy.ndarray): Stack of the same shape.
+
+    Returns:
+    numpy.ndarray: float64 array of shape (N,).
+    """
+    difference = np.asarray(images_1, dtype=np.float64) - np.asarray(images_2, dtype=np.float64)
+    pixels = difference.shape[1] * difference.shape[2]
+    return 1 - (difference ** 2).reshape(len(difference), -1).sum(axis=1) / pixels / 255.0
+
+def batch_edge_score(edges_1, edges_2):
+    """
+    The compare_edges score for stacks of gray edge strips.
+
+    As in compare_edges, the SSIM window is the largest odd size up to 7 that
+    fits the strip; strips too thin for a 3-pixel window are scored with mse.
+
+    Parameters:
+    edges_1 (numpy.ndarray): uint8 gray strips of shape (N, rows, cols), e.g. (N, 1, 16).
+    edges_2 (numpy.ndarray): Strips of the same shape.
+
+    Returns:
+    numpy.ndarray: float64 array of shape (N,).
+    """
+    win_size = min(7, min(edges_1.shape[1], edges_1.shape[2]))
+    if win_size % 2 == 0:
+        win_size -= 1
+    if win_size < 3:
+        return batch_mse_similarity(edges_1, edges_2)
+    return batch_ssim(edges_1, edges_2, win_size=win_size)
+
+def to_gray(pixels):
+    """
+    Gray values of RGB(A) pixels with the weights used by the StructureSimilarity functions.
+    """
+    return np.dot(np.asarray(pixels)[..., :3], GRAY_WEIGHTS)
+
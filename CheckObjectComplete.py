@@ -1,10 +1,8 @@
-import torch
 import numpy as np
 import cv2
 import os
-from PIL import Image
 from yolov5 import YOLOv5
-from segment_anything import sam_model_registry, SamAutomaticMaskGenerator
+from SamSession import get_session, load_image_rgb
 import json
 
 tileset_folder = "Data/GameTile/small_Segmenets_model/001_005/"
@@ -13,6 +11,8 @@ tile_size = 32
 out_folder = "Data/GameTile/small_Segmenets_complete/"
 
 chkpt_path_2 = "Data/sam_vit_h_4b8939.pth" 
+sam_preset = "balanced"  # SamSession.SAM_PRESETS: "fast", "balanced" or "quality"
+sam_threads = None  # torch CPU threads, None for the torch default
 
 
 
@@ -53,31 +53,24 @@ def is_object_complete(cropped_image_path, model):
 
     return True
 
-def segment_and_save_objects(image_path, output_dir, model, model_type='vit_h'):
+def segment_and_save_objects(image_path, output_dir, model, model_type='vit_h', session=None):
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
     results = []
     
     # Load the image
-    image = cv2.imread(image_path, cv2.IMREAD_UNCHANGED)
+    image, image_rgb = load_image_rgb(image_path)
     if image is None:
         print(f"Error: Unable to load image at {image_path}")
         return
 
-    # Load SAM model
-    sam_checkpoint_path = chkpt_path_2  # Replace with the actual path to your SAM checkpoint file
-    sam = sam_model_registry[model_type](checkpoint=sam_checkpoint_path)
-    sam.to(device='cuda' if torch.cuda.is_available() else 'cpu')
-
-    # Prepare the image for segmentation
-    image_rgb = cv2.cvtColor(image, cv2.COLOR_BGRA2RGB)
-    image_pil = Image.fromarray(image_rgb)
-    image_tensor = torch.from_numpy(np.array(image_pil)).permute(2, 0, 1).unsqueeze(0).float()
+    # SAM model, loaded once per process
+    if session is None:
+        session = get_session(chkpt_path_2, model_type, sam_preset, sam_threads)
 
     # Generate masks
-    mask_generator = SamAutomaticMaskGenerator(sam)
-    masks = mask_generator.generate(image_rgb)
+    masks = session.generate(image_rgb)
 
     # Process each mask
     for i, mask in enumerate(masks):
@@ -99,13 +92,14 @@ def segment_and_save_objects(image_path, output_dir, model, model_type='vit_h'):
 
 def process_tileset_images(input_folder, output_base_dir, yolo_model, model_type='vit_h', tile_size=32):
     all_results = {}
+    session = get_session(chkpt_path_2, model_type, sam_preset, sam_threads)
     # Process each image in the input folder
     for filename in os.listdir(input_folder):
         if filename.endswith('.png'):
             image_path = os.path.join(input_folder, filename)
             tileset_name = os.path.splitext(filename)[0]
             output_dir = os.path.join(output_base_dir, tileset_name)
-            results = segment_and_save_objects(image_path, output_dir, yolo_model, model_type)
+            results = segment_and_save_objects(image_path, output_dir, yolo_model, model_type, session)
             all_results[tileset_name] = results
 
     # Save all results to a JSON file
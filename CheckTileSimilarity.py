@@ -1,9 +1,11 @@
 import matplotlib.pyplot as plt
 import numpy as np
+import math
 from PIL import Image
 from pathlib import Path
-from skimage.metrics import structural_similarity as ssim
+from BatchSimilarity import batch_ssim, to_gray
 from collections import Counter
+from functools import lru_cache
 
 
 
@@ -57,6 +59,106 @@ def is_column_alpha_mostly_zero(image, column_index, threshold=0.85):
 
     return zero_alpha_fraction >= threshold
 
+### load an image as an RGBA array
+def load_rgba_array(image_path):
+    """
+    Load an image as an RGBA NumPy array.
+
+    Parameters:
+    image_path (str): Path to the image file.
+
+    Returns:
+    numpy.ndarray: uint8 array of shape (H, W, 4).
+    """
+    with Image.open(image_path) as img:
+        return np.asarray(img.convert("RGBA"))
+
+### view the tileset as a (rows, cols, T, T, 4) grid of tiles
+def tile_grid_view(tileset_array, tile_size):
+    """
+    Split a tileset array into a grid of tiles without copying pixel data.
+
+    The sheet is padded with transparent pixels up to a multiple of tile_size
+    (the same result Image.crop gives for tiles hanging over the border); the
+    padding is the only copy, and only happens for sheets with partial tiles.
+
+    Parameters:
+    tileset_array (numpy.ndarray): RGBA array of shape (H, W, 4).
+    tile_size (int): Edge length of a square tile.
+
+    Returns:
+    numpy.ndarray: Array of shape (rows, cols, tile_size, tile_size, 4), where
+    tiles[y, x] is the tile named tiles_x_y.
+    """
+    height, width = tileset_array.shape[:2]
+    rows = math.ceil(height / tile_size)
+    cols = math.ceil(width / tile_size)
+    pad_h = rows * tile_size - height
+    pad_w = cols * tile_size - width
+    if pad_h or pad_w:
+        tileset_array = np.pad(tileset_array, ((0, pad_h), (0, pad_w), (0, 0)))
+
+    # (rows, T, cols, T, 4) -> (rows, cols, T, T, 4), both steps are views
+    tiles = tileset_array.reshape(rows, tile_size, cols, tile_size, 4)
+    return tiles.swapaxes(1, 2)
+
+### batched checks: tiles is a stacked (N, T, T, 4) RGBA array, result is a boolean mask of shape (N,)
+def is_image_mostly_blank_batch(tiles, threshold=0.85):
+    """
+    Check which tiles are mostly blank (threshold% of the pixels are the same color).
+
+    Parameters:
+    tiles (numpy.ndarray): uint8 RGBA array of shape (N, H, W, 4).
+    threshold (float): Fraction of pixels that need to be the same for the image to be considered blank.
+
+    Returns:
+    numpy.ndarray: Boolean mask of shape (N,).
+    """
+    tiles = np.ascontiguousarray(tiles, dtype=np.uint8)
+    count = tiles.shape[0]
+    # one uint32 per RGBA pixel, so equal pixels compare as equal numbers
+    pixels = tiles.reshape(count, -1, 4).view(np.uint32)[..., 0]
+    pixel_count = pixels.shape[1]
+
+    # longest run of equal values in each sorted row = count of the most common pixel
+    pixels = np.sort(pixels, axis=1)
+    positions = np.arange(pixel_count)
+    run_starts = np.ones(pixels.shape, dtype=bool)
+    run_starts[:, 1:] = pixels[:, 1:] != pixels[:, :-1]
+    last_start = np.maximum.accumulate(np.where(run_starts, positions, 0), axis=1)
+    most_common_pixel_count = (positions - last_start).max(axis=1) + 1
+
+    return most_common_pixel_count / pixel_count >= threshold
+
+def is_almost_transparent_batch(tiles, threshold=0.95, alpha_threshold=10):
+    """
+    Check which tiles are almost transparent.
+
+    Parameters:
+    tiles (numpy.ndarray): RGBA array of shape (N, H, W, 4); any leading shape such as (rows, cols) also works.
+    threshold (float): Proportion of transparent pixels required to consider the image almost transparent.
+    alpha_threshold (int): Maximum alpha value to consider a pixel as transparent.
+
+    Returns:
+    numpy.ndarray: Boolean mask of shape tiles.shape[:-3].
+    """
+    alpha_channel = tiles[..., 3]
+    transparent_pixels = np.count_nonzero(alpha_channel <= alpha_threshold, axis=(-2, -1))
+    total_pixels = alpha_channel.shape[-2] * alpha_channel.shape[-1]
+    return transparent_pixels / total_pixels >= threshold
+
+def is_image_blank_batch(tiles):
+    """
+    Check which tiles are blank (a single color or transparent).
+
+    Parameters:
+    tiles (numpy.ndarray): RGBA array of shape (N, H, W, 4).
+
+    Returns:
+    numpy.ndarray: Boolean mask of shape (N,).
+    """
+    return (tiles == tiles[:, :1, :1, :]).all(axis=(1, 2, 3))
+
 def is_image_mostly_blank(image_path, threshold=0.85):
     """
     Check if an image is mostly blank (threshold% of the pixels are the same color).
@@ -68,18 +170,7 @@ def is_image_mostly_blank(image_path, threshold=0.85):
     Returns:
     bool: True if the image is mostly blank, False otherwise.
     """
-    image = Image.open(image_path).convert("RGBA")
-    pixels = image.getdata()
-    pixel_count = len(pixels)
-    
-    # Count the occurrences of each pixel
-    pixel_counter = Counter(pixels)
-    most_common_pixel_count = pixel_counter.most_common(1)[0][1]
-
-    # Calculate the fraction of the most common pixel
-    most_common_fraction = most_common_pixel_count / pixel_count
-
-    return most_common_fraction >= threshold
+    return bool(is_image_mostly_blank_batch(load_rgba_array(image_path)[np.newaxis], threshold)[0])
 
 def is_almost_transparent(image_path, threshold=0.95, alpha_threshold=10):
     """
@@ -95,26 +186,7 @@ def is_almost_transparent(image_path, threshold=0.95, alpha_threshold=10):
     Returns:
     bool: True if the image is almost transparent, False otherwise.
     """
-    with Image.open(image_path) as img:
-        # Convert the image to RGBA if it does not have an alpha channel
-        if img.mode != 'RGBA':
-            img = img.convert('RGBA')
-        
-        # Convert the image to a NumPy array
-        img_array = np.array(img)
-        
-        # Get the alpha channel
-        alpha_channel = img_array[:, :, 3]
-        
-        # Count the number of almost transparent pixels
-        transparent_pixels = np.sum(alpha_channel <= alpha_threshold)
-        
-        # Calculate the proportion of almost transparent pixels
-        total_pixels = alpha_channel.size
-        transparent_proportion = transparent_pixels / total_pixels
-        
-        # Determine if the image is almost transparent
-        return transparent_proportion >= threshold
+    return bool(is_almost_transparent_batch(load_rgba_array(image_path), threshold, alpha_threshold))
 
 # check an image is blank
 def is_image_blank(image_path):
@@ -127,17 +199,7 @@ def is_image_blank(image_path):
     Returns:
     bool: True if the image is blank, False otherwise.
     """
-    image = Image.open(image_path).convert("RGBA")
-    pixels = image.getdata()
-
-    # Get the first pixel value
-    first_pixel = pixels[0]
-
-    # Check if all pixels are the same as the first pixel
-    for pixel in pixels:
-        if pixel != first_pixel:
-            return False
-    return True
+    return bool(is_image_blank_batch(load_rgba_array(image_path)[np.newaxis])[0])
 
 # get image index from image path
 def get_image_index(image_path):
@@ -202,43 +264,65 @@ def is_column_almost_empty(image, column_index, threshold=0.85):
     return most_common_fraction >= threshold
 
 ### Computer histogram similarity
+def channel_histograms(vec, bins=256):
+    """
+    Normalized per-channel histograms of an (L, 4) RGBA pixel strip.
+
+    Parameters:
+    vec (numpy.ndarray): Pixel strip of shape (L, 4).
+    bins (int): Number of bins over the 0-255 range.
+
+    Returns:
+    numpy.ndarray: Array of shape (4, bins), each row sums to 1.
+    """
+    vec = np.asarray(vec)
+    if bins == 256:
+        # integer pixels: bin index is the value itself, one bincount for all channels
+        codes = vec.astype(np.intp) + np.arange(vec.shape[1]) * 256
+        hist = np.bincount(codes.ravel(), minlength=vec.shape[1] * 256).reshape(vec.shape[1], 256)
+    else:
+        hist = np.stack([np.histogram(vec[:, c], bins=bins, range=(0, 256))[0] for c in range(vec.shape[1])])
+    return hist / hist.sum(axis=1, keepdims=True)
+
 def histogram_similarity(vec1, vec2, bins=256):
-    # Calculate histograms for each RGBA channel
-    hist1_r, _ = np.histogram(vec1[:, 0], bins=bins, range=(0, 256))
-    hist1_g, _ = np.histogram(vec1[:, 1], bins=bins, range=(0, 256))
-    hist1_b, _ = np.histogram(vec1[:, 2], bins=bins, range=(0, 256))
-    hist1_a, _ = np.histogram(vec1[:, 3], bins=bins, range=(0, 256))
-    
-    hist2_r, _ = np.histogram(vec2[:, 0], bins=bins, range=(0, 256))
-    hist2_g, _ = np.histogram(vec2[:, 1], bins=bins, range=(0, 256))
-    hist2_b, _ = np.histogram(vec2[:, 2], bins=bins, range=(0, 256))
-    hist2_a, _ = np.histogram(vec2[:, 3], bins=bins, range=(0, 256))
-
-    # Normalize histograms
-    hist1_r = hist1_r / np.sum(hist1_r)
-    hist1_g = hist1_g / np.sum(hist1_g)
-    hist1_b = hist1_b / np.sum(hist1_b)
-    hist1_a = hist1_a / np.sum(hist1_a)
-    
-    hist2_r = hist2_r / np.sum(hist2_r)
-    hist2_g = hist2_g / np.sum(hist2_g)
-    hist2_b = hist2_b / np.sum(hist2_b)
-    hist2_a = hist2_a / np.sum(hist2_a)
-
-    # Calculate histogram intersection (a measure of similarity)
-    similarity_r = np.minimum(hist1_r, hist2_r).sum()
-    similarity_g = np.minimum(hist1_g, hist2_g).sum()
-    similarity_b = np.minimum(hist1_b, hist2_b).sum()
-    similarity_a = np.minimum(hist1_a, hist2_a).sum()
-    
-    # Calculate overall similarity
-    overall_similarity = (similarity_r + similarity_g + similarity_b + similarity_a) / 4.0
+    # Calculate normalized histograms for each RGBA channel
+    hist1 = channel_histograms(vec1, bins)
+    hist2 = channel_histograms(vec2, bins)
+
+    # Calculate histogram intersection (a measure of similarity), averaged over the channels
+    overall_similarity = np.minimum(hist1, hist2).sum(axis=1).mean()
     
     return overall_similarity
 ### compute SSIM
 def compare_ssim(image1_part, image2_part):
-    ssim_index, ssim_map = ssim(image1_part, image2_part, full=True)
-    return ssim_index
+    # gray lines are floats in the 0-255 range
+    return batch_ssim(image1_part[np.newaxis], image2_part[np.newaxis], data_range=255)[0]
+
+def lineStructureSimilarityBatch(tiles_1, tiles_2, side):
+    """
+    oneRowStructureSimilarity / oneColumnStructureSimilarity for many tile pairs at once.
+
+    Parameters:
+    tiles_1 (numpy.ndarray): RGB(A) tiles of shape (N, T, T, C).
+    tiles_2 (numpy.ndarray): Tiles of the same shape, the neighbours on `side` of tiles_1.
+    side (str): Edge of tiles_1 that touches tiles_2, one of EDGE_SIDES.
+
+    Returns:
+    numpy.ndarray: SSIM of each touching line pair, shape (N,).
+    """
+    tiles_1 = np.asarray(tiles_1)
+    tiles_2 = np.asarray(tiles_2)
+    if side == "top":
+        line_1, line_2 = tiles_1[:, 0], tiles_2[:, -1]
+    elif side == "down":
+        line_1, line_2 = tiles_1[:, -1], tiles_2[:, 0]
+    elif side == "left":
+        line_1, line_2 = tiles_1[:, :, 0], tiles_2[:, :, -1]
+    elif side == "right":
+        line_1, line_2 = tiles_1[:, :, -1], tiles_2[:, :, 0]
+    else:
+        raise ValueError(f"unknown side {side}")
+    return batch_ssim(to_gray(line_1), to_gray(line_2), data_range=255)
 
 def oneRowStructureSimilarity(image_1, image_2):
     # Convert images to NumPy arrays
@@ -338,149 +422,153 @@ def twoLineColorSimilarity(image_1_vec_1, image_1_vec_2, image_2_vec_1, image_2_
 
 
 
+### per-tile edge descriptors: histograms of the 1- and 2-pixel edge strips, computed once per tile
+EDGE_SIDES = ("top", "down", "left", "right")
+OPPOSITE_SIDE = np.array([1, 0, 3, 2])
+EDGE_DEPTH = 2
+
+class EdgeDescriptors:
+    """
+    Edge strip histograms for a stack of tiles.
+
+    hist[n, side, depth] holds the per-channel 256-bin counts of the pixel line
+    `depth` pixels in from `side` (EDGE_SIDES order) of tile n, and
+    empty[n, side] marks outermost lines whose alpha is mostly zero (the
+    is_row_alpha_mostly_zero / is_column_alpha_mostly_zero rule). Similarities
+    between any tiles are then lookups plus an np.minimum reduction.
+    """
+
+    def __init__(self, tiles, empty_threshold=0.85):
+        """
+        Parameters:
+        tiles (numpy.ndarray): uint8 RGBA array of shape (N, H, W, 4).
+        empty_threshold (float): Fraction of alpha == 0 pixels for an edge line to count as empty.
+        """
+        tiles = np.asarray(tiles)
+        count, height, width = tiles.shape[:3]
+        self.count = count
+        self.lengths = np.array([width, width, height, height])
+
+        depths = np.arange(EDGE_DEPTH)
+        # (N, depth, L, 4) strips for each side
+        strips = (
+            tiles[:, depths, :, :],
+            tiles[:, height - 1 - depths, :, :],
+            tiles[:, :, depths, :].transpose(0, 2, 1, 3),
+            tiles[:, :, width - 1 - depths, :].transpose(0, 2, 1, 3),
+        )
+
+        count_dtype = np.uint8 if max(height, width) <= 255 else np.uint16
+        self.hist = np.empty((count, len(EDGE_SIDES), EDGE_DEPTH, 4, 256), dtype=count_dtype)
+        self.empty = np.empty((count, len(EDGE_SIDES)), dtype=bool)
+        for side, strip in enumerate(strips):
+            # one bincount per side: code = ((tile, depth, channel), value)
+            rows = np.arange(count * EDGE_DEPTH).reshape(count, EDGE_DEPTH, 1, 1) * 4 + np.arange(4)
+            codes = rows * 256 + strip
+            hist = np.bincount(codes.ravel(), minlength=count * EDGE_DEPTH * 4 * 256)
+            self.hist[:, side] = hist.reshape(count, EDGE_DEPTH, 4, 256)
+            self.empty[:, side] = np.mean(strip[:, 0, :, 3] == 0, axis=1) >= empty_threshold
+
+    @classmethod
+    def from_paths(cls, image_paths):
+        return cls(np.stack([load_rgba_array(image_path) for image_path in image_paths]))
+
+    def similarity_to(self, rows, other, other_rows, sides, two_lines=False):
+        """
+        Color similarity between edges of tiles in self and the facing edges of tiles in other.
+
+        Parameters:
+        rows (array-like): Tile rows in self.
+        other (EdgeDescriptors): Descriptors of the neighbour tiles (may be self).
+        other_rows (array-like): Tile rows in other.
+        sides (array-like): Side index (EDGE_SIDES) of self's tile that faces the neighbour.
+        two_lines (bool): Average the 4 pairings of the two outer lines (twoLineColorSimilarity)
+                          instead of comparing the outermost lines (oneLineColorSimilarity).
+
+        Returns:
+        numpy.ndarray: Similarities in [0, 1], 0 where either edge is empty.
+        """
+        rows = np.asarray(rows)
+        other_rows = np.asarray(other_rows)
+        sides = np.asarray(sides)
+        facing = OPPOSITE_SIDE[sides]
+        length = self.lengths[sides]
+
+        depth_pairs = [(0, 0)] if not two_lines else [(0, 0), (0, 1), (1, 0), (1, 1)]
+        similarity = np.zeros(np.broadcast(rows, other_rows, sides).shape)
+        for depth, other_depth in depth_pairs:
+            overlap = np.minimum(self.hist[rows, sides, depth], other.hist[other_rows, facing, other_depth])
+            similarity += overlap.sum(axis=-1).mean(axis=-1) / length
+        similarity /= len(depth_pairs)
+
+        similarity[self.empty[rows, sides] | other.empty[other_rows, facing]] = 0.0
+        return similarity
+
+    def pair_similarity(self, rows_a, rows_b, sides, two_lines=False):
+        """
+        Batch similarity for tile pairs inside this descriptor set; see similarity_to.
+        """
+        return self.similarity_to(rows_a, self, rows_b, sides, two_lines)
+
+    def grid_similarity(self, grid_rows, grid_cols, two_lines=False):
+        """
+        Similarity of every horizontal and vertical neighbour pair of a tile grid.
+
+        The descriptors must come from a (grid_rows, grid_cols) grid flattened in
+        row-major order. The measure is symmetric, so right[y, x] is both the
+        right similarity of (x, y) and the left similarity of (x + 1, y).
+
+        Returns:
+        tuple: (right, down) arrays of shape (grid_rows, grid_cols - 1) and (grid_rows - 1, grid_cols).
+        """
+        index = np.arange(grid_rows * grid_cols).reshape(grid_rows, grid_cols)
+        right = self.pair_similarity(index[:, :-1], index[:, 1:], EDGE_SIDES.index("right"), two_lines)
+        down = self.pair_similarity(index[:-1, :], index[1:, :], EDGE_SIDES.index("down"), two_lines)
+        return right, down
+
+@lru_cache(maxsize=8192)
+def get_edge_descriptors(image_path):
+    """
+    Edge descriptors of one image file, computed once per path.
+    """
+    return EdgeDescriptors(load_rgba_array(image_path)[np.newaxis])
+
 def checkSimilarity(image_path_1, image_path_2):
     isAdjacent = False
-    # connect_directions = []
-    image_1 = Image.open(image_path_1).convert('RGBA')
-    image_1_w, image_1_h = image_1.size
-    image_2 = Image.open(image_path_2).convert('RGBA')
-    image_2_w, image_2_h = image_2.size
-    # plt.imshow(image_1)
-    # plt.show()    
-    # plt.imshow(image_2)
-    # plt.show()    
+    image_1_w, image_1_h = Image.open(image_path_1).size
+    image_2_w, image_2_h = Image.open(image_path_2).size
 
     if image_1_w != image_2_w or image_1_h != image_2_h:
         print("images should be the same size")
         return isAdjacent
 
-    image_1_x, image_1_y  = get_image_index(image_path_1)
-    image_2_x, image_2_y  = get_image_index(image_path_2)
-    
-    image_1_key = str(image_1_x)+"_"+str(image_1_y)
-    image_2_key = str(image_2_x)+"_"+str(image_2_y)
-
-    image_array_1 = {}
-    image_array_2 = {}
-    ### the four edges: right, left, top, down
-    
-    # Get the right-most column
-    right_edge = image_1_w-1
-    image_1_right_most = [image_1.getpixel((right_edge, y)) for y in range(image_1_h)]
-    image_array_1["right_1"] = np.array(image_1_right_most)
-    image_2_right_most = [image_2.getpixel((right_edge, y)) for y in range(image_2_h)]
-    image_array_2["right_1"] = np.array(image_2_right_most)
-    right_edge = image_1_w-2
-    image_1_right_most = [image_1.getpixel((right_edge, y)) for y in range(image_1_h)]
-    image_array_1["right_2"] = np.array(image_1_right_most)
-    image_2_right_most = [image_2.getpixel((right_edge, y)) for y in range(image_2_h)]
-    image_array_2["right_2"] = np.array(image_2_right_most)
-
-    # Get the left-most column
-    left_edge = 0
-    image_1_left_most = [image_1.getpixel((left_edge, y)) for y in range(image_1_h)]
-    image_array_1["left_1"] = np.array(image_1_left_most)
-    image_2_left_most = [image_2.getpixel((left_edge, y)) for y in range(image_2_h)]
-    image_array_2["left_1"] = np.array(image_2_left_most)
-    left_edge = 1
-    image_1_left_most = [image_1.getpixel((left_edge, y)) for y in range(image_1_h)]
-    image_array_1["left_2"] = np.array(image_1_left_most)
-    image_2_left_most = [image_2.getpixel((left_edge, y)) for y in range(image_2_h)]
-    image_array_2["left_2"] = np.array(image_2_left_most)
-    # Get the top-most row
-    top_edge = 0
-    image_1_top_most = [image_1.getpixel((x, top_edge)) for x in range(image_1_w)]
-    image_array_1["top_1"] = np.array(image_1_top_most) 
-    image_2_top_most = [image_2.getpixel((x, top_edge)) for x in range(image_2_w)]
-    image_array_2["top_1"] = np.array(image_2_top_most)
-    top_edge = 1
-    image_1_top_most = [image_1.getpixel((x, top_edge)) for x in range(image_1_w)]
-    image_array_1["top_2"] = np.array(image_1_top_most) 
-    image_2_top_most = [image_2.getpixel((x, top_edge)) for x in range(image_2_w)]
-    image_array_2["top_2"] = np.array(image_2_top_most)      
-    # Get the down-most row   
-    down_edge = image_1_h-1
-    image_1_down_most = [image_1.getpixel((x, down_edge)) for x in range(image_1_w)]
-    image_array_1["down_1"] = np.array(image_1_down_most) 
-    image_2_down_most = [image_2.getpixel((x, down_edge)) for x in range(image_2_w)]
-    image_array_2["down_1"] = np.array(image_2_down_most) 
-    down_edge = image_1_h-2
-    image_1_down_most = [image_1.getpixel((x, down_edge)) for x in range(image_1_w)]
-    image_array_1["down_2"] = np.array(image_1_down_most) 
-    image_2_down_most = [image_2.getpixel((x, down_edge)) for x in range(image_2_w)]
-    image_array_2["down_2"] = np.array(image_2_down_most) 
-
+    image_1_x, image_1_y  = map(int, get_image_index(image_path_1))
+    image_2_x, image_2_y  = map(int, get_image_index(image_path_2))
 
-    
-    # second image at top x = 0, y = -1, , compare top from image 1, and down from image 2
+    # which edge of image 1 faces image 2
+    side = None
+    # second image at top x = 0, y = -1, compare top from image 1, and down from image 2
     if image_1_x == image_2_x and image_1_y > image_2_y:
-        print("Check top adjacency")
-        one_similarity = oneLineColorSimilarity(image_array_1["top_1"], image_array_2["down_1"])
-        two_similarity = twoLineColorSimilarity(image_array_1["top_1"], image_array_1["top_2"], image_array_2["down_1"],image_array_2["down_2"])
-        # one_structure = oneRowStructureSimilarity(image_1, image_2)
-        # two_structure = twoRowsStructureSimilarity(image_1, image_2)
-        # print("one line color: ", one_similarity, "two lines color: ", two_similarity, "one_structure: ", one_structure, "two_structure: ", two_structure)  
-        print("one line color: ", one_similarity, "two lines color: ", two_similarity)  
-        similarity = one_similarity
-        if is_row_alpha_mostly_zero(image_1, 0) or is_row_alpha_mostly_zero(image_2, image_2_h-1):
-        # if is_row_almost_empty(image_1, 0) or is_row_almost_empty(image_2, image_2_h-1):
-            print("image 2 at top, Separate Images because of empty row")
-            similarity = 0.0
-
+        side = "top"
     # second image at down x = 0, y = 1, compare down from image 1, and top from image 2
     if image_1_x == image_2_x and image_1_y < image_2_y:
-        print("Check down adjacency")
-        one_similarity = oneLineColorSimilarity(image_array_1["down_1"], image_array_2["top_1"])
-        two_similarity = twoLineColorSimilarity(image_array_1["down_1"], image_array_1["down_2"], image_array_2["top_1"],image_array_2["top_2"])
-        # one_structure = oneRowStructureSimilarity(image_2, image_1)
-        # two_structure = twoRowsStructureSimilarity(image_2, image_1)
-        # print("one line color: ", one_similarity, "two lines color: ", two_similarity, "one_structure: ", one_structure, "two_structure: ", two_structure)  
-        print("one line color: ", one_similarity, "two lines color: ", two_similarity)  
-        
-        similarity = one_similarity
-        if is_row_alpha_mostly_zero(image_1, image_1_h-1) or is_row_alpha_mostly_zero(image_2, 0):
-        # if is_row_almost_empty(image_1, image_1_h-1) or is_row_almost_empty(image_2, 0):
-            print("image 2 at down, Separate Images because of empty row")
-            similarity = 0.0
-
-
+        side = "down"
     # second image at left x = -1, y = 0, left from image 1, right from image 2
     if image_1_x > image_2_x and image_1_y == image_2_y:
-        print("Check left adjacency")
-        one_similarity = oneLineColorSimilarity(image_array_1["left_1"], image_array_2["right_1"])
-        two_similarity = twoLineColorSimilarity(image_array_1["left_1"], image_array_1["left_2"], image_array_2["right_1"],image_array_2["right_2"])
-        # one_structure = oneColumnStructureSimilarity(image_1, image_2)
-        # two_structure = twoRowsStructureSimilarity(image_1, image_2)
-        # print("one line color: ", one_similarity, "two lines color: ", two_similarity, "one_structure: ", one_structure, "two_structure: ", two_structure)  
-        print("one line color: ", one_similarity, "two lines color: ", two_similarity)  
-
-        similarity = one_similarity
-        if is_column_alpha_mostly_zero(image_1, 0) or is_column_alpha_mostly_zero(image_2, image_2_w -1):        
-        # if is_column_almost_empty(image_1, 0) or is_row_almost_empty(image_2, image_2_w -1):
-            print("image 2 at left, Separate Images because of empty column")
-            similarity = 0.0
-
+        side = "left"
     # second image at right x = 1, y = 0, right from image 1, left from image 2
     if image_1_x < image_2_x and image_1_y == image_2_y:
-        print("Check right adjacency")
-        one_similarity = oneLineColorSimilarity(image_array_1["right_1"], image_array_2["left_1"])
-        two_similarity = twoLineColorSimilarity(image_array_1["right_1"], image_array_1["right_2"], image_array_2["left_1"],image_array_2["left_2"])
-        # one_structure = oneColumnStructureSimilarity(image_2, image_1)
-        # two_structure = twoRowsStructureSimilarity(image_2, image_1)
-        # print("one line color: ", one_similarity, "two lines color: ", two_similarity, "one_structure: ", one_structure, "two_structure: ", two_structure)  
-        print("one line color: ", one_similarity, "two lines color: ", two_similarity)  
+        side = "right"
+    if side is None:
+        print("images are not edge neighbours")
+        return 0.0
+
+    print("Check", side, "adjacency")
+    descriptors_1 = get_edge_descriptors(image_path_1)
+    descriptors_2 = get_edge_descriptors(image_path_2)
+    side_index = EDGE_SIDES.index(side)
+    if descriptors_1.empty[0, side_index] or descriptors_2.empty[0, OPPOSITE_SIDE[side_index]]:
+        print("image 2 at", side, ", Separate Images because of empty edge")
+    similarity = descriptors_1.similarity_to(0, descriptors_2, 0, side_index)[()]
 
-        similarity = one_similarity
-        if is_column_alpha_mostly_zero(image_1, image_1_w -1) or is_column_alpha_mostly_zero(image_2, 0):   
-        # if is_column_almost_empty(image_1, image_1_w -1) or is_row_almost_empty(image_2, 0):
-            print("image 2 at right, Separate Images because of empty column")
-            similarity = 0.0
-
-    # if similarity > SIMILARITY_THRESHOLDS:
-    #     isAdjacent = True
-
-
-    # if one_similarity > SIMILARITY_THRESHOLDS:
-    #     isAdjacent = True
-
-    return similarity
\ No newline at end of file
+    return similarity
@@ -1,10 +1,19 @@
 import os
 import json
+import numpy as np
 
 human_folder = "Data/GameTile/small_SimilarityLabel_verify/" 
 model_folder = "Data/GameTile/small_SimilarityLabel_auto/"
 out_path = "Data/GameTile/Json/"
 
+# label sets compared all at once: annotator name -> folder of labeled pair files
+ANNOTATOR_FOLDERS = {
+    "human": human_folder,
+    "model": model_folder,
+}
+
+MISSING = -1                # label matrix entry of a pair an annotator did not label
+
 def load_json_file(file_path):
     """
     Load data from a JSON file.
@@ -19,10 +28,164 @@ def load_json_file(file_path):
         data = json.load(file)
     return data
 
+def tile_name(path):
+    """
+    (tileset folder, file stem) of an image path with "/" or "\\" separators.
+    """
+    parts = path.replace("\\", "/").split("/")
+    return (parts[-2] if len(parts) > 1 else ""), os.path.splitext(parts[-1])[0]
+
+def pair_key(image1, image2):
+    """
+    Canonical (tileset, tile_a, tile_b, direction) id of an image pair, the same for both orders.
+
+    tile_a is the tile with the smaller (x, y), then the smaller stem; direction is where tile_b lies
+    from tile_a ("right", "down" or "none" for tiles that are not edge
+    neighbours). A tile from another tileset is named "<tileset>/<stem>".
+    """
+    (tileset_1, stem_1), (tileset_2, stem_2) = tile_name(image1), tile_name(image2)
+    try:
+        xy_1 = tuple(map(int, stem_1.split("_")[-2:]))
+        xy_2 = tuple(map(int, stem_2.split("_")[-2:]))
+    except ValueError:
+        xy_1, xy_2 = (stem_1,), (stem_2,)
+    if (tileset_2, xy_2, stem_2) < (tileset_1, xy_1, stem_1):
+        (tileset_1, stem_1, xy_1), (tileset_2, stem_2, xy_2) = (tileset_2, stem_2, xy_2), (tileset_1, stem_1, xy_1)
+
+    direction = "none"
+    if tileset_1 == tileset_2 and len(xy_1) == 2:
+        if xy_1[0] == xy_2[0] and xy_1[1] != xy_2[1]:
+            direction = "down"
+        elif xy_1[1] == xy_2[1] and xy_1[0] != xy_2[0]:
+            direction = "right"
+    tile_b = stem_2 if tileset_2 == tileset_1 else f"{tileset_2}/{stem_2}"
+    return (tileset_1, stem_1, tile_b, direction)
+
+def index_labels(labels):
+    """
+    Key a list of labeled pairs by pair_key.
+
+    Returns:
+    dict: pair_key -> connected (bool); a later duplicate of a pair replaces an earlier one.
+    """
+    return {pair_key(pair['image1'], pair['image2']): bool(pair['connected']) for pair in labels}
+
+def load_label_folder(folder_path):
+    """
+    Load and key all labeled pair files of a folder, see index_labels.
+    """
+    label_set = {}
+    for filename in sorted(os.listdir(folder_path)):
+        if filename.endswith('.json'):
+            label_set.update(index_labels(load_json_file(os.path.join(folder_path, filename))))
+    return label_set
+
+def label_matrix(label_sets):
+    """
+    Hash-join label sets on their pair keys.
+
+    Parameters:
+    label_sets (dict): Annotator name -> {pair_key: connected}.
+
+    Returns:
+    tuple: (keys list, int8 matrix of shape (annotators, keys) holding 0, 1 or MISSING)
+    """
+    keys = list(dict.fromkeys(key for label_set in label_sets.values() for key in label_set))
+    column = {key: i for i, key in enumerate(keys)}
+    matrix = np.full((len(label_sets), len(keys)), MISSING, dtype=np.int8)
+    for row, label_set in enumerate(label_sets.values()):
+        if label_set:
+            matrix[row, [column[key] for key in label_set]] = list(label_set.values())
+    return keys, matrix
+
+def confusion_matrix(labels_a, labels_b):
+    """
+    Counts of (label a, label b) over pairs labeled by both.
+
+    Parameters:
+    labels_a (numpy.ndarray): Row of a label matrix.
+    labels_b (numpy.ndarray): Row of a label matrix.
+
+    Returns:
+    numpy.ndarray: 2x2 int64 array, [a][b] with index 1 for connected.
+    """
+    both = (labels_a != MISSING) & (labels_b != MISSING)
+    return np.bincount(labels_a[both] * 2 + labels_b[both], minlength=4).reshape(2, 2)
+
+def cohen_kappa(confusion):
+    """
+    Cohen's kappa of a 2x2 confusion matrix; 1.0 when both annotators use a single label throughout and agree.
+    """
+    total = confusion.sum()
+    if total == 0:
+        return float("nan")
+    observed = np.trace(confusion) / total
+    expected = (confusion.sum(axis=1) @ confusion.sum(axis=0)) / total ** 2
+    return 1.0 if expected == 1 else float((observed - expected) / (1 - expected))
+
+def fleiss_kappa(matrix):
+    """
+    Fleiss' kappa over the pairs labeled by every annotator.
+
+    Parameters:
+    matrix (numpy.ndarray): Label matrix from label_matrix.
+
+    Returns:
+    float: Kappa, nan with fewer than 2 annotators or no common pairs.
+    """
+    common = matrix[:, (matrix != MISSING).all(axis=0)]
+    raters, items = common.shape
+    if raters < 2 or items == 0:
+        return float("nan")
+    connected = common.sum(axis=0)
+    counts = np.stack([raters - connected, connected], axis=1)
+    agreement = ((counts * (counts - 1)).sum(axis=1) / (raters * (raters - 1))).mean()
+    proportions = counts.sum(axis=0) / (raters * items)
+    expected = (proportions ** 2).sum()
+    return 1.0 if expected == 1 else float((agreement - expected) / (1 - expected))
+
+def compare_label_sets(label_sets, with_disagreements=True):
+    """
+    Agreement, confusion matrix, kappa and disagreements of every pair of annotators in one join.
+
+    Parameters:
+    label_sets (dict): Annotator name -> {pair_key: connected}.
+    with_disagreements (bool): List the pair keys on which two annotators differ.
+
+    Returns:
+    dict: {"annotators", "pairs": {"a vs b": results}, "fleiss_kappa"}
+    """
+    names = list(label_sets)
+    keys, matrix = label_matrix(label_sets)
+    results = {"annotators": {name: int((matrix[row] != MISSING).sum()) for row, name in enumerate(names)},
+               "pairs": {}, "fleiss_kappa": fleiss_kappa(matrix)}
+    for a in range(len(names)):
+        for b in range(a + 1, len(names)):
+            confusion = confusion_matrix(matrix[a], matrix[b])
+            compared = int(confusion.sum())
+            pair_results = {
+                "compared": compared,
+                "agreement": float(np.trace(confusion) / compared) if compared else float("nan"),
+                "confusion_matrix": {"both_connected": int(confusion[1, 1]), "both_separate": int(confusion[0, 0]),
+                                     f"only_{names[a]}_connected": int(confusion[1, 0]),
+                                     f"only_{names[b]}_connected": int(confusion[0, 1])},
+                "kappa": cohen_kappa(confusion),
+                f"missing_in_{names[a]}": int(((matrix[a] == MISSING) & (matrix[b] != MISSING)).sum()),
+                f"missing_in_{names[b]}": int(((matrix[b] == MISSING) & (matrix[a] != MISSING)).sum()),
+            }
+            if with_disagreements:
+                differ = np.nonzero((matrix[a] != MISSING) & (matrix[b] != MISSING) & (matrix[a] != matrix[b]))[0]
+                pair_results["disagreements"] = [{"pair": list(keys[i]), names[a]: bool(matrix[a, i]),
+                                                  names[b]: bool(matrix[b, i])} for i in differ]
+            results["pairs"][f"{names[a]} vs {names[b]}"] = pair_results
+    return results
+
 def compare_connections(human_labels, model_labels):
     """
     Compare the `connected` values between human labels and model labels.
 
+    Pairs are matched by pair_key, so the order of the two images does not matter.
+
     Parameters:
     human_labels (list): List of dictionaries containing human labels.
     model_labels (list): List of dictionaries containing model labels.
@@ -30,28 +193,25 @@ def compare_connections(human_labels, model_labels):
     Returns:
     dict: A dictionary containing the comparison results.
     """
+    human_pairs = {pair_key(pair['image1'], pair['image2']): (pair['image1'], pair['image2']) for pair in human_labels}
+    keys, matrix = label_matrix({"human": index_labels(human_labels), "model": index_labels(model_labels)})
+    human, model = matrix[:, :len(human_pairs)]     # human keys come first in the join
+    confusion = confusion_matrix(human, model)
+    matching = int((human == model).sum())
+
     comparison_results = {
-        "total": 0,
-        "matching": 0,
-        "non_matching": 0,
-        "detailed_comparison": []
+        "total": len(human_pairs),
+        "matching": matching,
+        "non_matching": len(human_pairs) - matching,
+        "confusion_matrix": {"both_connected": int(confusion[1, 1]), "both_separate": int(confusion[0, 0]),
+                             "only_human_connected": int(confusion[1, 0]), "only_model_connected": int(confusion[0, 1])},
+        "kappa": cohen_kappa(confusion),
+        "detailed_comparison": [{
+            "image_pair": human_pairs[key],
+            "human_connected": bool(human[i]),
+            "model_connected": None if model[i] == MISSING else bool(model[i])
+        } for i, key in enumerate(keys[:len(human_pairs)])]
     }
-    
-    human_dict = { (pair['image1'], pair['image2']): pair['connected'] for pair in human_labels }
-    model_dict = { (pair['image1'], pair['image2']): pair['connected'] for pair in model_labels }
-
-    for key in human_dict:
-        comparison_results["total"] += 1
-        if human_dict[key] == model_dict.get(key, None):
-            comparison_results["matching"] += 1
-        else:
-            comparison_results["non_matching"] += 1
-        comparison_results["detailed_comparison"].append({
-            "image_pair": key,
-            "human_connected": human_dict[key],
-            "model_connected": model_dict.get(key, None)
-        })
-
     return comparison_results
 
 def process_comparison(human_folder, model_folder, output_path):
@@ -87,10 +247,30 @@ def process_comparison(human_folder, model_folder, output_path):
 
     print(f"Comparison results saved to {output_path}")
 
+def process_annotator_comparison(annotator_folders, output_path):
+    """
+    Compare the labels of several annotators over all their pairs and save the results.
+
+    Parameters:
+    annotator_folders (dict): Annotator name -> folder of labeled pair files.
+    output_path (str): Path to save the comparison results JSON file.
+    """
+    label_sets = {name: load_label_folder(folder) for name, folder in annotator_folders.items()}
+    results = compare_label_sets(label_sets)
+
+    with open(output_path, 'w') as output_file:
+        json.dump(results, output_file, indent=4)
+
+    for name, pair_results in results["pairs"].items():
+        print(f"{name}: agreement {pair_results['agreement']:.4f}, kappa {pair_results['kappa']:.4f} "
+              f"over {pair_results['compared']} pairs")
+    print(f"Annotator comparison saved to {output_path}")
+
 # Example usage
 if __name__ == "__main__":
     human_folder = human_folder  # Replace with your human label folder path
     model_folder = model_folder  # Replace with your model output folder path
     output_path = out_path + "similarity_comparison_results.json"  # Replace with your desired output JSON file path
 
-    process_comparison(human_folder, model_folder, output_path)
\ No newline at end of file
+    process_comparison(human_folder, model_folder, output_path)
+    process_annotator_comparison(ANNOTATOR_FOLDERS, out_path + "similarity_annotator_agreement.json")
\ No newline at end of file
@@ -0,0 +1,228 @@
+import os
+import json
+import numpy as np
+
+from ConnectivityStore import (ConnectivityStore, DIRECTIONS, CONNECTED_SHIFT, POSSIBLE_SHIFT,
+                               TRANSPARENT_SHIFT, direction_bits, encode_record)
+
+# Edge sets are compared as 8-bit masks (one bit per direction, in
+# ConnectivityStore.DIRECTIONS order) aligned on the (map, x, y) keys of the
+# manual labels. Predictions may be a single (N,) array or a stack (R, N) of
+# runs / threshold settings, which are all scored in one pass.
+
+# which edge set of a prediction is compared with the manual labels
+FIELDS = ("connectivity", "possible_connectivity", "solid")
+
+# number of set bits of every byte
+POPCOUNT = np.array([bin(value).count("1") for value in range(256)], dtype=np.uint8)
+
+
+def parse_manual_key(path):
+    """
+    (map, x, y) key of a labeled tile path such as "000_001\\tiles_3_4.png", or None.
+    """
+    parts = path.replace(".png", "").replace("\\", "/").split("/")[-1].split("_")
+    if len(parts) != 3:
+        return None
+    return (path.split("\\")[0], int(parts[1]), int(parts[2]))
+
+def load_manual_masks(manual_file):
+    """
+    Load the manual connectivity labels as direction masks.
+
+    Parameters:
+    manual_file (str): labeled_connectivity_manual.json, {tile path: [directions]}.
+
+    Returns:
+    tuple: (keys list of (map, x, y), uint8 masks of shape (N,))
+    """
+    with open(manual_file) as f:
+        manual_labels = json.load(f)
+    manual_map = {}
+    for path, labels in manual_labels.items():
+        key = parse_manual_key(path)
+        if key is not None:
+            manual_map[key] = direction_bits(labels)
+    return list(manual_map), np.array(list(manual_map.values()), dtype=np.uint8)
+
+def field_masks(masks, field):
+    """
+    Extract one 8-bit edge set from 24-bit connectivity masks.
+
+    Parameters:
+    masks (numpy.ndarray): uint32 masks, see ConnectivityStore.
+    field (str): One of FIELDS; "solid" is the complement of edge transparency.
+
+    Returns:
+    numpy.ndarray: uint8 masks.
+    """
+    masks = np.asarray(masks, dtype=np.uint32)
+    if field == "connectivity":
+        return (masks >> CONNECTED_SHIFT & 0xFF).astype(np.uint8)
+    if field == "possible_connectivity":
+        return (masks >> POSSIBLE_SHIFT & 0xFF).astype(np.uint8)
+    if field == "solid":
+        return (~(masks >> TRANSPARENT_SHIFT) & 0xFF).astype(np.uint8)
+    raise ValueError(f"unknown field {field}")
+
+def load_predicted_masks(keys, field, predicted_folder=None, predicted_store=None):
+    """
+    Look up the predicted edge set of every key; tiles without a prediction get an empty set.
+
+    Reads the packed store when one is given and exists, otherwise only the
+    tile_connectivity JSON files of maps that appear in keys.
+
+    Parameters:
+    keys (list): (map, x, y) keys.
+    field (str): One of FIELDS.
+    predicted_folder (str): Folder of tile_connectivity-<map>.json files.
+    predicted_store (str): ConnectivityStore folder.
+
+    Returns:
+    numpy.ndarray: uint8 masks of shape (len(keys),).
+    """
+    predicted = np.zeros(len(keys), dtype=np.uint8)
+    by_map = {}
+    for i, (map_id, x, y) in enumerate(keys):
+        by_map.setdefault(map_id, []).append((i, x, y))
+
+    if predicted_store is not None and os.path.exists(predicted_store):
+        store = ConnectivityStore(predicted_store)
+        for map_id, entries in by_map.items():
+            index, xs, ys = (np.array(column) for column in zip(*entries))
+            rows = store.get_rows(map_id, xs, ys)
+            found = rows >= 0
+            predicted[index[found]] = field_masks(store.mask[rows[found]], field)
+        return predicted
+
+    for map_id, entries in by_map.items():
+        json_path = os.path.join(predicted_folder, f"tile_connectivity-{map_id}.json")
+        if not os.path.exists(json_path):
+            continue
+        with open(json_path) as f:
+            tiles = {(tile["tile_x"], tile["tile_y"]): tile for tile in json.load(f)}
+        for i, x, y in entries:
+            tile = tiles.get((x, y))
+            if tile is None:
+                continue
+            if field == "solid" and not tile.get("edge_transparency"):
+                continue  # no transparency recorded: no solid edges
+            predicted[i] = field_masks(encode_record(tile), field)
+    return predicted
+
+def tile_metrics(manual, predicted):
+    """
+    Per-tile precision, recall and F1 of predicted edge sets against manual ones.
+
+    Parameters:
+    manual (numpy.ndarray): uint8 masks of shape (N,).
+    predicted (numpy.ndarray): uint8 masks of shape (N,) or (R, N).
+
+    Returns:
+    dict: tp, fp, fn, precision, recall, f1 and exact_match arrays shaped like predicted.
+    Scores with an empty denominator are 0, as in the comparison scripts.
+    """
+    manual = np.asarray(manual, dtype=np.uint8)
+    predicted = np.asarray(predicted, dtype=np.uint8)
+    tp = POPCOUNT[manual & predicted].astype(np.int32)
+    fp = POPCOUNT[predicted & ~manual].astype(np.int32)
+    fn = POPCOUNT[manual & ~predicted].astype(np.int32)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        precision = np.where(tp + fp > 0, tp / (tp + fp), 0.0)
+        recall = np.where(tp + fn > 0, tp / (tp + fn), 0.0)
+        f1 = np.where(precision + recall > 0, 2 * precision * recall / (precision + recall), 0.0)
+    return {"tp": tp, "fp": fp, "fn": fn, "precision": precision, "recall": recall, "f1": f1,
+            "exact_match": manual == predicted}
+
+def aggregate_metrics(manual, predicted):
+    """
+    Summary scores for one or more prediction runs.
+
+    macro_* average the per-tile scores (the mean of the report columns),
+    micro_* pool the edge counts over all tiles.
+
+    Parameters:
+    manual (numpy.ndarray): uint8 masks of shape (N,).
+    predicted (numpy.ndarray): uint8 masks of shape (N,) or (R, N).
+
+    Returns:
+    dict: Arrays of shape () or (R,) keyed by metric name.
+    """
+    metrics = tile_metrics(manual, predicted)
+    tp = metrics["tp"].sum(axis=-1)
+    fp = metrics["fp"].sum(axis=-1)
+    fn = metrics["fn"].sum(axis=-1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        micro_precision = np.where(tp + fp > 0, tp / (tp + fp), 0.0)
+        micro_recall = np.where(tp + fn > 0, tp / (tp + fn), 0.0)
+        micro_f1 = np.where(micro_precision + micro_recall > 0,
+                            2 * micro_precision * micro_recall / (micro_precision + micro_recall), 0.0)
+    return {
+        "macro_precision": metrics["precision"].mean(axis=-1),
+        "macro_recall": metrics["recall"].mean(axis=-1),
+        "macro_f1": metrics["f1"].mean(axis=-1),
+        "micro_precision": micro_precision,
+        "micro_recall": micro_recall,
+        "micro_f1": micro_f1,
+        "exact_match_rate": metrics["exact_match"].mean(axis=-1),
+    }
+
+def mask_directions(mask):
+    """
+    Sorted direction names of one 8-bit mask.
+    """
+    return sorted(d for bit, d in enumerate(DIRECTIONS) if int(mask) >> bit & 1)
+
+def tile_report(keys, manual, predicted, manual_name="manual", predicted_name="predicted"):
+    """
+    Per-tile report rows in the format of the comparison scripts' CSV / JSON output.
+
+    Parameters:
+    keys (list): (map, x, y) keys.
+    manual (numpy.ndarray): uint8 masks of shape (N,).
+    predicted (numpy.ndarray): uint8 masks of shape (N,).
+    manual_name (str): Column name of the manual edge list.
+    predicted_name (str): Column name of the predicted edge list.
+
+    Returns:
+    list: One dict per key.
+    """
+    metrics = tile_metrics(manual, predicted)
+    results = []
+    for i, (map_id, x, y) in enumerate(keys):
+        results.append({"map": map_id, "tile_x": x, "tile_y": y,
+            manual_name: mask_directions(manual[i]), predicted_name: mask_directions(predicted[i]),
+            "precision": round(float(metrics["precision"][i]), 2), "recall": round(float(metrics["recall"][i]), 2),
+            "f1_score": round(float(metrics["f1"][i]), 2), "exact_match": bool(metrics["exact_match"][i])})
+    return results
+
+def compare_runs(manual_file, runs, field):
+    """
+    Score several prediction runs against the manual labels in one pass.
+
+    Parameters:
+    manual_file (str): labeled_connectivity_manual.json.
+    runs (dict): run name -> (predicted_folder, predicted_store); either may be None.
+    field (str): One of FIELDS.
+
+    Returns:
+    list: One dict of aggregate scores per run, with its "run" name.
+    """
+    keys, manual = load_manual_masks(manual_file)
+    predicted = np.stack([load_predicted_masks(keys, field, folder, store) for folder, store in runs.values()])
+    summary = aggregate_metrics(manual, predicted)
+    return [dict({"run": name}, **{metric: float(values[r]) for metric, values in summary.items()})
+            for r, name in enumerate(runs)]
+
+
+if __name__ == "__main__":
+    # compare the conservative and smart FindConnectivity runs
+    MANUAL_FILE = "Data/GameTile/labeled_connectivity_manual.json"
+    RUNS = {
+        "conservative": ("Data/GameTile/connectivity_results_4", None),
+        "smart": ("Data/GameTile/connectivity_results_smart", "Data/GameTile/connectivity_results_smart_packed"),
+    }
+    for field in FIELDS:
+        for row in compare_runs(MANUAL_FILE, RUNS, field):
+            print(field, row)
@@ -0,0 +1,417 @@
+import os
+import json
+import shutil
+import numpy as np
+
+from IngestCache import save_json_atomic
+
+# A packed connectivity store is a folder holding one column file per field
+#   x.i2, y.i2    tile coordinates
+#   mask.u4       24-bit direction mask per tile (see below)
+#   meta.json     direction order, row count and the tileset table
+#   profile.u2    (count, 8, profile_depth) edge-transparency profiles, see
+#                 EdgeProfile.py; in stores written by FindConnectivity_4, whose
+#                 meta.json has "profile_depth" (json_to_store has no pixels to
+#                 profile, so its stores have none)
+# Every tileset is one contiguous run of rows sorted by (x, y), the order of
+# the tile_connectivity-<tileset>.json files, so (tileset, x, y) is looked up
+# with the tileset table plus a binary search inside the run.
+#
+# mask bits, one bit per direction in DIRECTIONS order:
+#   0-7    connectivity
+#   8-15   possible_connectivity
+#   16-23  edge_transparency
+
+X_FILE = "x.i2"
+Y_FILE = "y.i2"
+MASK_FILE = "mask.u4"
+META_FILE = "meta.json"
+PROFILE_FILE = "profile.u2"
+
+DIRECTIONS = ("right_top", "right_down", "left_top", "left_down", "top_left", "top_right", "down_left", "down_right")
+# key order of the "edge_transparency" dict in the JSON results
+TRANSPARENCY_ORDER = ("top_left", "top_right", "down_left", "down_right", "left_top", "left_down", "right_top", "right_down")
+
+CONNECTED_SHIFT = 0
+POSSIBLE_SHIFT = 8
+TRANSPARENT_SHIFT = 16
+
+# edges named by side, e.g. "right" covers right_top and right_down
+SIDES = ("right", "left", "top", "down")
+
+
+def direction_bits(directions):
+    """
+    Bitmask of a list of directions or sides, e.g. ["right"] or ["top_left", "down_right"].
+
+    Returns:
+    int: Mask over the 8 direction bits.
+    """
+    bits = 0
+    for direction in directions:
+        if direction in SIDES:
+            bits |= direction_bits([d for d in DIRECTIONS if d.startswith(direction + "_")])
+        else:
+            bits |= 1 << DIRECTIONS.index(direction)
+    return bits
+
+def encode_masks(connected, possible, transparent):
+    """
+    Pack per-direction boolean arrays into the 24-bit mask.
+
+    Parameters:
+    connected (dict): direction -> boolean array, all of the same shape.
+    possible (dict): direction -> boolean array.
+    transparent (dict): direction -> boolean array.
+
+    Returns:
+    numpy.ndarray: uint32 masks of the same shape.
+    """
+    mask = None
+    for bit, direction in enumerate(DIRECTIONS):
+        part = (np.asarray(connected[direction], dtype=np.uint32) << (CONNECTED_SHIFT + bit)) \
+            | (np.asarray(possible[direction], dtype=np.uint32) << (POSSIBLE_SHIFT + bit)) \
+            | (np.asarray(transparent[direction], dtype=np.uint32) << (TRANSPARENT_SHIFT + bit))
+        mask = part if mask is None else mask | part
+    return mask
+
+def encode_record(tile):
+    """
+    Mask of one JSON connectivity record.
+    """
+    transparency = tile.get("edge_transparency", {})
+    return (direction_bits(tile.get("connectivity", [])) << CONNECTED_SHIFT) \
+        | (direction_bits(tile.get("possible_connectivity", [])) << POSSIBLE_SHIFT) \
+        | (direction_bits([d for d in DIRECTIONS if transparency.get(d)]) << TRANSPARENT_SHIFT)
+
+def decode_record(x, y, mask):
+    """
+    Rebuild the JSON connectivity record of one tile.
+    """
+    mask = int(mask)
+    return {
+        "tile_x": int(x),
+        "tile_y": int(y),
+        "connectivity": [d for bit, d in enumerate(DIRECTIONS) if mask >> (CONNECTED_SHIFT + bit) & 1],
+        "possible_connectivity": [d for bit, d in enumerate(DIRECTIONS) if mask >> (POSSIBLE_SHIFT + bit) & 1],
+        "edge_transparency": {d: bool(mask >> (TRANSPARENT_SHIFT + DIRECTIONS.index(d)) & 1) for d in TRANSPARENCY_ORDER},
+    }
+
+def load_store_meta(store_path):
+    """
+    Read the meta.json of a connectivity store.
+
+    Returns:
+    dict: {"directions", "count", "tilesets": [{"name", "start", "count"}, ...]}, plus
+    "profile_depth" if the store holds edge profiles.
+    """
+    with open(os.path.join(store_path, META_FILE), "r") as f:
+        return json.load(f)
+
+
+class ConnectivityStoreWriter:
+    """
+    Append tilesets to a packed connectivity store.
+
+    Columns are streamed to their files as each tileset is added; meta.json is
+    written by flush() and close(), so readers only see complete tilesets.
+    With append=True an existing store is extended (re-adding a tileset name
+    shadows its earlier rows); otherwise it is overwritten. profile_depth
+    fixes whether every tileset carries edge profiles; appending to a store
+    written with another depth, or with or without profiles, raises ValueError.
+    """
+
+    def __init__(self, store_path, append=True, profile_depth=None):
+        self.store_path = store_path
+        self.profile_depth = profile_depth
+        os.makedirs(store_path, exist_ok=True)
+
+        if append and os.path.exists(os.path.join(store_path, META_FILE)):
+            meta = load_store_meta(store_path)
+            if tuple(meta["directions"]) != DIRECTIONS:
+                raise ValueError(f"store {store_path} uses direction order {meta['directions']}")
+            if meta["count"] and meta.get("profile_depth") != profile_depth:
+                raise ValueError(f"store {store_path} has profile depth {meta.get('profile_depth')}, "
+                                 f"{profile_depth} requested; delete it to rebuild")
+            self.tilesets = meta["tilesets"]
+            self.count = meta["count"]
+        else:
+            self.tilesets = []
+            self.count = 0
+
+        self.files = {}
+        for file_name, itemsize in ((X_FILE, 2), (Y_FILE, 2), (MASK_FILE, 4)):
+            self._open_column(file_name, itemsize)
+        if self.profile_depth is not None:
+            self._open_column(PROFILE_FILE, 2 * len(DIRECTIONS) * self.profile_depth)
+
+    def _open_column(self, file_name, itemsize):
+        column_file = open(os.path.join(self.store_path, file_name), "r+b" if self.count else "wb")
+        column_file.seek(self.count * itemsize)
+        column_file.truncate()
+        self.files[file_name] = column_file
+
+    def add_tileset(self, name, xs, ys, masks, profiles=None):
+        """
+        Append one tileset.
+
+        Parameters:
+        name (str): Tileset name.
+        xs (numpy.ndarray): Tile x of each row.
+        ys (numpy.ndarray): Tile y of each row.
+        masks (numpy.ndarray): 24-bit mask of each row, see encode_masks.
+        profiles (numpy.ndarray): (rows, 8, profile_depth) edge profiles, see EdgeProfile.edge_profile;
+        required exactly when the writer has a profile_depth.
+        """
+        xs = np.asarray(xs, dtype="<i2")
+        ys = np.asarray(ys, dtype="<i2")
+        masks = np.asarray(masks, dtype="<u4")
+        if (profiles is None) != (self.profile_depth is None):
+            raise ValueError(f"store {self.store_path} {'needs' if profiles is None else 'has no'} edge profiles")
+        if profiles is not None and np.shape(profiles)[1:] != (len(DIRECTIONS), self.profile_depth):
+            raise ValueError(f"profiles of shape {np.shape(profiles)} do not match depth {self.profile_depth}")
+
+        order = np.lexsort((ys, xs))
+        self.files[X_FILE].write(xs[order].tobytes())
+        self.files[Y_FILE].write(ys[order].tobytes())
+        self.files[MASK_FILE].write(masks[order].tobytes())
+        if profiles is not None:
+            self.files[PROFILE_FILE].write(np.asarray(profiles, dtype="<u2")[order].tobytes())
+
+        self.tilesets.append({"name": name, "start": self.count, "count": len(order)})
+        self.count += len(order)
+
+    def add_records(self, name, tiles):
+        """
+        Append one tileset from its list of JSON connectivity records.
+        """
+        self.add_tileset(name,
+                         [tile["tile_x"] for tile in tiles],
+                         [tile["tile_y"] for tile in tiles],
+                         [encode_record(tile) for tile in tiles])
+
+    def flush(self):
+        """
+        Make the tilesets added so far visible to readers.
+        """
+        for column_file in self.files.values():
+            column_file.flush()
+        meta = {"directions": list(DIRECTIONS), "count": self.count, "tilesets": self.tilesets}
+        if self.profile_depth is not None:
+            meta["profile_depth"] = self.profile_depth
+        save_json_atomic(meta, os.path.join(self.store_path, META_FILE))
+
+    def close(self):
+        self.flush()
+        for column_file in self.files.values():
+            column_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ConnectivityStore:
+    """
+    Read-only, memory-mapped view of a packed connectivity store.
+
+    Columns are mapped on first use, and only the rows a query touches are
+    read, so looking up one tileset does not parse the rest of the corpus.
+    """
+
+    def __init__(self, store_path):
+        self.store_path = store_path
+        meta = load_store_meta(store_path)
+        self.count = meta["count"]
+        # later entries shadow earlier ones with the same name
+        self.tilesets = {tileset["name"]: tileset for tileset in meta["tilesets"]}
+        self.tileset_names = list(self.tilesets)
+        self.profile_depth = meta.get("profile_depth")
+        self._columns = {}
+
+    def __len__(self):
+        return sum(tileset["count"] for tileset in self.tilesets.values())
+
+    @property
+    def shadowed_rows(self):
+        """
+        Rows of tilesets re-added later, which compact_store reclaims.
+        """
+        return self.count - len(self)
+
+    def __contains__(self, name):
+        return name in self.tilesets
+
+    def _column(self, file_name, dtype, row_shape=()):
+        if file_name not in self._columns:
+            if self.count:
+                self._columns[file_name] = np.memmap(os.path.join(self.store_path, file_name), dtype=dtype, mode="r", shape=(self.count,) + row_shape)
+            else:
+                self._columns[file_name] = np.empty((0,) + row_shape, dtype=dtype)
+        return self._columns[file_name]
+
+    @property
+    def x(self):
+        return self._column(X_FILE, "<i2")
+
+    @property
+    def y(self):
+        return self._column(Y_FILE, "<i2")
+
+    @property
+    def mask(self):
+        return self._column(MASK_FILE, "<u4")
+
+    @property
+    def profile(self):
+        """
+        (count, 8, profile_depth) edge-transparency profiles, or None if the store has none.
+        """
+        if self.profile_depth is None:
+            return None
+        return self._column(PROFILE_FILE, "<u2", (len(DIRECTIONS), self.profile_depth))
+
+    def tileset_rows(self, name):
+        """
+        Row range [start, stop) of a tileset.
+        """
+        tileset = self.tilesets[name]
+        return tileset["start"], tileset["start"] + tileset["count"]
+
+    def get_rows(self, name, xs, ys):
+        """
+        Row numbers of many tiles of one tileset, -1 where a tile has no record.
+
+        Parameters:
+        name (str): Tileset name.
+        xs (numpy.ndarray): Tile x values.
+        ys (numpy.ndarray): Tile y values.
+
+        Returns:
+        numpy.ndarray: int64 rows, same length as xs.
+        """
+        xs = np.asarray(xs, dtype=np.int64)
+        ys = np.asarray(ys, dtype=np.int64)
+        rows = np.full(len(xs), -1, dtype=np.int64)
+        if name not in self.tilesets:
+            return rows
+        start, stop = self.tileset_rows(name)
+        # rows are sorted by (x, y); combine both into one sortable key
+        keys = self.x[start:stop].astype(np.int64) * 65536 + self.y[start:stop]
+        query = xs * 65536 + ys
+        positions = np.minimum(np.searchsorted(keys, query), max(len(keys) - 1, 0))
+        if len(keys):
+            found = keys[positions] == query
+            rows[found] = start + positions[found]
+        return rows
+
+    def get_row(self, name, x, y):
+        """
+        Row number of tile (x, y) of a tileset, or None if the tile has no record.
+        """
+        row = int(self.get_rows(name, [x], [y])[0])
+        return row if row >= 0 else None
+
+    def get(self, name, x, y):
+        """
+        JSON connectivity record of one tile, or None.
+        """
+        row = self.get_row(name, x, y)
+        if row is None:
+            return None
+        return decode_record(self.x[row], self.y[row], self.mask[row])
+
+    def to_records(self, name):
+        """
+        All records of a tileset, as json.load of its tile_connectivity JSON would return them.
+        """
+        start, stop = self.tileset_rows(name)
+        return [decode_record(x, y, mask) for x, y, mask in zip(self.x[start:stop], self.y[start:stop], self.mask[start:stop])]
+
+    def find(self, tileset=None, connected=(), possible=(), solid=(), transparent=()):
+        """
+        Find tiles whose flags include all of the given directions.
+
+        Each argument takes direction names ("right_top") or sides ("right",
+        meaning both halves). solid is the complement of edge transparency,
+        e.g. find("000_001", solid=["right"]) lists the tiles of tileset
+        000_001 whose right edge is not transparent.
+
+        Parameters:
+        tileset (str): Restrict the search to one tileset; None searches all.
+        connected (list): Directions that must be connected.
+        possible (list): Directions that must be possible connections.
+        solid (list): Directions whose edge must not be transparent.
+        transparent (list): Directions whose edge must be transparent.
+
+        Returns:
+        list: (tileset, x, y) keys of the matching tiles.
+        """
+        required = (direction_bits(connected) << CONNECTED_SHIFT) \
+            | (direction_bits(possible) << POSSIBLE_SHIFT) \
+            | (direction_bits(transparent) << TRANSPARENT_SHIFT)
+        forbidden = direction_bits(solid) << TRANSPARENT_SHIFT
+
+        names = [tileset] if tileset is not None else self.tileset_names
+        matches = []
+        for name in names:
+            start, stop = self.tileset_rows(name)
+            masks = self.mask[start:stop]
+            hits = np.nonzero(((masks & required) == required) & ((masks & forbidden) == 0))[0] + start
+            matches.extend((name, int(self.x[row]), int(self.y[row])) for row in hits)
+        return matches
+
+
+def compact_store(store_path):
+    """
+    Rewrite a connectivity store with only the live rows of each tileset, dropping shadowed ones.
+
+    The compacted store is written next to the old one and swapped in when complete.
+
+    Returns:
+    int: Rows reclaimed.
+    """
+    store = ConnectivityStore(store_path)
+    reclaimed = store.shadowed_rows
+    if reclaimed == 0:
+        return 0
+    compact_path = store_path.rstrip("/\\") + ".compact"
+    old_path = store_path.rstrip("/\\") + ".old"
+    shutil.rmtree(compact_path, ignore_errors=True)
+    with ConnectivityStoreWriter(compact_path, append=False, profile_depth=store.profile_depth) as writer:
+        for name in store.tileset_names:
+            start, stop = store.tileset_rows(name)
+            profiles = store.profile[start:stop] if store.profile_depth is not None else None
+            writer.add_tileset(name, store.x[start:stop], store.y[start:stop], store.mask[start:stop], profiles)
+    del store
+    shutil.rmtree(old_path, ignore_errors=True)
+    os.replace(store_path, old_path)
+    os.replace(compact_path, store_path)
+    shutil.rmtree(old_path)
+    return reclaimed
+
+def json_to_store(json_folder, store_path, append=False):
+    """
+    Pack a folder of tile_connectivity-<tileset>.json files into a connectivity store.
+
+    Parameters:
+    json_folder (str): Folder written by FindConnectivity_4.
+    store_path (str): Output store folder.
+    append (bool): Extend an existing store instead of overwriting it.
+    """
+    with ConnectivityStoreWriter(store_path, append=append) as writer:
+        for fname in sorted(os.listdir(json_folder)):
+            if not (fname.startswith("tile_connectivity-") and fname.endswith(".json")):
+                continue
+            with open(os.path.join(json_folder, fname), "r") as f:
+                tiles = json.load(f)
+            writer.add_records(fname[len("tile_connectivity-"):-len(".json")], tiles)
+
+
+if __name__ == "__main__":
+    JSON_FOLDER = "Data/GameTile/connectivity_results_smart"
+    STORE_PATH = "Data/GameTile/connectivity_results_smart_packed"
+    json_to_store(JSON_FOLDER, STORE_PATH)
+    print(f"[SAVE] {len(ConnectivityStore(STORE_PATH))} tile records → {STORE_PATH}")
@@ -0,0 +1,188 @@
+import os
+import numpy as np
+from scipy import sparse
+from numpy.lib.format import open_memmap
+
+from CheckTileSimilarity import EdgeDescriptors, EDGE_SIDES
+from TileStore import TileStore, FLAG_TRANSPARENT
+
+# === Configurable Parameters ===
+TILE_STORE = "Data/GameTile/tile_store"
+OUTPUT_PATH = "Data/GameTile/edge_compatibility_topk.npz"
+TOP_K = 16
+CHUNK_SIZE = 512                # query tiles per block, bounds the (CHUNK_SIZE, N) score block
+SCORE_DTYPE = np.float16
+
+# direction of tile b as seen from tile a: (edge of a, facing edge of b)
+DIRECTIONS = {
+    "right": ("right", "left"),
+    "left": ("left", "right"),
+    "down": ("down", "top"),
+    "top": ("top", "down"),
+}
+
+
+def edge_incidence_matrix(tiles, side, chunk_size=CHUNK_SIZE):
+    """
+    Encode one edge of every tile as a sparse 0/1 row whose dot products are histogram intersections.
+
+    A count c in histogram bin (channel, value) becomes c ones in columns
+    (channel, value, 0..c-1), so for two rows the dot product is
+    sum(min(count_a, count_b)) over all bins. Empty edges (mostly alpha 0)
+    get an all-zero row, which scores 0 against everything, as in checkSimilarity.
+
+    Parameters:
+    tiles (numpy.ndarray): uint8 RGBA array of shape (N, T, T, 4); a memmap is read chunk by chunk.
+    side (str): One of EDGE_SIDES.
+    chunk_size (int): Tiles processed per step.
+
+    Returns:
+    scipy.sparse.csr_matrix: float32 matrix of shape (N, 4 * 256 * T).
+    """
+    count, tile_size = tiles.shape[0], tiles.shape[1]
+    side_index = EDGE_SIDES.index(side)
+    row_parts, col_parts = [], []
+    for start in range(0, count, chunk_size):
+        descriptors = EdgeDescriptors(tiles[start:start + chunk_size])
+        hist = descriptors.hist[:, side_index, 0].reshape(descriptors.count, -1).astype(np.int64)
+        hist[descriptors.empty[:, side_index]] = 0
+
+        rows, bins = np.nonzero(hist)
+        counts = hist[rows, bins]
+        # rank of each unit inside its bin: 0..count-1
+        ranks = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        row_parts.append(np.repeat(rows + start, counts))
+        col_parts.append(np.repeat(bins, counts) * tile_size + ranks)
+
+    rows = np.concatenate(row_parts) if row_parts else np.empty(0, dtype=np.int64)
+    cols = np.concatenate(col_parts) if col_parts else np.empty(0, dtype=np.int64)
+    data = np.ones(rows.size, dtype=np.float32)
+    return sparse.csr_matrix((data, (rows, cols)), shape=(count, 4 * 256 * tile_size))
+
+def top_k_rows(block, k):
+    """
+    Column positions and values of the k largest entries of each row, by decreasing value.
+    """
+    top = np.argpartition(-block, k - 1, axis=1)[:, :k]
+    top_scores = np.take_along_axis(block, top, axis=1)
+    order = np.argsort(-top_scores, axis=1, kind="stable")
+    return np.take_along_axis(top, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+
+def compatibility_topk(tiles, k=TOP_K, chunk_size=CHUNK_SIZE, score_dtype=SCORE_DTYPE, dense_path=None):
+    """
+    Score every tile's edges against every other tile's facing edge and keep the top k per direction.
+
+    The score is the one-line colour similarity of checkSimilarity (mean
+    per-channel histogram intersection of the touching pixel lines), computed
+    as sparse matrix products in blocks of chunk_size query tiles, so memory
+    stays at O(chunk_size * N) regardless of corpus size. Only the right and
+    down products are computed; left and top are their transposes.
+
+    Parameters:
+    tiles (numpy.ndarray): uint8 RGBA array of shape (N, T, T, 4).
+    k (int): Neighbours kept per tile and direction.
+    chunk_size (int): Query tiles per block.
+    score_dtype (numpy.dtype): Storage type of the scores (float16 or float32).
+    dense_path (str): If set, also write the full (4, N, N) score matrix as a .npy memmap in score_dtype.
+
+    Returns:
+    tuple: (indices, scores), both of shape (4, N, k) in DIRECTIONS order; indices are tile rows,
+    sorted by decreasing score.
+    """
+    count, tile_size = tiles.shape[0], tiles.shape[1]
+    k = min(k, count)
+    indices = np.empty((len(DIRECTIONS), count, k), dtype=np.int32)
+    scores = np.empty((len(DIRECTIONS), count, k), dtype=score_dtype)
+    dense = open_memmap(dense_path, mode="w+", dtype=score_dtype, shape=(len(DIRECTIONS), count, count)) if dense_path else None
+
+    incidence = {side: edge_incidence_matrix(tiles, side, chunk_size) for side in EDGE_SIDES}
+    normalizer = 4.0 * tile_size
+
+    # left and top scores are the transposes of right and down (the same incidence
+    # products with the operands swapped), so each product is computed once and its
+    # transposed block is merged into a running top-k of the reverse direction
+    names = list(DIRECTIONS)
+    for name, reverse in (("right", "left"), ("down", "top")):
+        d, r = names.index(name), names.index(reverse)
+        edge, facing = DIRECTIONS[name]
+        facing_t = incidence[facing].T.tocsc()
+        reverse_indices = np.full((count, k), -1, dtype=np.int64)
+        reverse_scores = np.full((count, k), -np.inf, dtype=np.float32)
+        for start in range(0, count, chunk_size):
+            stop = min(start + chunk_size, count)
+            block = (incidence[edge][start:stop] @ facing_t).toarray()
+            block /= normalizer
+            if dense is not None:
+                dense[d, start:stop] = block
+                dense[r, :, start:stop] = block.T
+
+            top, top_scores = top_k_rows(block, k)
+            indices[d, start:stop] = top
+            scores[d, start:stop] = top_scores
+
+            # block.T holds the reverse scores of every tile against tiles start..stop-1
+            candidates = np.concatenate([reverse_indices, np.broadcast_to(np.arange(start, stop), (count, stop - start))], axis=1)
+            top, reverse_scores = top_k_rows(np.concatenate([reverse_scores, block.T], axis=1), k)
+            reverse_indices = np.take_along_axis(candidates, top, axis=1)
+        indices[r] = reverse_indices
+        scores[r] = reverse_scores
+        print(f"[INFO] {name} and {reverse} edges scored for {count} tiles")
+
+    if dense is not None:
+        dense.flush()
+    return indices, scores
+
+def save_topk_index(output_path, keys, indices, scores):
+    """
+    Save a top-k neighbour index.
+
+    Parameters:
+    output_path (str): .npz path.
+    keys (list): (tileset, x, y) of every tile row.
+    indices (numpy.ndarray): (4, N, k) neighbour rows.
+    scores (numpy.ndarray): (4, N, k) scores.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    tilesets = np.array([key[0] for key in keys])
+    coords = np.array([(key[1], key[2]) for key in keys], dtype=np.int32).reshape(-1, 2)
+    np.savez(output_path, tilesets=tilesets, coords=coords, indices=indices, scores=scores,
+             directions=np.array(list(DIRECTIONS)))
+
+def load_topk_index(index_path):
+    """
+    Load a top-k neighbour index saved by save_topk_index.
+
+    Returns:
+    dict: {"keys": [(tileset, x, y)], "indices", "scores", "directions"}
+    """
+    with np.load(index_path) as data:
+        keys = [(str(tileset), int(x), int(y)) for tileset, (x, y) in zip(data["tilesets"], data["coords"])]
+        return {"keys": keys, "indices": data["indices"], "scores": data["scores"],
+                "directions": [str(direction) for direction in data["directions"]]}
+
+def load_store_tiles(store_path):
+    """
+    Collect the non-transparent tiles of a tile store, skipping rows of re-added (shadowed) tilesets.
+
+    Returns:
+    tuple: (tiles array of shape (N, T, T, 4), keys list of (tileset, x, y))
+    """
+    store = TileStore(store_path)
+    rows, keys = [], []
+    for name in store.tileset_names:
+        tileset = store.tilesets[name]
+        start = tileset["start"]
+        stop = start + tileset["rows"] * tileset["cols"]
+        keep = np.nonzero((store.index["flags"][start:stop] & FLAG_TRANSPARENT) == 0)[0] + start
+        rows.append(keep)
+        keys.extend((name, int(store.index["x"][row]), int(store.index["y"][row])) for row in keep)
+    rows = np.concatenate(rows) if rows else np.empty(0, dtype=np.int64)
+    return store.tiles[rows], keys
+
+
+if __name__ == "__main__":
+    tiles, keys = load_store_tiles(TILE_STORE)
+    print(f"[INFO] {len(keys)} non-transparent tiles in {TILE_STORE}")
+    indices, scores = compatibility_topk(tiles, TOP_K, CHUNK_SIZE, SCORE_DTYPE)
+    save_topk_index(OUTPUT_PATH, keys, indices, scores)
+    print(f"[SAVE] Top-{TOP_K} edge compatibility index → {OUTPUT_PATH}")
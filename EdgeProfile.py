@@ -0,0 +1,94 @@
+import numpy as np
+
+from ConnectivityStore import DIRECTIONS, TRANSPARENCY_ORDER
+
+# Edge-transparency profile of a tile: for each of the 8 half-edge sections
+# (DIRECTIONS order) and each depth d, the number of alpha-0 pixels in the d
+# lines nearest the edge, as a cumulative sum over the lines. The transparency
+# ratio of check_edge_transparency for any EDGE_CHECK_ROWS is one lookup in
+# the profile, so thresholds and check depths can change without reading the
+# pixels again.
+
+# check_edge_transparency sections: (half of the tile along the edge, axis
+# summed across a line, whether lines count from the far side). Half 0 is the
+# first half of the other axis, 1 the second.
+PROFILE_SECTIONS = {
+    "right_top": (0, -1, True),
+    "right_down": (1, -1, True),
+    "left_top": (0, -1, False),
+    "left_down": (1, -1, False),
+    "top_left": (0, -2, False),
+    "top_right": (1, -2, False),
+    "down_left": (0, -2, True),
+    "down_right": (1, -2, True),
+}
+
+
+def edge_profile(alpha_zero, depth=None):
+    """
+    Cumulative alpha-0 counts of every edge section, from the edge inwards.
+
+    Parameters:
+    alpha_zero (numpy.ndarray): (..., T, T) boolean, True where alpha is 0.
+    depth (int): Lines kept per section; defaults to T.
+
+    Returns:
+    numpy.ndarray: uint16 array of shape (..., 8, depth) in DIRECTIONS order; entry d - 1 is
+    the alpha-0 count of the d lines nearest the edge.
+    """
+    tile_size = alpha_zero.shape[-1]
+    half = tile_size // 2
+    depth = tile_size if depth is None else depth
+    profiles = []
+    for direction in DIRECTIONS:
+        half_index, axis, from_end = PROFILE_SECTIONS[direction]
+        part = slice(None, half) if half_index == 0 else slice(half, None)
+        section = alpha_zero[..., :, part] if axis == -1 else alpha_zero[..., part, :]
+        counts = section.sum(axis=axis, dtype=np.uint16)
+        if from_end:
+            counts = counts[..., ::-1]
+        profiles.append(np.cumsum(counts[..., :depth], axis=-1, dtype=np.uint16))
+    return np.stack(profiles, axis=-2)
+
+def transparency_ratios(profile, edge_check_rows, tile_size):
+    """
+    Alpha-0 fraction of every edge section checked edge_check_rows lines deep.
+
+    Parameters:
+    profile (numpy.ndarray): edge_profile output with depth >= edge_check_rows.
+    edge_check_rows (int): Lines per section.
+    tile_size (int): Tile side length T; a section is T // 2 pixels wide.
+
+    Returns:
+    numpy.ndarray: float64 array of shape (..., 8).
+    """
+    if edge_check_rows > profile.shape[-1]:
+        raise ValueError(f"profile holds {profile.shape[-1]} lines, {edge_check_rows} requested")
+    return profile[..., edge_check_rows - 1] / ((tile_size // 2) * edge_check_rows)
+
+def transparent_sections(profile, has_alpha, transparency_threshold, edge_check_rows, tile_size):
+    """
+    check_edge_transparency for profiles: a section is transparent if its ratio exceeds the threshold.
+
+    Parameters:
+    profile (numpy.ndarray): edge_profile output.
+    has_alpha (numpy.ndarray): Whether each tile had an alpha channel; tiles without one have no transparent edges.
+    transparency_threshold (float): Alpha-0 fraction above which a section is transparent.
+    edge_check_rows (int): Lines per section.
+    tile_size (int): Tile side length.
+
+    Returns:
+    numpy.ndarray: Boolean array of shape (..., 8) in DIRECTIONS order.
+    """
+    ratio = transparency_ratios(profile, edge_check_rows, tile_size)
+    return (ratio > transparency_threshold) & np.asarray(has_alpha)[..., np.newaxis]
+
+def tile_edge_transparency(tile, transparency_threshold, edge_check_rows):
+    """
+    The edge_transparency dict of one cv2 tile, keyed in TRANSPARENCY_ORDER.
+    """
+    has_alpha = tile.ndim == 3 and tile.shape[-1] == 4
+    alpha_zero = tile[..., 3] == 0 if has_alpha else np.zeros(tile.shape[:2], dtype=bool)
+    profile = edge_profile(alpha_zero, edge_check_rows)
+    transparent = transparent_sections(profile, has_alpha, transparency_threshold, edge_check_rows, tile.shape[0])
+    return {direction: bool(transparent[DIRECTIONS.index(direction)]) for direction in TRANSPARENCY_ORDER}
@@ -1,6 +1,9 @@
 import cv2
 import numpy as np
 import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from CheckTileSimilarity import tile_grid_view
+from TileStore import TileStoreWriter
 
 
 tileset_folder = "Data/GameTile/small_Tilesets/"
@@ -8,10 +11,12 @@ tileset_name = "001_001.png"
 tile_size = 32
 out_folder = "Data/GameTile/small_Segmenets/"
 
+NUM_WORKERS = os.cpu_count() or 1
+ENCODE_THREADS = 4  # PNG encoder threads of a single extract_objects call; 1 inside the process pool
+MERGE_OVERLAPS = True  # merge snapped boxes that share tiles into one object
+WRITE_PNG = True  # object_<x>_<y>_<w>_<h>.png crops per tileset
+OBJECT_STORE = None  # e.g. "Data/GameTile/small_Segmenets_packed": also pack every crop as one tileset of a tile store
 
-import cv2
-import numpy as np
-import os
 
 def adjust_bounding_box(box, step=32):
     x, y, w, h = box
@@ -27,13 +32,106 @@ def save_cropped_image(image, box, output_dir):
     output_path = os.path.join(output_dir, f'object_{x}_{y}_{w}_{h}.png')
     cv2.imwrite(output_path, cropped_image)
 
-def extract_objects(image_path, output_base_dir):
+def foreground_mask(image):
+    """
+    Object pixels of a tileset: alpha > 0, or gray > 1 for images without alpha.
+    """
+    if image.ndim == 3 and image.shape[2] == 4:
+        return image[:, :, 3] > 0
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    return gray > 1
+
+def component_boxes(mask):
+    """
+    Bounding boxes (x, y, w, h) of the 8-connected components of a boolean mask.
+    """
+    _, _, stats, _ = cv2.connectedComponentsWithStats(mask.astype(np.uint8), connectivity=8)
+    return stats[1:, :4]  # row 0 is the background
+
+def snap_boxes(boxes, step=32):
+    """
+    Grow (x, y, w, h) boxes to the tile grid.
+
+    Returns:
+    numpy.ndarray: (N, 4) int array of (x0, y0, x1, y1) multiples of step covering each box.
+    """
+    boxes = np.asarray(boxes, dtype=np.int64).reshape(-1, 4)
+    x0 = boxes[:, 0] // step * step
+    y0 = boxes[:, 1] // step * step
+    x1 = -(-(boxes[:, 0] + boxes[:, 2]) // step) * step
+    y1 = -(-(boxes[:, 1] + boxes[:, 3]) // step) * step
+    return np.stack([x0, y0, x1, y1], axis=1)
+
+def merge_overlapping_boxes(boxes):
+    """
+    Merge (x0, y0, x1, y1) boxes that overlap into their union, until no two boxes overlap.
+
+    Each pass sweeps the boxes by x0, keeping the boxes whose x range is still
+    open, and joins overlapping pairs with a union-find.
+
+    Returns:
+    numpy.ndarray: Merged boxes sorted by (y0, x0).
+    """
+    boxes = np.unique(np.asarray(boxes, dtype=np.int64).reshape(-1, 4), axis=0)
+    while len(boxes) > 1:
+        parent = np.arange(len(boxes))
+
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        active = []
+        for i in np.argsort(boxes[:, 0], kind="stable"):
+            x0, y0, _, y1 = boxes[i]
+            active = [j for j in active if boxes[j, 2] > x0]
+            for j in active:
+                if boxes[j, 1] < y1 and y0 < boxes[j, 3]:
+                    parent[find(i)] = find(j)
+            active.append(i)
+
+        _, groups = np.unique([find(i) for i in range(len(boxes))], return_inverse=True)
+        if groups.max() + 1 == len(boxes):
+            break
+        merged = np.empty((groups.max() + 1, 4), dtype=np.int64)
+        merged[:, :2] = np.iinfo(np.int64).max
+        merged[:, 2:] = np.iinfo(np.int64).min
+        np.minimum.at(merged[:, 0], groups, boxes[:, 0])
+        np.minimum.at(merged[:, 1], groups, boxes[:, 1])
+        np.maximum.at(merged[:, 2], groups, boxes[:, 2])
+        np.maximum.at(merged[:, 3], groups, boxes[:, 3])
+        boxes = merged
+    return boxes[np.lexsort((boxes[:, 0], boxes[:, 1]))]
+
+def object_boxes(image, step=32, merge=MERGE_OVERLAPS):
+    """
+    Tile-snapped (x0, y0, x1, y1) object boxes of a tileset image, without duplicates.
+    """
+    boxes = snap_boxes(component_boxes(foreground_mask(image)), step)
+    if merge:
+        return merge_overlapping_boxes(boxes)
+    boxes = np.unique(boxes, axis=0)
+    return boxes[np.lexsort((boxes[:, 0], boxes[:, 1]))]
+
+def extract_objects(image_path, output_base_dir, write_png=WRITE_PNG, return_crops=False, step=32, encode_threads=ENCODE_THREADS):
+    """
+    Crop the objects of one tileset: connected components of its alpha channel, snapped to the tile grid.
+
+    Parameters:
+    image_path (str): Tileset image.
+    output_base_dir (str): Crops go to <output_base_dir>/out_<tileset>/object_<x>_<y>_<w>_<h>.png.
+    write_png (bool): Write the crops.
+    return_crops (bool): Also return the crop arrays, e.g. for a packed store.
+    step (int): Tile size.
+    encode_threads (int): Threads encoding the crops; 1 encodes them serially.
+
+    Returns:
+    tuple: (tileset name, (N, 4) boxes as (x0, y0, x1, y1), list of crops or None), or None if the image cannot be read.
+    """
     # Extract tileset name from image path
     tileset_name = os.path.splitext(os.path.basename(image_path))[0]
     output_dir = os.path.join(output_base_dir, f'out_{tileset_name}')
-    
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
 
     # Load the image
     image = cv2.imread(image_path, cv2.IMREAD_UNCHANGED)
@@ -41,31 +139,63 @@ def extract_objects(image_path, output_base_dir):
     # Check if the image is loaded successfully
     if image is None:
         print(f"Error: Unable to load image at {image_path}")
-        return
-
-    # Convert to grayscale
-    gray = cv2.cvtColor(image, cv2.COLOR_BGRA2GRAY)
-
-    # Apply binary threshold
-    _, thresh = cv2.threshold(gray, 1, 255, cv2.THRESH_BINARY)
-
-    # Find contours
-    contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-
-    # Loop through contours and create bounding boxes
-    for contour in contours:
-        x, y, w, h = cv2.boundingRect(contour)
-        adjusted_box = adjust_bounding_box((x, y, w, h))
-        save_cropped_image(image, adjusted_box, output_dir)
-
-def process_tileset_images(input_folder, output_base_dir):
-    # Process each image in the input folder
-    for filename in os.listdir(input_folder):
-        if filename.endswith('.png'):
-            image_path = os.path.join(input_folder, filename)
-            extract_objects(image_path, output_base_dir)
-
-# Example usage
-input_folder =  tileset_folder  # Replace with your input folder path containing tileset images
-output_base_dir = out_folder  # Base directory to save the cropped images
-process_tileset_images(input_folder, output_base_dir)
\ No newline at end of file
+        return None
+
+    boxes = object_boxes(image, step)
+    crops = [image[y0:y1, x0:x1] for x0, y0, x1, y1 in boxes]
+
+    if write_png:
+        os.makedirs(output_dir, exist_ok=True)
+        paths = [os.path.join(output_dir, f'object_{x0}_{y0}_{x1 - x0}_{y1 - y0}.png') for x0, y0, x1, y1 in boxes]
+        if encode_threads > 1:
+            # cv2.imwrite releases the GIL, so the crops are encoded in parallel
+            with ThreadPoolExecutor(max_workers=encode_threads) as executor:
+                list(executor.map(cv2.imwrite, paths, crops))
+        else:
+            for path, crop in zip(paths, crops):
+                cv2.imwrite(path, crop)
+    return tileset_name, boxes, (crops if return_crops else None)
+
+def crop_to_tiles(crop, step=32):
+    """
+    An object crop as an RGBA (rows, cols, step, step, 4) tile grid for a TileStore.
+    """
+    if crop.ndim == 2:
+        crop = cv2.cvtColor(crop, cv2.COLOR_GRAY2BGRA)
+    elif crop.shape[2] == 3:
+        crop = cv2.cvtColor(crop, cv2.COLOR_BGR2BGRA)
+    return tile_grid_view(cv2.cvtColor(crop, cv2.COLOR_BGRA2RGBA), step)
+
+def process_tileset_images(input_folder, output_base_dir, num_workers=NUM_WORKERS, store_path=OBJECT_STORE, step=32):
+    """
+    Extract the objects of every tileset in a folder over a process pool.
+
+    With store_path set, every object is also added to a packed tile store as
+    its own tileset named "<tileset>/object_<x>_<y>_<w>_<h>". The processes
+    already use every core, so each one encodes its crops serially.
+    """
+    image_paths = [os.path.join(input_folder, filename) for filename in sorted(os.listdir(input_folder)) if filename.endswith('.png')]
+    writer = TileStoreWriter(store_path, step, append=False) if store_path else None
+    try:
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            jobs = executor.map(extract_objects, image_paths, [output_base_dir] * len(image_paths),
+                                [WRITE_PNG] * len(image_paths), [writer is not None] * len(image_paths),
+                                [step] * len(image_paths), [1] * len(image_paths))
+            for result in jobs:
+                if result is None:
+                    continue
+                tileset_name, boxes, crops = result
+                print(f"[SAVE] {tileset_name}: {len(boxes)} objects")
+                if writer is not None:
+                    for (x0, y0, x1, y1), crop in zip(boxes, crops):
+                        writer.add_tileset(f"{tileset_name}/object_{x0}_{y0}_{x1 - x0}_{y1 - y0}", crop_to_tiles(crop, step))
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+if __name__ == "__main__":
+    # Example usage
+    input_folder =  tileset_folder  # Replace with your input folder path containing tileset images
+    output_base_dir = out_folder  # Base directory to save the cropped images
+    process_tileset_images(input_folder, output_base_dir)
@@ -1,9 +1,9 @@
-import torch
 import numpy as np
 import cv2
-from PIL import Image
-from segment_anything import sam_model_registry, SamAutomaticMaskGenerator
 import os
+from SamSession import get_session, load_image_rgb
+from CheckTileSimilarity import is_almost_transparent_batch, tile_grid_view
+from TileStore import TileStore, FLAG_TRANSPARENT
 
 
 tileset_folder = "Data/GameTile/small_Tilesets/"
@@ -15,6 +15,12 @@ from huggingface_hub import hf_hub_download
 
 chkpt_path = hf_hub_download("ybelkada/segment-anything", "checkpoints/sam_vit_b_01ec64.pth")
 chkpt_path_2 = "Data/sam_vit_h_4b8939.pth" 
+sam_preset = "balanced"  # SamSession.SAM_PRESETS: "fast", "balanced" or "quality"
+sam_threads = None  # torch CPU threads, None for the torch default
+prompt_mode = "auto"  # "auto": SAM's dense point grid, "grid": one point prompt per non-transparent tile
+tile_store_folder = None  # e.g. "Data/GameTile/small_dataset" to take tile transparency from <tileset>_packed stores
+transparency_threshold = 0.95  # as SliceTiles: a tile is transparent if this share of pixels ...
+alpha_threshold = 10  # ... has alpha at or below this
 
 
 def adjust_bounding_box(box, step=32):
@@ -31,53 +37,111 @@ def save_cropped_image(image, box, output_dir, index):
     output_path = os.path.join(output_dir, f'object_{x}_{y}_{w}_{h}_{index}.png')
     cv2.imwrite(output_path, cropped_image)
 
-def segment_and_save_objects(image_path, output_dir, model_type='vit_h'):
+def opaque_cells(image, tileset_name, tile_size=32):
+    """
+    Tiles of a sheet that hold content, as SliceTiles decides: the transparency flags of the
+    tileset's packed store if there is one, otherwise the alpha channel.
+
+    Returns:
+    numpy.ndarray: Boolean (rows, cols) grid, True for non-transparent tiles.
+    """
+    rows, cols = -(-image.shape[0] // tile_size), -(-image.shape[1] // tile_size)
+    store_path = os.path.join(tile_store_folder, f"{tileset_name}_packed") if tile_store_folder else None
+    if store_path and os.path.exists(store_path):
+        store = TileStore(store_path)
+        if tileset_name in store:
+            return (store.get_flags(tileset_name) & FLAG_TRANSPARENT) == 0
+    if image.ndim != 3 or image.shape[2] != 4:
+        return np.ones((rows, cols), dtype=bool)
+    return ~is_almost_transparent_batch(tile_grid_view(image, tile_size), transparency_threshold, alpha_threshold)
+
+def grid_prompt_points(cells, tile_size=32):
+    """
+    Pixel centres (x, y) of the True cells of a tile grid.
+    """
+    ys, xs = np.nonzero(cells)
+    return np.stack([xs * tile_size + tile_size / 2, ys * tile_size + tile_size / 2], axis=1)
+
+def dedupe_masks(masks, step=32):
+    """
+    Keep one mask per snapped bounding box, the one with the highest predicted IoU, in the original order.
+    """
+    if not masks:
+        return masks
+    boxes = np.array([adjust_bounding_box(cv2.boundingRect(mask['segmentation'].astype(np.uint8)), step) for mask in masks])
+    scores = np.array([mask.get('predicted_iou', 0.0) for mask in masks])
+    order = np.argsort(-scores, kind="stable")
+    _, first = np.unique(boxes[order], axis=0, return_index=True)
+    return [masks[i] for i in np.sort(order[first])]
+
+def generate_tileset_masks(session, image, image_rgb, image_path, mode=None, tile_size=32):
+    """
+    SAM masks of one tileset.
+
+    In "auto" mode these are the automatic generator's masks, unchanged. In
+    "grid" mode SAM is prompted with one point at the centre of every
+    non-transparent tile instead of its dense automatic grid, so transparent
+    areas cost no decoder calls; neighbouring tiles of one object give the
+    same mask, so grid masks are deduplicated by snapped box.
+    """
+    mode = mode or prompt_mode
+    if mode != "grid":
+        return session.generate(image_rgb)
+    tileset_name = os.path.splitext(os.path.basename(image_path))[0]
+    points = grid_prompt_points(opaque_cells(image, tileset_name, tile_size), tile_size)
+    session.set_image(image_rgb, os.path.abspath(image_path))
+    return dedupe_masks(session.predict_points(points), tile_size)
+
+def segment_and_save_objects(image_path, output_dir, model_type='vit_h', session=None):
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
     # Load the image
-    image = cv2.imread(image_path, cv2.IMREAD_UNCHANGED)
+    image, image_rgb = load_image_rgb(image_path)
     if image is None:
         print(f"Error: Unable to load image at {image_path}")
         return
 
-    # Load SAM model
-    sam_checkpoint_path = chkpt_path_2  # Replace with the actual path to your SAM checkpoint file
-    sam = sam_model_registry[model_type](checkpoint=sam_checkpoint_path)
-    sam.to(device='cuda' if torch.cuda.is_available() else 'cpu')
-
-    # Prepare the image for SAM
-    image_rgb = cv2.cvtColor(image, cv2.COLOR_BGRA2RGB)
-    image_pil = Image.fromarray(image_rgb)
-    image_tensor = torch.from_numpy(np.array(image_pil)).permute(2, 0, 1).unsqueeze(0).float()
+    # SAM model, loaded once per process
+    if session is None:
+        session = get_session(chkpt_path_2, model_type, sam_preset, sam_threads)
 
     # Generate masks
-    mask_generator = SamAutomaticMaskGenerator(sam)
-    masks = mask_generator.generate(image_rgb)  # Updated to pass the numpy array directly
+    masks = generate_tileset_masks(session, image, image_rgb, image_path)
+    save_masks(image, masks, output_dir)
 
+def save_masks(image, masks, output_dir):
     # Process each mask
     for i, mask in enumerate(masks):
         x, y, w, h = cv2.boundingRect(mask['segmentation'].astype(np.uint8))
         adjusted_box = adjust_bounding_box((x, y, w, h))
         save_cropped_image(image, adjusted_box, output_dir, i)
 
-def process_tileset_images(input_folder, output_base_dir, model_type='vit_h', tile_size=32):
-    # Process each image in the input folder
-    for filename in os.listdir(input_folder):
-        if filename.endswith('.png'):
-            image_path = os.path.join(input_folder, filename)
-            tileset_name = os.path.splitext(filename)[0]
-            output_dir = os.path.join(output_base_dir, tileset_name)
-            segment_and_save_objects(image_path, output_dir, model_type)
-
-
-# Example usage
-image_path = tileset_folder  # Replace with your image path
-output_dir = out_folder  # Directory to save the cropped images
-segment_and_save_objects(image_path, output_dir)
-
-# Example usage
-input_folder = tileset_folder # Replace with your input folder path containing tileset images
-output_base_dir = out_folder  # Base directory to save the cropped images
-model_type = 'vit_h'  # Specify the model type
-process_tileset_images(input_folder, output_base_dir, model_type)
\ No newline at end of file
+def process_tileset_images(input_folder, output_base_dir, model_type='vit_h', tile_size=32, session=None):
+    # One session segments the whole queue of tilesets
+    if session is None:
+        session = get_session(chkpt_path_2, model_type, sam_preset, sam_threads)
+    image_paths = [os.path.join(input_folder, filename) for filename in os.listdir(input_folder) if filename.endswith('.png')]
+
+    def segment(image_path, image, image_rgb):
+        return generate_tileset_masks(session, image, image_rgb, image_path, tile_size=tile_size)
+
+    def save(image_path, image, masks):
+        output_dir = os.path.join(output_base_dir, os.path.splitext(os.path.basename(image_path))[0])
+        os.makedirs(output_dir, exist_ok=True)
+        save_masks(image, masks, output_dir)
+
+    session.process_queue(image_paths, save, segment)
+
+
+if __name__ == "__main__":
+    # Example usage
+    image_path = tileset_folder  # Replace with your image path
+    output_dir = out_folder  # Directory to save the cropped images
+    segment_and_save_objects(image_path, output_dir)
+
+    # Example usage
+    input_folder = tileset_folder # Replace with your input folder path containing tileset images
+    output_base_dir = out_folder  # Base directory to save the cropped images
+    model_type = 'vit_h'  # Specify the model type
+    process_tileset_images(input_folder, output_base_dir, model_type)
@@ -2,7 +2,7 @@ import os
 import cv2
 import numpy as np
 import json
-from skimage.metrics import structural_similarity as ssim
+from BatchSimilarity import batch_edge_score
 
 # Configuration - Change these paths as needed
 TILESET_FOLDER = "Data/GameTile/sub_small_Tilesets"
@@ -49,11 +49,6 @@ def load_tile(tileset_id, x, y):
         return cv2.imread(tile_path, cv2.IMREAD_UNCHANGED)
     return None
 
-def mse(imageA, imageB):
-    err = np.sum((imageA.astype("float") - imageB.astype("float")) ** 2)
-    err /= float(imageA.shape[0] * imageA.shape[1])
-    return 1 - (err / 255.0)
-
 def compare_edges(tile1, tile2, direction):
     if tile1 is None or tile2 is None:
         return 0
@@ -79,16 +74,8 @@ def compare_edges(tile1, tile2, direction):
     edge1_gray = cv2.cvtColor(np.expand_dims(edge1, axis=0), cv2.COLOR_BGR2GRAY)
     edge2_gray = cv2.cvtColor(np.expand_dims(edge2, axis=0), cv2.COLOR_BGR2GRAY)
 
-    min_dim = min(edge1_gray.shape[0], edge1_gray.shape[1])
-    win_size = min(7, min_dim)
-    if win_size % 2 == 0:
-        win_size -= 1  
-
-    if win_size < 3:
-        return mse(edge1_gray, edge2_gray)
-
-    similarity = ssim(edge1_gray, edge2_gray, win_size=win_size, channel_axis=None)
-    return similarity
+    # SSIM with the largest odd window that fits, MSE for 1-pixel strips
+    return batch_edge_score(edge1_gray[np.newaxis], edge2_gray[np.newaxis])[0]
 
 # Analyze connectivity
 results = []
@@ -2,7 +2,8 @@ import os
 import cv2
 import numpy as np
 import json
-from skimage.metrics import structural_similarity as ssim
+from BatchSimilarity import batch_edge_score
+from IngestCache import IngestCache, file_stats
 
 # Configuration
 TILESET_FOLDER = "Data/GameTile/small_Tilesets"
@@ -47,11 +48,6 @@ def load_tile(tileset_id, x, y):
         return cv2.imread(tile_path, cv2.IMREAD_UNCHANGED)
     return None
 
-def mse(imageA, imageB):
-    err = np.sum((imageA.astype("float") - imageB.astype("float")) ** 2)
-    err /= float(imageA.shape[0] * imageA.shape[1])
-    return 1 - (err / 255.0)
-
 def compare_edges(tile1, tile2, direction):
     if tile1 is None or tile2 is None:
         return 0
@@ -77,22 +73,25 @@ def compare_edges(tile1, tile2, direction):
     edge1_gray = cv2.cvtColor(np.expand_dims(edge1, axis=0), cv2.COLOR_BGR2GRAY)
     edge2_gray = cv2.cvtColor(np.expand_dims(edge2, axis=0), cv2.COLOR_BGR2GRAY)
 
-    min_dim = min(edge1_gray.shape[0], edge1_gray.shape[1])
-    win_size = min(7, min_dim)
-    if win_size % 2 == 0:
-        win_size -= 1  
-
-    if win_size < 3:
-        return mse(edge1_gray, edge2_gray)
-
-    similarity = ssim(edge1_gray, edge2_gray, win_size=win_size, channel_axis=None)
-    return similarity
+    # SSIM with the largest odd window that fits, MSE for 1-pixel strips
+    return batch_edge_score(edge1_gray[np.newaxis], edge2_gray[np.newaxis])[0]
 
 # Process each tileset separately
+cache = IngestCache()
+connectivity_params = {"tile_size": TILE_SIZE, "ssim_threshold": THRESHOLD, "transparency_threshold": TRANSPARENCY_THRESHOLD, "edge_check_rows": EDGE_CHECK_ROWS}
+
 for tileset in tileset_images:
     tileset_id = os.path.splitext(tileset)[0]  # Extract ID (e.g., "000_001")
-
+    tileset_path = os.path.join(TILESET_FOLDER, tileset)
+    output_file = os.path.join(OUTPUT_FOLDER, f"tile_connectivity-{tileset_id}.json")
     tileset_folder = os.path.join(SPLIT_TILE_FOLDER, tileset_id)
+    # the sliced tiles are read, not the sheet, so re-sliced tiles make the tileset dirty too
+    tile_paths = sorted(os.path.join(tileset_folder, f) for f in os.listdir(tileset_folder)
+                        if f.startswith("tiles_") and f.endswith(".png")) if os.path.exists(tileset_folder) else []
+    params = dict(connectivity_params, tiles=file_stats(tile_paths))
+    if cache.is_fresh(tileset_path, "connectivity", params):
+        print(f"[SKIP] Up to date: {tileset_id}")
+        continue
 
     print(f"[INFO] Processing tileset: {tileset_id}")
     print(f"        -> tileset folder exists: {os.path.exists(tileset_folder)}")
@@ -152,9 +151,10 @@ for tileset in tileset_images:
     # Save each tileset's result separately
 
 
-    output_file = os.path.join(OUTPUT_FOLDER, f"tile_connectivity-{tileset_id}.json")
     print(f"[SAVE] Writing results to {output_file} with {len(results)} tiles.")
     with open(output_file, "w") as json_file:
         json.dump(results, json_file, indent=4, default=lambda x: bool(x) if isinstance(x, np.bool_) else x)
+    cache.record(tileset_path, "connectivity", params, [output_file])
+    cache.save()  # after every tileset, so an interrupted run keeps the finished ones
 
 print("All tileset connectivity files saved.")
@@ -2,40 +2,31 @@ import os
 import cv2
 import numpy as np
 import json
-from skimage.metrics import structural_similarity as ssim
+from BatchSimilarity import batch_edge_score
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from IngestCache import IngestCache, file_stats, save_json_atomic, stage_key
+from TileStore import TileStore, FLAG_TRANSPARENT, TILES_FILE, INDEX_FILE, META_FILE
+from ConnectivityStore import ConnectivityStoreWriter, compact_store, encode_masks, TRANSPARENCY_ORDER
+from ConnectivityEval import FIELDS, load_manual_masks, aggregate_metrics
+from EdgeProfile import edge_profile, transparent_sections, tile_edge_transparency
 
 # === Configurable Parameters ===
 TILESET_FOLDER = "Data/GameTile/small_Tilesets"
 SPLIT_TILE_FOLDER = "Data/GameTile/small_dataset/Tiles"
 OUTPUT_FOLDER = "Data/GameTile/connectivity_results_smart"
+CONNECTIVITY_STORE = "Data/GameTile/connectivity_results_smart_packed"
+WRITE_CONNECTIVITY_JSON = True      # one tile_connectivity-<tileset>.json per tileset
+WRITE_CONNECTIVITY_STORE = True     # packed bitmask store, see ConnectivityStore.py
 
 TILE_SIZE = 32
 SSIM_THRESHOLD = 0.6                 # Smart rule: lower than conservative 0.85
 TRANSPARENCY_THRESHOLD = 0.6        # Keep consistent with your best result
 EDGE_CHECK_ROWS = 4
-
-# === Ensure output directory exists ===
-os.makedirs(OUTPUT_FOLDER, exist_ok=True)
+PROFILE_DEPTH = 8                   # edge-profile lines kept per section (stats, sweep cache and store)
 
 # === Helper Functions ===
-def is_edge_section_transparent(edge):
-    if edge.ndim == 3 and edge.shape[-1] == 4:
-        alpha_channel = edge[:, :, 3]
-        transparent_ratio = np.sum(alpha_channel == 0) / alpha_channel.size
-        return transparent_ratio > TRANSPARENCY_THRESHOLD
-    return False
-
 def check_edge_transparency(tile):
-    return {
-        "top_left": is_edge_section_transparent(tile[0:TILE_SIZE // 2, 0:EDGE_CHECK_ROWS]),
-        "top_right": is_edge_section_transparent(tile[TILE_SIZE // 2:TILE_SIZE, 0:EDGE_CHECK_ROWS]),
-        "down_left": is_edge_section_transparent(tile[0:TILE_SIZE // 2, TILE_SIZE - EDGE_CHECK_ROWS:TILE_SIZE]),
-        "down_right": is_edge_section_transparent(tile[TILE_SIZE // 2:TILE_SIZE, TILE_SIZE - EDGE_CHECK_ROWS:TILE_SIZE]),
-        "left_top": is_edge_section_transparent(tile[0:EDGE_CHECK_ROWS, 0:TILE_SIZE // 2]),
-        "left_down": is_edge_section_transparent(tile[0:EDGE_CHECK_ROWS, TILE_SIZE // 2:TILE_SIZE]),
-        "right_top": is_edge_section_transparent(tile[TILE_SIZE - EDGE_CHECK_ROWS:TILE_SIZE, 0:TILE_SIZE // 2]),
-        "right_down": is_edge_section_transparent(tile[TILE_SIZE - EDGE_CHECK_ROWS:TILE_SIZE, TILE_SIZE // 2:TILE_SIZE])
-    }
+    return tile_edge_transparency(tile, TRANSPARENCY_THRESHOLD, EDGE_CHECK_ROWS)
 
 def load_tile(tileset_id, x, y):
     tile_path = os.path.join(SPLIT_TILE_FOLDER, tileset_id, f"tiles_{x}_{y}.png")
@@ -43,11 +34,6 @@ def load_tile(tileset_id, x, y):
         return cv2.imread(tile_path, cv2.IMREAD_UNCHANGED)
     return None
 
-def mse(imageA, imageB):
-    err = np.sum((imageA.astype("float") - imageB.astype("float")) ** 2)
-    err /= float(imageA.shape[0] * imageA.shape[1])
-    return 1 - (err / 255.0)
-
 def compare_edges(tile1, tile2, direction):
     if tile1 is None or tile2 is None:
         return 0
@@ -67,87 +53,494 @@ def compare_edges(tile1, tile2, direction):
     else:
         return 0
 
-    if is_edge_section_transparent(edge1) or is_edge_section_transparent(edge2):
-        return 0
-
     edge1_gray = cv2.cvtColor(np.expand_dims(edge1, axis=0), cv2.COLOR_BGR2GRAY)
     edge2_gray = cv2.cvtColor(np.expand_dims(edge2, axis=0), cv2.COLOR_BGR2GRAY)
 
-    win_size = min(7, min(edge1_gray.shape[0], edge1_gray.shape[1]))
-    if win_size % 2 == 0: win_size -= 1
-    if win_size < 3:
-        return mse(edge1_gray, edge2_gray)
+    # SSIM with the largest odd window that fits, MSE for 1-pixel strips
+    return batch_edge_score(edge1_gray[np.newaxis], edge2_gray[np.newaxis])[0]
 
-    return ssim(edge1_gray, edge2_gray, win_size=win_size, channel_axis=None)
+# === Vectorized Connectivity (whole tileset at once) ===
+# direction -> neighbour offset, in the order the results list them
+DIRECTION_OFFSETS = {
+    "right_top": (1, 0),
+    "right_down": (1, 0),
+    "left_top": (-1, 0),
+    "left_down": (-1, 0),
+    "top_left": (0, -1),
+    "top_right": (0, -1),
+    "down_left": (0, 1),
+    "down_right": (0, 1),
+}
 
-# === Main Processing Loop ===
-tileset_images = [f for f in os.listdir(TILESET_FOLDER) if f.endswith(".png")]
+HALF = TILE_SIZE // 2
 
-for tileset in tileset_images:
-    tileset_id = os.path.splitext(tileset)[0]
-    tileset_folder = os.path.join(SPLIT_TILE_FOLDER, tileset_id)
+# (edge of tile, edge of neighbour) compared by compare_edges, as (row, col) index into a tile
+EDGE_INDEX = {
+    "right_top": (np.s_[:HALF, -1], np.s_[:HALF, 0]),
+    "right_down": (np.s_[HALF:, -1], np.s_[HALF:, 0]),
+    "left_top": (np.s_[:HALF, 0], np.s_[:HALF, -1]),
+    "left_down": (np.s_[HALF:, 0], np.s_[:HALF, -1]),
+    "top_left": (np.s_[0, :HALF], np.s_[-1, :HALF]),
+    "top_right": (np.s_[0, HALF:], np.s_[-1, HALF:]),
+    "down_left": (np.s_[-1, :HALF], np.s_[0, :HALF]),
+    "down_right": (np.s_[-1, HALF:], np.s_[0, HALF:]),
+}
 
-    if not os.path.exists(tileset_folder):
-        print(f"[SKIP] Folder not found: {tileset_folder}")
-        continue
+NUM_WORKERS = os.cpu_count() or 1
+CHECKPOINT_EVERY = 50               # save the ingest cache and store after this many finished tilesets
+TILE_STORE_FOLDER = None            # e.g. "Data/GameTile/small_dataset" to read <tileset>_packed stores instead of PNGs
 
+# === Threshold Sweep ===
+SWEEP_MODE = False                  # cache raw edge scores once, then score threshold settings against the manual labels
+SWEEP_CACHE = "Data/GameTile/connectivity_sweep_cache.npz"
+SWEEP_REPORT = "Data/GameTile/connectivity_sweep_report.json"
+MANUAL_LABELS = "Data/GameTile/labeled_connectivity_manual.json"
+SWEEP_SSIM_THRESHOLDS = [0.5, 0.6, 0.7, 0.8, 0.85, 0.9, 0.95]
+SWEEP_TRANSPARENCY_THRESHOLDS = [0.5, 0.6, 0.7, 0.8, 0.9]
+SWEEP_EDGE_CHECK_ROWS = [1, 2, 4, 8]
+
+
+def grid_index(index):
+    """
+    Prefix a per-tile (row, col) index with the two grid axes.
+    """
+    return (slice(None), slice(None)) + index
+
+def load_tileset_grid(tileset_id):
+    """
+    Load every tile of a tileset once into a dense grid.
+
+    Tiles come from the <tileset>_packed store under TILE_STORE_FOLDER if there is
+    one (transparent tiles count as missing, like the sliced PNG folder),
+    otherwise from the tiles_x_y.png files in SPLIT_TILE_FOLDER. The grid spans
+    the existing tiles, as the per-tile loop's max_x / max_y did.
+
+    Parameters:
+    tileset_id (str): Tileset name.
+
+    Returns:
+    tuple: (bgra, has_alpha, exists) with bgra of shape (rows, cols, T, T, 4) in cv2 channel
+    order, has_alpha and exists of shape (rows, cols); None if the tileset has no tiles.
+    """
+    store_path = os.path.join(TILE_STORE_FOLDER, f"{tileset_id}_packed") if TILE_STORE_FOLDER else None
+    if store_path and os.path.exists(store_path):
+        store = TileStore(store_path)
+        exists = (store.get_flags(tileset_id) & FLAG_TRANSPARENT) == 0
+        if not exists.any():
+            return None
+        ys, xs = np.nonzero(exists)
+        rows, cols = ys.max() + 1, xs.max() + 1
+        bgra = store.get_tileset(tileset_id)[:rows, :cols][..., [2, 1, 0, 3]]
+        return bgra, np.ones((rows, cols), dtype=bool), exists[:rows, :cols]
+
+    tileset_folder = os.path.join(SPLIT_TILE_FOLDER, tileset_id)
+    if not os.path.exists(tileset_folder):
+        return None
     tile_files = [f for f in os.listdir(tileset_folder) if f.startswith("tiles_") and f.endswith(".png")]
     tile_coords = [(int(f.split("_")[1]), int(f.split("_")[2].split(".")[0])) for f in tile_files]
     if not tile_coords:
-        print(f"[SKIP] No tiles found in {tileset_folder}")
-        continue
-
-    max_x = max(coord[0] for coord in tile_coords) + 1
-    max_y = max(coord[1] for coord in tile_coords) + 1
-
-    results = []
+        return None
 
+    cols = max(coord[0] for coord in tile_coords) + 1
+    rows = max(coord[1] for coord in tile_coords) + 1
+    bgra = np.zeros((rows, cols, TILE_SIZE, TILE_SIZE, 4), dtype=np.uint8)
+    has_alpha = np.zeros((rows, cols), dtype=bool)
+    exists = np.zeros((rows, cols), dtype=bool)
     for x, y in tile_coords:
         tile = load_tile(tileset_id, x, y)
-        if tile is None:
+        if tile is None or tile.shape[:2] != (TILE_SIZE, TILE_SIZE):
+            continue
+        if tile.ndim == 2:
+            tile = cv2.cvtColor(tile, cv2.COLOR_GRAY2BGR)
+        bgra[y, x, :, :, :tile.shape[2]] = tile
+        has_alpha[y, x] = tile.shape[2] == 4
+        exists[y, x] = True
+    return bgra, has_alpha, exists
+
+def shift_grid(grid, dx, dy, fill=0):
+    """
+    Align every cell with its neighbour at (x + dx, y + dy); cells outside the grid get fill.
+    """
+    pad = [(1, 1), (1, 1)] + [(0, 0)] * (grid.ndim - 2)
+    padded = np.pad(grid, pad, constant_values=fill)
+    rows, cols = grid.shape[:2]
+    return padded[1 + dy:1 + dy + rows, 1 + dx:1 + dx + cols]
+
+def compute_edge_stats(bgra, has_alpha, exists):
+    """
+    Threshold-independent inputs of the connectivity rule for every tile of a sheet.
+
+    Parameters:
+    bgra (numpy.ndarray): (rows, cols, T, T, 4) tiles in cv2 channel order.
+    has_alpha (numpy.ndarray): (rows, cols) whether the tile had an alpha channel.
+    exists (numpy.ndarray): (rows, cols) whether the tile exists.
+
+    Returns:
+    dict: Arrays in DIRECTION_OFFSETS order:
+        "edge_profile" (rows, cols, 8, PROFILE_DEPTH) EdgeProfile.edge_profile of the tile,
+        "scores" (rows, cols, 8) compare_edges score against the neighbour,
+        "in_bounds" (rows, cols, 8) the tile exists and the neighbour position is inside the grid,
+        "neighbor_exists" (rows, cols, 8) the neighbour tile exists,
+        "has_alpha" (rows, cols).
+    """
+    rows, cols = exists.shape
+    profile = edge_profile(bgra[..., 3] == 0, PROFILE_DEPTH)
+
+    # same gray conversion as compare_edges, done once for the whole sheet
+    gray = cv2.cvtColor(np.ascontiguousarray(bgra[..., :3]).reshape(-1, TILE_SIZE, 3), cv2.COLOR_BGR2GRAY)
+    gray = gray.reshape(rows, cols, TILE_SIZE, TILE_SIZE)
+
+    y_index, x_index = np.indices((rows, cols))
+    scores, in_bounds, neighbor_exists = [], [], []
+    for direction, (dx, dy) in DIRECTION_OFFSETS.items():
+        inside = (0 <= x_index + dx) & (x_index + dx < cols) & (0 <= y_index + dy) & (y_index + dy < rows)
+        in_bounds.append(exists & inside)
+        neighbor_exists.append(shift_grid(exists, dx, dy, False))
+
+        tile_edge, neighbor_edge = EDGE_INDEX[direction]
+        edge1 = gray[grid_index(tile_edge)].reshape(rows * cols, 1, -1)
+        edge2 = shift_grid(gray, dx, dy)[grid_index(neighbor_edge)].reshape(rows * cols, 1, -1)
+        scores.append(batch_edge_score(edge1, edge2).reshape(rows, cols))
+    return {
+        "edge_profile": profile,
+        "scores": np.stack(scores, axis=-1),
+        "in_bounds": np.stack(in_bounds, axis=-1),
+        "neighbor_exists": np.stack(neighbor_exists, axis=-1),
+        "has_alpha": has_alpha,
+    }
+
+def derive_connectivity(stats, ssim_threshold=SSIM_THRESHOLD, transparency_threshold=TRANSPARENCY_THRESHOLD,
+                        edge_check_rows=EDGE_CHECK_ROWS):
+    """
+    Apply the connectivity rule to cached edge stats.
+
+    Parameters:
+    stats (dict): compute_edge_stats output, for a grid or for flattened tile rows.
+    ssim_threshold (float): Edge score above which neighbours connect.
+    transparency_threshold (float): Alpha-0 fraction above which an edge section is transparent.
+    edge_check_rows (int): Lines per edge section in the transparency check, at most PROFILE_DEPTH.
+
+    Returns:
+    tuple: (transparent, possible, connected) boolean arrays of shape (..., 8) in DIRECTION_OFFSETS order.
+    """
+    transparent = transparent_sections(stats["edge_profile"], stats["has_alpha"], transparency_threshold,
+                                       edge_check_rows, TILE_SIZE)
+    possible = stats["in_bounds"] & ~transparent
+    connected = possible & stats["neighbor_exists"] & (stats["scores"] > ssim_threshold)
+    return transparent, possible, connected
+
+def compute_tileset_connectivity(bgra, has_alpha, exists):
+    """
+    Vectorized equivalent of the per-tile loop: edge transparency, possible and actual connectivity for all tiles.
+
+    Parameters:
+    bgra (numpy.ndarray): (rows, cols, T, T, 4) tiles in cv2 channel order.
+    has_alpha (numpy.ndarray): (rows, cols) whether the tile had an alpha channel.
+    exists (numpy.ndarray): (rows, cols) whether the tile exists.
+
+    Returns:
+    tuple: (transparent, possible, connected), dicts of (rows, cols) boolean arrays keyed by direction,
+    and the (rows, cols, 8, PROFILE_DEPTH) edge profiles they were derived from.
+    """
+    stats = compute_edge_stats(bgra, has_alpha, exists)
+    derived = derive_connectivity(stats)
+    flags = tuple({direction: values[..., i] for i, direction in enumerate(DIRECTION_OFFSETS)} for values in derived)
+    return flags + (stats["edge_profile"],)
+
+def process_tileset(tileset_id):
+    """
+    Compute the connectivity of one tileset and save its JSON.
+
+    Parameters:
+    tileset_id (str): Tileset name.
+
+    Returns:
+    tuple: (path of the written JSON or None, (xs, ys, masks, profiles) rows for the connectivity store),
+    or None if the tileset has no tiles.
+    """
+    grid = load_tileset_grid(tileset_id)
+    if grid is None:
+        print(f"[SKIP] No tiles found for {tileset_id}")
+        return None
+    bgra, has_alpha, exists = grid
+    transparent, possible, connected, profile = compute_tileset_connectivity(bgra, has_alpha, exists)
+
+    ys, xs = np.nonzero(exists)
+    masks = encode_masks(connected, possible, transparent)[ys, xs]
+    # tiles without alpha have an all-zero profile, like their transparency flags
+    profiles = np.where(has_alpha[ys, xs, np.newaxis, np.newaxis], profile[ys, xs], 0)
+
+    output_file = None
+    if WRITE_CONNECTIVITY_JSON:
+        results = []
+        for x, y in sorted(zip(xs.tolist(), ys.tolist())):
+            results.append({
+                "tile_x": x,
+                "tile_y": y,
+                "connectivity": [direction for direction in DIRECTION_OFFSETS if connected[direction][y, x]],
+                "possible_connectivity": [direction for direction in DIRECTION_OFFSETS if possible[direction][y, x]],
+                "edge_transparency": {direction: bool(transparent[direction][y, x]) for direction in TRANSPARENCY_ORDER},
+            })
+        output_file = os.path.join(OUTPUT_FOLDER, f"tile_connectivity-{tileset_id}.json")
+        save_json_atomic(results, output_file)
+    print(f"[SAVE] {tileset_id}: {len(xs)} tiles")
+    return output_file, (xs, ys, masks, profiles)
+
+def run_connectivity(num_workers=NUM_WORKERS, resume=True):
+    """
+    Compute connectivity for every tileset in TILESET_FOLDER over a process pool.
+
+    Finished tilesets are recorded in the ingest cache and appended to the
+    connectivity store, both saved every CHECKPOINT_EVERY tilesets and on
+    exit; with resume=True tilesets whose image and parameters are unchanged
+    and whose outputs exist are skipped, so an interrupted run picks up where
+    it stopped. A tileset that fails is reported and skipped; the others are
+    still recorded, and the next run retries it. Recomputed tilesets are appended to the store, and the rows
+    they shadow are compacted away once the run completes; an interrupted run
+    keeps the older rows, which the ingest cache still points to.
+
+    Parameters:
+    num_workers (int): Number of worker processes.
+    resume (bool): Skip tilesets that are already up to date.
+    """
+    os.makedirs(OUTPUT_FOLDER, exist_ok=True)
+    cache = IngestCache()
+    connectivity_params = {"tile_size": TILE_SIZE, "ssim_threshold": SSIM_THRESHOLD, "transparency_threshold": TRANSPARENCY_THRESHOLD, "edge_check_rows": EDGE_CHECK_ROWS}
+
+    tileset_paths = {}
+    tileset_params = {}
+    for tileset in sorted(f for f in os.listdir(TILESET_FOLDER) if f.endswith(".png")):
+        tileset_id = os.path.splitext(tileset)[0]
+        tileset_path = os.path.join(TILESET_FOLDER, tileset)
+        # the tiles are read, not the sheet, so re-sliced tiles make the tileset dirty too
+        params = dict(connectivity_params, tiles=tile_source_stats(tileset_id))
+        if resume and cache.is_fresh(tileset_path, "connectivity", params):
             continue
+        tileset_paths[tileset_id] = tileset_path
+        tileset_params[tileset_id] = params
+    print(f"[INFO] {len(tileset_paths)} tilesets to process with {num_workers} workers")
+
+    # tilesets computed in this run shadow their older rows in the store until it is compacted
+    store_writer = ConnectivityStoreWriter(CONNECTIVITY_STORE, profile_depth=PROFILE_DEPTH) if WRITE_CONNECTIVITY_STORE else None
+    finished = 0
+    try:
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            futures = {executor.submit(process_tileset, tileset_id): tileset_id for tileset_id in tileset_paths}
+            for future in as_completed(futures):
+                tileset_id = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    print(f"[ERROR] {tileset_id}: {e}")
+                    continue
+                if result is None:
+                    continue
+                output_file, rows = result
+                artifacts = []
+                if output_file is not None:
+                    artifacts.append(output_file)
+                if store_writer is not None:
+                    store_writer.add_tileset(tileset_id, *rows)
+                    artifacts.append(CONNECTIVITY_STORE)
+                cache.record(tileset_paths[tileset_id], "connectivity", tileset_params[tileset_id], artifacts)
+                finished += 1
+                if finished % CHECKPOINT_EVERY == 0:
+                    if store_writer is not None:
+                        store_writer.flush()
+                    cache.save()
+    finally:
+        if store_writer is not None:
+            store_writer.close()
+        cache.save()
+
+    if store_writer is not None:
+        reclaimed = compact_store(CONNECTIVITY_STORE)
+        if reclaimed:
+            print(f"[INFO] Compacted {reclaimed} shadowed rows out of {CONNECTIVITY_STORE}")
+
+def tileset_edge_stats(tileset_id):
+    """
+    Edge stats of the existing tiles of one tileset, flattened to rows.
+
+    Returns:
+    dict: compute_edge_stats arrays indexed by tile, plus "x" and "y"; None if the tileset has no tiles.
+    """
+    grid = load_tileset_grid(tileset_id)
+    if grid is None:
+        return None
+    stats = compute_edge_stats(*grid)
+    ys, xs = np.nonzero(grid[2])
+    rows = {key: value[ys, xs] for key, value in stats.items()}
+    rows["x"] = xs.astype(np.int16)
+    rows["y"] = ys.astype(np.int16)
+    return rows
+
+def sweep_tileset_ids():
+    return sorted(os.path.splitext(f)[0] for f in os.listdir(TILESET_FOLDER) if f.endswith(".png"))
+
+def tile_source_stats(tileset_id):
+    """
+    (name, size, mtime_ns) of the files load_tileset_grid reads for a tileset, so re-sliced tiles change it.
+    """
+    store_path = os.path.join(TILE_STORE_FOLDER, f"{tileset_id}_packed") if TILE_STORE_FOLDER else None
+    if store_path and os.path.exists(store_path):
+        paths = [os.path.join(store_path, name) for name in (TILES_FILE, INDEX_FILE, META_FILE)]
+    else:
+        tileset_folder = os.path.join(SPLIT_TILE_FOLDER, tileset_id)
+        if not os.path.exists(tileset_folder):
+            return []
+        paths = [os.path.join(tileset_folder, f) for f in sorted(os.listdir(tileset_folder)) if f.startswith("tiles_") and f.endswith(".png")]
+    return file_stats(paths)
+
+def sweep_inputs_key(tileset_ids):
+    """
+    Key of everything the sweep cache is computed from: the tileset sheets (by content, through
+    the ingest cache), the tiles or packed stores sliced from them, and the edge-stat parameters.
+    """
+    cache = IngestCache()
+    sources = {tileset_id: [cache.content_digest(os.path.join(TILESET_FOLDER, f"{tileset_id}.png")), tile_source_stats(tileset_id)]
+               for tileset_id in tileset_ids}
+    cache.save()
+    params = {"tile_size": TILE_SIZE, "profile_depth": PROFILE_DEPTH, "split_tile_folder": SPLIT_TILE_FOLDER,
+              "tile_store_folder": TILE_STORE_FOLDER}
+    return stage_key(json.dumps(sources, sort_keys=True), params)
+
+def is_sweep_cache_fresh(cache_path=SWEEP_CACHE):
+    """
+    Whether the sweep cache exists and was built from the current tiles and parameters.
+    """
+    if not os.path.exists(cache_path):
+        return False
+    with np.load(cache_path) as data:
+        if "inputs_key" not in data.files:
+            return False
+        stored_key = str(data["inputs_key"])
+    return stored_key == sweep_inputs_key(sweep_tileset_ids())
+
+def build_sweep_cache(cache_path=SWEEP_CACHE, num_workers=NUM_WORKERS):
+    """
+    Compute the threshold-independent edge stats of every tileset once and save them.
+
+    Rows are sorted by (tileset, x, y). The cache is what the threshold
+    sweep reads; it stores sweep_inputs_key so is_sweep_cache_fresh can tell
+    when the tiles or TILE_SIZE / PROFILE_DEPTH changed.
 
-        edge_transparency = check_edge_transparency(tile)
-        connectivity_list = []
-        possible_connectivity_list = []
-
-        directions = {
-            "right_top": (x + 1, y),
-            "right_down": (x + 1, y),
-            "left_top": (x - 1, y),
-            "left_down": (x - 1, y),
-            "top_left": (x, y - 1),
-            "top_right": (x, y - 1),
-            "down_left": (x, y + 1),
-            "down_right": (x, y + 1),
-        }
-
-        for direction, (nx, ny) in directions.items():
-            if not (0 <= nx < max_x and 0 <= ny < max_y):
+    Parameters:
+    cache_path (str): Output .npz path.
+    num_workers (int): Number of worker processes.
+    """
+    tileset_ids = sweep_tileset_ids()
+    inputs_key = sweep_inputs_key(tileset_ids)
+    parts = {}
+    failed = []
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        futures = {executor.submit(tileset_edge_stats, tileset_id): tileset_id for tileset_id in tileset_ids}
+        for future in as_completed(futures):
+            try:
+                rows = future.result()
+            except Exception as e:
+                print(f"[ERROR] {futures[future]}: {e}")
+                failed.append(futures[future])
                 continue
+            if rows is not None:
+                parts[futures[future]] = rows
+    print(f"[INFO] Edge stats computed for {len(parts)} tilesets")
+    if failed:
+        # without the inputs key the cache counts as stale, so the failed tilesets are retried next time
+        print(f"[WARN] {len(failed)} tilesets left out of the sweep cache: {', '.join(sorted(failed))}")
+        inputs_key = ""
+
+    tilesets = sorted(parts)
+    columns = {key: np.concatenate([parts[name][key] for name in tilesets]) for key in parts[tilesets[0]]} if tilesets else {}
+    tileset_index = np.concatenate([np.full(len(parts[name]["x"]), i, dtype=np.int32) for i, name in enumerate(tilesets)]) if tilesets else np.empty(0, dtype=np.int32)
+    if tilesets:
+        order = np.lexsort((columns["y"], columns["x"], tileset_index))
+        columns = {key: value[order] for key, value in columns.items()}
+        tileset_index = tileset_index[order]
+
+    os.makedirs(os.path.dirname(os.path.abspath(cache_path)), exist_ok=True)
+    np.savez(cache_path, tilesets=np.array(tilesets), tileset_index=tileset_index, inputs_key=np.array(inputs_key), **columns)
+    print(f"[SAVE] Edge stats of {len(tileset_index)} tiles → {cache_path}")
+
+def load_sweep_cache(cache_path=SWEEP_CACHE):
+    """
+    Load a cache written by build_sweep_cache into memory.
+
+    Returns:
+    dict: Column name -> array; "tilesets" is a list of names.
+    """
+    with np.load(cache_path) as data:
+        cache = {key: data[key] for key in data.files}
+    if "edge_profile" not in cache:
+        raise ValueError(f"{cache_path} predates cumulative edge profiles; delete it to rebuild")
+    cache["tilesets"] = [str(name) for name in cache["tilesets"]]
+    return cache
 
-            # if edge_transparency.get(direction) is False:
-            # if edge_transparency.get(direction) is False or direction in ["top_left", "right_down", "left_down"]:
-            if direction in edge_transparency and not edge_transparency[direction]:
-
-                possible_connectivity_list.append(direction)
-                neighbor_tile = load_tile(tileset_id, nx, ny)
-                if neighbor_tile is not None:
-                    score = compare_edges(tile, neighbor_tile, direction)
-                    if score > SSIM_THRESHOLD:
-                        connectivity_list.append(direction)
-
-        results.append({
-            "tile_x": x,
-            "tile_y": y,
-            "connectivity": connectivity_list,
-            "possible_connectivity": possible_connectivity_list,
-            "edge_transparency": edge_transparency
-        })
-
-    output_file = os.path.join(OUTPUT_FOLDER, f"tile_connectivity-{tileset_id}.json")
-    print(f"[SAVE] {tileset_id}: {len(results)} tiles → {output_file}")
-    with open(output_file, "w") as json_file:
-        json.dump(results, json_file, indent=4, default=lambda x: bool(x) if isinstance(x, np.bool_) else x)
-
-print("✅ All smart connectivity results saved.")
+def lookup_cache_rows(cache, keys):
+    """
+    Row of every (tileset, x, y) key in the sweep cache, -1 if it is not there.
+    """
+    names = {name: i for i, name in enumerate(cache["tilesets"])}
+    # rows are sorted by (tileset, x, y); pack the triple into one sortable key
+    cache_keys = (cache["tileset_index"].astype(np.int64) << 32) | (cache["x"].astype(np.int64) << 16) | cache["y"].astype(np.int64)
+    query = np.array([(names.get(name, -1) << 32) | (x << 16) | y for name, x, y in keys], dtype=np.int64)
+    if not len(cache_keys):
+        return np.full(len(query), -1, dtype=np.int64)
+    positions = np.minimum(np.searchsorted(cache_keys, query), len(cache_keys) - 1)
+    return np.where(cache_keys[positions] == query, positions, -1)
+
+def run_threshold_sweep(cache_path=SWEEP_CACHE, manual_file=MANUAL_LABELS, report_path=SWEEP_REPORT,
+                        ssim_thresholds=SWEEP_SSIM_THRESHOLDS, transparency_thresholds=SWEEP_TRANSPARENCY_THRESHOLDS,
+                        edge_check_rows_values=SWEEP_EDGE_CHECK_ROWS):
+    """
+    Score every threshold setting against the manual labels using the cached edge stats.
+
+    For each (ssim_threshold, transparency_threshold, edge_check_rows) the
+    connectivity rule is re-applied to the labeled tiles only and compared
+    with the manual edge sets as connectivity, possible connectivity and solid
+    (non-transparent) edges, see ConnectivityEval.
+
+    Returns:
+    list: One report row per setting and field, also saved to report_path.
+    """
+    cache = load_sweep_cache(cache_path)
+    keys, manual = load_manual_masks(manual_file)
+    rows = lookup_cache_rows(cache, keys)
+    found = rows >= 0
+    stats = {key: cache[key][rows[found]] for key in ("edge_profile", "scores", "in_bounds", "neighbor_exists", "has_alpha")}
+    print(f"[INFO] {found.sum()} of {len(keys)} labeled tiles found in {cache_path}")
+
+    settings = [(s, t, r) for r in edge_check_rows_values for t in transparency_thresholds for s in ssim_thresholds]
+    bit_weights = 1 << np.arange(len(DIRECTION_OFFSETS))
+    predicted = {field: np.zeros((len(settings), len(keys)), dtype=np.uint8) for field in FIELDS}
+    for i, (ssim_threshold, transparency_threshold, edge_check_rows) in enumerate(settings):
+        transparent, possible, connected = derive_connectivity(stats, ssim_threshold, transparency_threshold, edge_check_rows)
+        predicted["connectivity"][i, found] = connected @ bit_weights
+        predicted["possible_connectivity"][i, found] = possible @ bit_weights
+        predicted["solid"][i, found] = ~transparent @ bit_weights
+
+    report = []
+    for field in FIELDS:
+        summary = aggregate_metrics(manual, predicted[field])
+        for i, (ssim_threshold, transparency_threshold, edge_check_rows) in enumerate(settings):
+            row = {"field": field, "ssim_threshold": ssim_threshold, "transparency_threshold": transparency_threshold,
+                   "edge_check_rows": edge_check_rows}
+            row.update({metric: round(float(values[i]), 4) for metric, values in summary.items()})
+            report.append(row)
+    save_json_atomic(report, report_path)
+    print(f"[SAVE] {len(settings)} settings × {len(FIELDS)} fields → {report_path}")
+    return report
+
+
+if __name__ == "__main__":
+    if SWEEP_MODE:
+        if not is_sweep_cache_fresh():
+            build_sweep_cache()
+        report = run_threshold_sweep()
+        best = sorted((row for row in report if row["field"] == "connectivity"), key=lambda row: -row["micro_f1"])[:5]
+        for row in best:
+            print(f"[BEST] ssim={row['ssim_threshold']} transparency={row['transparency_threshold']} "
+                  f"rows={row['edge_check_rows']}: micro F1 {row['micro_f1']}, exact {row['exact_match_rate']}")
+    else:
+        run_connectivity()
+        print("✅ All smart connectivity results saved.")
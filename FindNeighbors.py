@@ -1,10 +1,24 @@
 import os
 import re
 import json
+import numpy as np
 
 
 tileset_path = "Data/GameTile/dataset_small/"
 
+# neighbour order of the "neighbors" lists: right, left, down, up
+NEIGHBOR_OFFSETS = [(1, 0), (-1, 0), (0, 1), (0, -1)]
+
+# A neighbour graph is a folder holding
+#   names.npy         tile filename of every node
+#   folder_index.npy  index into folders.json of every node
+#   offsets.npy       CSR row offsets, node i's neighbours are neighbors[offsets[i]:offsets[i + 1]]
+#   neighbors.npy     neighbour node ids
+#   sources.npy       node id of every entry of neighbors.npy, for O(1) edge sampling
+#   folders.json      subfolder names
+GRAPH_ARRAYS = ("names", "folder_index", "offsets", "neighbors", "sources")
+GRAPH_FOLDERS_FILE = "folders.json"
+
 def parse_filename(filename):
     """
     Parse the filename to extract the image name and coordinates.
@@ -24,43 +38,76 @@ def parse_filename(filename):
         return image_name, x, y
     return None
 
-def find_neighbors(folder_path):
+def build_folder_graph(folder_path):
     """
-    Find the neighbors for each image in the specified folder.
+    Build the CSR neighbour graph of the tiles in one folder.
+
+    Coordinates are parsed once per file and placed in a dense occupancy grid
+    per image name, so every neighbour lookup is an array index.
 
     Parameters:
     folder_path (str): Path to the folder containing images.
 
     Returns:
-    dict: A dictionary where the keys are filenames and the values are dictionaries with neighbor information.
+    tuple: (names list, offsets array of shape (N + 1,), neighbors array of node ids)
     """
-    neighbors_info = {}
-    filenames = [f for f in os.listdir(folder_path) if f.endswith('.png')]
-
-    for filename in filenames:
+    names, image_ids, xs, ys = [], [], [], []
+    image_index = {}
+    for filename in os.listdir(folder_path):
+        if not filename.endswith('.png'):
+            continue
         parsed = parse_filename(filename)
         if not parsed:
             continue
         image_name, x, y = parsed
-        neighbors = []
+        names.append(filename)
+        image_ids.append(image_index.setdefault(image_name, len(image_index)))
+        xs.append(x)
+        ys.append(y)
+
+    count = len(names)
+    image_ids = np.array(image_ids, dtype=np.int64)
+    xs = np.array(xs, dtype=np.int64)
+    ys = np.array(ys, dtype=np.int64)
+    neighbor_ids = np.full((count, len(NEIGHBOR_OFFSETS)), -1, dtype=np.int64)
+    for image_id in range(len(image_index)):
+        members = np.nonzero(image_ids == image_id)[0]
+        gx = xs[members] - xs[members].min()
+        gy = ys[members] - ys[members].min()
+        # one padding cell on each side keeps neighbour lookups in bounds
+        grid = np.full((gy.max() + 3, gx.max() + 3), -1, dtype=np.int64)
+        grid[gy + 1, gx + 1] = members
+        for d, (dx, dy) in enumerate(NEIGHBOR_OFFSETS):
+            neighbor_ids[members, d] = grid[gy + 1 + dy, gx + 1 + dx]
 
-        neighbor_coords = [
-            (x + 1, y),
-            (x - 1, y),
-            (x, y + 1),
-            (x, y - 1)
-        ]
+    valid = neighbor_ids >= 0
+    offsets = np.zeros(count + 1, dtype=np.int64)
+    np.cumsum(valid.sum(axis=1), out=offsets[1:])
+    return names, offsets, neighbor_ids[valid].astype(np.int32)
 
-        for nx, ny in neighbor_coords:
-            neighbor_filename = f"{image_name}_{nx}_{ny}.png"
-            if neighbor_filename in filenames:
-                neighbors.append(neighbor_filename)
+def find_neighbors(folder_path):
+    """
+    Find the neighbors for each image in the specified folder.
 
+    Parameters:
+    folder_path (str): Path to the folder containing images.
+
+    Returns:
+    dict: A dictionary where the keys are filenames and the values are dictionaries with neighbor information.
+    """
+    return graph_to_neighbors_info(*build_folder_graph(folder_path))
+
+def graph_to_neighbors_info(names, offsets, neighbors):
+    """
+    Convert a folder graph from build_folder_graph to the neighbors_info dictionary.
+    """
+    neighbors_info = {}
+    for i, filename in enumerate(names):
+        neighbor_names = [names[j] for j in neighbors[offsets[i]:offsets[i + 1]]]
         neighbors_info[filename] = {
-            "total_neighbors": len(neighbors),
-            "neighbors": neighbors
+            "total_neighbors": len(neighbor_names),
+            "neighbors": neighbor_names
         }
-
     return neighbors_info
 
 def save_neighbors_info(neighbors_info, output_path):
@@ -75,13 +122,15 @@ def save_neighbors_info(neighbors_info, output_path):
         json.dump(neighbors_info, json_file, indent=4)
     print(f"Neighbors information saved to {output_path}")
 
-def process_subfolders(parent_folder):
+def process_subfolders(parent_folder, graph_path=None):
     """
     Process all subfolders within the specified parent folder to find neighbors for images and save the information to JSON files.
 
     Parameters:
     parent_folder (str): Path to the parent folder containing subfolders.
+    graph_path (str): If set, also save the neighbour graph of all subfolders there (see save_neighbor_graph).
     """
+    folder_graphs = []
     for root, dirs, _ in os.walk(parent_folder):
         for dir_name in dirs:
             
@@ -97,10 +146,15 @@ def process_subfolders(parent_folder):
             if "black" not in subfolder_path and "white" not in subfolder_path:
 
                 if os.path.isdir(subfolder_path):
-                    neighbors_info = find_neighbors(subfolder_path)
+                    folder_graph = build_folder_graph(subfolder_path)
+                    folder_graphs.append((last_folder, folder_graph))
+                    neighbors_info = graph_to_neighbors_info(*folder_graph)
                     output_path = os.path.join(neighbor_path, last_folder+'_neighbors_info.json')
                     save_neighbors_info(neighbors_info, output_path)
 
+    if graph_path is not None:
+        save_neighbor_graph(merge_folder_graphs(folder_graphs), graph_path)
+        print(f"Neighbor graph saved to {graph_path}")
 
 def split_path(path):
     """
@@ -118,9 +172,111 @@ def split_path(path):
     directory_path, last_folder_name = os.path.split(normalized_path)
     return directory_path, last_folder_name
 
+def merge_folder_graphs(folder_graphs):
+    """
+    Combine per-folder graphs into one graph with global node ids.
+
+    Parameters:
+    folder_graphs (list): (folder name, (names, offsets, neighbors)) per folder.
+
+    Returns:
+    dict: Arrays named in GRAPH_ARRAYS plus "folders".
+    """
+    names, folder_index, offsets, neighbors = [], [], [np.zeros(1, dtype=np.int64)], []
+    node_count = edge_count = 0
+    for f, (_, (folder_names, folder_offsets, folder_neighbors)) in enumerate(folder_graphs):
+        names.extend(folder_names)
+        folder_index.append(np.full(len(folder_names), f, dtype=np.int32))
+        offsets.append(folder_offsets[1:] + edge_count)
+        neighbors.append(folder_neighbors + node_count)
+        node_count += len(folder_names)
+        edge_count += len(folder_neighbors)
+
+    offsets = np.concatenate(offsets)
+    return {
+        "names": np.array(names, dtype=str),
+        "folder_index": np.concatenate(folder_index) if folder_index else np.empty(0, dtype=np.int32),
+        "offsets": offsets,
+        "neighbors": np.concatenate(neighbors).astype(np.int32) if neighbors else np.empty(0, dtype=np.int32),
+        "sources": np.repeat(np.arange(node_count, dtype=np.int32), np.diff(offsets)),
+        "folders": [folder for folder, _ in folder_graphs],
+    }
+
+def save_neighbor_graph(graph, graph_path):
+    """
+    Save a graph from merge_folder_graphs as .npy arrays plus folders.json.
+    """
+    os.makedirs(graph_path, exist_ok=True)
+    for key in GRAPH_ARRAYS:
+        np.save(os.path.join(graph_path, key + ".npy"), graph[key])
+    with open(os.path.join(graph_path, GRAPH_FOLDERS_FILE), 'w') as json_file:
+        json.dump(graph["folders"], json_file)
+
+
+class NeighborGraph:
+    """
+    Memory-mapped neighbour graph saved by save_neighbor_graph.
+
+    Node i is the tile names[i] in folders[folder_index[i]]; its neighbours
+    are neighbors[offsets[i]:offsets[i + 1]] in NEIGHBOR_OFFSETS order.
+    Every directed edge e goes from sources[e] to neighbors[e].
+    """
+
+    def __init__(self, graph_path):
+        self.graph_path = graph_path
+        for key in GRAPH_ARRAYS:
+            setattr(self, key, np.load(os.path.join(graph_path, key + ".npy"), mmap_mode="r"))
+        with open(os.path.join(graph_path, GRAPH_FOLDERS_FILE), 'r') as json_file:
+            self.folders = json.load(json_file)
+
+    def __len__(self):
+        return len(self.names)
+
+    @property
+    def edge_count(self):
+        return len(self.neighbors)
+
+    def node_path(self, node, image_root=""):
+        """
+        Path of a node's tile image, image_root + folder + "/" + filename.
+        """
+        return image_root + self.folders[self.folder_index[node]] + "/" + str(self.names[node])
+
+    def neighbors_of(self, node):
+        """
+        Node ids of a node's neighbours.
+        """
+        return self.neighbors[self.offsets[node]:self.offsets[node + 1]]
+
+    def sample_pairs(self, num_pairs, rng=None, exclude=()):
+        """
+        Sample distinct neighbour pairs uniformly, each drawn in O(1) from the edge arrays.
+
+        Every directed edge stands for one unordered pair, so only edges with
+        source < neighbour are kept; excluded pairs are rejected the same way.
+
+        Parameters:
+        num_pairs (int): Number of pairs; capped at the number of pairs in the graph less the excluded ones.
+        rng (numpy.random.Generator): Random generator, a fresh one if None.
+        exclude (set): (min node, max node) pairs that must not be drawn.
+
+        Returns:
+        list: (node, neighbour) id tuples.
+        """
+        rng = rng if rng is not None else np.random.default_rng()
+        num_pairs = min(num_pairs, self.edge_count // 2 - len(exclude))
+        pairs = {}
+        while len(pairs) < num_pairs:
+            edge = int(rng.integers(self.edge_count))
+            source, target = int(self.sources[edge]), int(self.neighbors[edge])
+            if source < target and (source, target) not in exclude:
+                pairs[(source, target)] = None
+        return list(pairs)
+
 
 # Example usage
 if __name__ == "__main__":
     parent_folder = tileset_path   # Replace with your parent folder path
+    graph_path = os.path.normpath(parent_folder) + "_neighbor_graph"
 
-    process_subfolders(parent_folder)
\ No newline at end of file
+    process_subfolders(parent_folder, graph_path)
\ No newline at end of file
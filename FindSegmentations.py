@@ -3,10 +3,18 @@ import os
 from CheckTileSimilarity import *
 from PIL import Image
 from CreateFileList import *
+from IngestCache import IngestCache
+from TileStore import TileStoreWriter
+import math
+import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
 
 tile_name = "tiles_"
 format = ".png"
 Similarity_threshold = 0.671875
+WRITE_SEGMENT_PNG = True        # combined_<seed>.png per segment
+WRITE_SEGMENT_STORE = False     # all segments of a tileset in one packed tile store (see TileStore.py)
 image_folder = "Data/GameTile/small_dataset/"
 out_path = "Data/GameTile/Json/"
 out_file = out_path+"small_all_tilesets.json"
@@ -171,185 +179,117 @@ def chekcAdjacent(image1_path, image2_path):
     else:
         return False
 
-def check_segment_for_tiles(target_folder, x_max, y_max, x, y, visited, area, unvisited_index, image_path_dictionary, parent):
-    rows, cols = y_max, x_max
-    print("rows = ", rows, "cols = ", cols)
-
-
-
-    # Boundary and value check
-    if y >= rows or x >= cols:
-        print("our of index", (x,y))
-        # del unvisited_index[getName(x,y)]
-        return
-    else:
-
-        print("check ", (x,y))
-        new_index = getName(x,y)
-        # print(new_index)
-        image1_path = image_path_dictionary[new_index]
-        # print(image1_path)
-
-        ### record as visited and delete from seed list
-        if new_index not in visited:
-            visited[new_index] = 1
-
-        else:
-            if visited[new_index] == 1:
-                print("was visited ", (x,y))
-
-        del unvisited_index[new_index]    
-    # if alpha == 0
-
-# is_image_mostly_blank(new_path):
-#             # if an blank image
-#             os.remove(new_path)
-    if is_almost_transparent(image1_path) == True:
-    # if is_image_mostly_blank(image1_path) == True:
-        print("0, delete", (x, y))
-        # del unvisited_index[getName(x,y)]
-        return
-    else: # not 0
-        if parent == "":
-            # no parent, mean it is the seed
-            print("this is seed ", (x,y))
-            parent = getName(x, y)
-            area[parent] = []
-        else:
-            pass
-
-    if parent not in area[parent]:
-        area[parent].append(getName(x,y)) 
-    if getName(x,y) not in area[parent]:
-        area[parent].append(getName(x,y))     
+def find_tile_segments(tiles, similarity_threshold=Similarity_threshold):
+    """
+    Group the non-transparent tiles of a grid into segments of adjacent, similar tiles.
 
+    One batch similarity gives the edge list of the sheet (right and down
+    neighbours whose checkSimilarity score reaches the threshold, both tiles
+    not almost transparent); segments are its connected components.
 
-    
-    # check right
-    if x+1 < cols:
-        print("rows = ", rows, "cols = ", cols)
-        print((x,y), "check right", (x+1, y))
-        # if matrix[y][x+1] == matrix[y][x]  and matrix[y][x] != 0 and getName(x+1, y) not in visited:
-        image2_path = image_path_dictionary[getName(x+1, y)]
-        # if chekcAdjacent(image1_path, image2_path) == True and is_image_mostly_blank(image1_path) == False and getName(x+1, y) not in visited:
-        if chekcAdjacent(image1_path, image2_path) == True and is_almost_transparent(image1_path) == False and getName(x+1, y) not in visited:
+    Parameters:
+    tiles (numpy.ndarray): Tile grid of shape (rows, cols, T, T, 4).
+    similarity_threshold (float): Minimum edge similarity for two tiles to be joined.
 
-            # check_segment(matrix, x+1, y, visited, area, unvisited_index, parent)
-            check_segment_for_tiles(target_folder, x_max, y_max, x+1, y, visited, area, unvisited_index, image_path_dictionary, parent)
-        else:
-            # del unvisited_index[getName(x+1,y)]
-            pass
-    # check left
-    if x-1 >= 0:
-        print("rows = ", rows, "cols = ", cols)
-        print((x,y), "check left", (x-1, y))
-        image2_path = image_path_dictionary[getName(x-1, y)]
-        # if chekcAdjacent(image1_path, image2_path) == True  and is_image_mostly_blank(image1_path) == False and getName(x-1, y) not in visited:
-        if chekcAdjacent(image1_path, image2_path) == True  and is_almost_transparent(image1_path) == False and getName(x-1, y) not in visited:
-            # check_segment(matrix, x-1, y, visited, area, unvisited_index, parent)
-            check_segment_for_tiles(target_folder, x_max, y_max, x-1, y, visited, area, unvisited_index, image_path_dictionary, parent)
-        else:
-            # del unvisited_index[getName(x+1,y)]
-            pass
-
-    # check down
-    if y+1 < rows:
-        print("rows = ", rows, "cols = ", cols)
-        print((x,y), "check", (x, y+1))
-        # if getName(x,y) not in area[parent]:
-        #     area[parent].append(getName(x,y))
+    Returns:
+    dict: {seed: [tile names]} with names "x_y"; the seed is the first tile of the
+    segment scanning column by column, and is listed first.
+    """
+    rows, cols = tiles.shape[:2]
+    flat_tiles = tiles.reshape(rows * cols, *tiles.shape[2:])
+    solid = ~is_almost_transparent_batch(tiles)
 
-        # if  matrix[y+1][x]== matrix[y][x] and matrix[y][x] != 0 and getName(x, y+1) not in visited:
-        image2_path = image_path_dictionary[getName(x, y+1)]
-        # if  chekcAdjacent(image1_path, image2_path) == True  and is_image_mostly_blank(image1_path) == False and getName(x, y+1) not in visited:
-        if  chekcAdjacent(image1_path, image2_path) == True  and is_almost_transparent(image1_path) == False and getName(x, y+1) not in visited:
-            # check_segment(matrix, x, y+1, visited, area, unvisited_index, parent)
-            check_segment_for_tiles(target_folder, x_max, y_max, x, y+1, visited, area, unvisited_index, image_path_dictionary, parent)
-        else:
-            pass
-            # del unvisited_index[getName(x,y+1)]       
-    # check top
-    if y-1 >= 0:
-        print("rows = ", rows, "cols = ", cols)
-        print((x,y), "check", (x, y-1))
-        # if getName(x,y) not in area[parent]:
-        #     area[parent].append(getName(x,y))
-        # if  matrix[y-1][x]== matrix[y][x] and matrix[y][x] != 0 and getName(x, y-1) not in visited:
-        image2_path = image_path_dictionary[getName(x, y-1)]
-        # if  chekcAdjacent(image1_path, image2_path) == True  and is_image_mostly_blank(image1_path) == False and getName(x, y-1) not in visited:
-        if  chekcAdjacent(image1_path, image2_path) == True  and is_almost_transparent(image1_path) == False and getName(x, y-1) not in visited:
-        # if  matrix[y-1][x]== matrix[y][x] and matrix[y][x] != 0 and getName(x, y-1) not in visited:
-            # check_segment(matrix, x, y-1, visited, area, unvisited_index, parent)
-            check_segment_for_tiles(target_folder, x_max, y_max, x, y-1, visited, area, unvisited_index, image_path_dictionary, parent)
-        else:
-            pass
-            # del unvisited_index[getName(x,y+1)]  
+    right, down = EdgeDescriptors(flat_tiles).grid_similarity(rows, cols)
+    join_right = (right >= similarity_threshold) & solid[:, :-1] & solid[:, 1:]
+    join_down = (down >= similarity_threshold) & solid[:-1, :] & solid[1:, :]
 
-    # Mark as visited and add to area
+    node = np.arange(rows * cols).reshape(rows, cols)
+    sources = np.concatenate([node[:, :-1][join_right], node[:-1, :][join_down]])
+    targets = np.concatenate([node[:, 1:][join_right], node[1:, :][join_down]])
+    graph = coo_matrix((np.ones(sources.size, dtype=np.int8), (sources, targets)), shape=(rows * cols, rows * cols))
+    _, labels = connected_components(graph, directed=False)
 
-    return
+    area = {}
+    seeds = {}
+    # column-major scan, the order the seed loop in SeparateObjects used to visit tiles
+    for x in range(cols):
+        for y in range(rows):
+            if not solid[y, x]:
+                continue
+            label = labels[node[y, x]]
+            if label not in seeds:
+                seeds[label] = getName(x, y)
+                area[seeds[label]] = []
+            area[seeds[label]].append(getName(x, y))
+    return area
 
 
 def SeparateObjects(image_folder, image_name, target_folder, tile_size):
-    # matrix = [
-    #     [1, 0, 2, 2, 2],
-    #     [1, 1, 0, 2, 0],
-    #     [0, 1, 0, 1, 0],
-    #     [3, 0, 1, 1, 0],
-    #     [3, 0, 1, 1, 1],
-    #     [3, 3, 0, 2, 2]
-    # ]
-    
-    tile_map_image = Image.open(image_folder+image_name)   
-    width, height = tile_map_image.size
+    tileset_array = load_rgba_array(image_folder+image_name)
+    height, width = tileset_array.shape[:2]
     x_max = math.floor(width/tile_size)
     y_max = math.floor(height/tile_size)
     print(width, height)
     print("x: ", x_max, y_max)
 
+    # only whole tiles take part in segmentation
+    tiles = tile_grid_view(tileset_array[:y_max * tile_size, :x_max * tile_size], tile_size)
+    area = find_tile_segments(tiles, Similarity_threshold)
+    print("Adjacent area:", area)
 
-    rows, cols = y_max, x_max
-    x = 0
-    y = 0
-    unvisited_index = {}
-    image_path_dictionary = {}
-    for x in range(cols):
-        for y in range(rows):
-            index = getName(x, y)
-            if index not in unvisited_index:
+    output_folder = create_segmented_folder(target_folder)
 
-                unvisited_index[index] = tile_name + index + format
-                image_path_dictionary[index] = target_folder + tile_name + index + format
-                new_image_path = target_folder + unvisited_index[index]
-                isExist = check_png_file_exists(new_image_path)
-                # print("image path = ", index,  unvisited_index[index], isExist, new_image_path)
-                
+    if not os.path.exists(output_folder):
+        os.makedirs(output_folder)
 
-    # print(unvisited_index)
-    visited = {}
+    store_path = output_folder + "segments_packed" if WRITE_SEGMENT_STORE else None
+    combine_tiles(area, tiles, output_folder, write_png=WRITE_SEGMENT_PNG, store_path=store_path)
 
-    start_x, start_y = 0, 0  # Starting point
-    # if matrix[start_x][start_y] == 1:
-    area = {}
-    while len(unvisited_index) > 0 :
-        # print(unvisited_index) 
-        start_x, start_y = getXY(next(iter(unvisited_index)))
-        print("new seed ", (start_x, start_y))
-        parent = ""
-        check_segment_for_tiles(target_folder, x_max, y_max, start_x, start_y, visited, area, unvisited_index, image_path_dictionary, parent)
-    
-        # Report the list of adjacent areas
-        print("Adjacent area:", area)
 
-    
-    input_image_folder = target_folder
-    output_folder = create_segmented_folder(target_folder)
 
-    if not os.path.exists(output_folder):
-        os.makedirs(output_folder)
+def combine_tiles(input_dict, tiles, output_folder, write_png=True, store_path=None):
+    """
+    Build each segment image straight from the in-memory tile grid.
+
+    The segment's bounding box is sliced out of the grid and tiles that are not
+    part of the segment are cleared to transparent, giving the same image
+    combine_images pastes together from the tile PNGs.
+
+    Parameters:
+    input_dict (dict): {seed: [tile names "x_y"]} as returned by find_tile_segments.
+    tiles (numpy.ndarray): Tile grid of shape (rows, cols, T, T, 4).
+    output_folder (str): Folder for combined_<seed>.png.
+    write_png (bool): Write one PNG per segment.
+    store_path (str): If set, also write every segment as a tileset named combined_<seed> into one packed tile store.
+    """
+    tile_size = tiles.shape[2]
+    store = TileStoreWriter(store_path, tile_size, append=False) if store_path else None
 
-    combine_images(area, input_image_folder, output_folder)
+    for seed, neighbors in input_dict.items():
+        if not neighbors:
+            continue
+        coords = np.array([getXY(tile) for tile in neighbors])
+        min_x, min_y = coords.min(axis=0)
+        max_x, max_y = coords.max(axis=0)
+
+        segment = tiles[min_y:max_y + 1, min_x:max_x + 1].copy()
+        outside = np.ones(segment.shape[:2], dtype=bool)
+        outside[coords[:, 1] - min_y, coords[:, 0] - min_x] = False
+        segment[outside] = 0
 
+        if store is not None:
+            store.add_tileset(f'combined_{seed}', segment, outside)
+
+        if write_png:
+            # (rows, cols, T, T, 4) -> (rows * T, cols * T, 4)
+            rows, cols = segment.shape[:2]
+            combined_image = segment.swapaxes(1, 2).reshape(rows * tile_size, cols * tile_size, 4)
+            output_path = os.path.join(output_folder, f'combined_{seed}.png')
+            Image.fromarray(combined_image, 'RGBA').save(output_path)
+
+    if store is not None:
+        store.close()
+    print(f'Saved {len(input_dict)} combined segments to {output_folder}')
 
 
 def combine_images(input_dict, image_folder, output_folder):
@@ -448,9 +388,19 @@ if __name__ == "__main__":
     # save_file_list_to_json(tileset_folder, out_file)
     
     # DisplayImage(tileset_folder+tileset_name, 32)
+    cache = IngestCache()
+    # SeparateObjects slices the sheet itself in memory rather than reading SliceTiles' output,
+    # so the sheet digest plus these parameters cover everything the stage reads
+    segment_params = {"tile_size": tile_size, "similarity_threshold": Similarity_threshold}
     for new_image in file_list:
         print(tileset_folder)
 
         new_image_name = getImageName(new_image)+".png"
         image_folder_path = target_folder + getImageName(new_image_name)+"_full/"        
-        SeparateObjects(tileset_folder, new_image_name, image_folder_path, 32)
\ No newline at end of file
+        segment_folder = image_folder_path.rstrip('/') + "_seg/"
+        if cache.is_fresh(new_image, "segments", segment_params):
+            print("[SKIP] segments up to date:", new_image_name)
+            continue
+        SeparateObjects(tileset_folder, new_image_name, image_folder_path, tile_size)
+        cache.record(new_image, "segments", segment_params, [segment_folder])
+        cache.save()  # after every tileset, so an interrupted run keeps the finished ones
\ No newline at end of file
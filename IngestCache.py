@@ -0,0 +1,149 @@
+import os
+import json
+import hashlib
+import tempfile
+
+# one manifest shared by every ingest stage (slicing, segmentation, connectivity)
+CACHE_MANIFEST = "Data/GameTile/ingest_cache.json"
+CACHE_VERSION = 1
+
+
+def save_json_atomic(data, json_path):
+    """
+    Write JSON to a temporary file and rename it over json_path, so readers never see a partial file.
+
+    Parameters:
+    data: JSON-serializable object.
+    json_path (str): Destination path.
+    """
+    directory = os.path.dirname(os.path.abspath(json_path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, json_path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+def file_digest(file_path, chunk_size=1 << 20):
+    """
+    Compute the SHA-256 digest of a file's bytes.
+
+    Parameters:
+    file_path (str): Path to the file.
+    chunk_size (int): Bytes read per step.
+
+    Returns:
+    str: Hex digest.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def file_stats(paths):
+    """
+    Fingerprint derived inputs, such as sliced tiles, that a stage reads besides its source sheet.
+
+    Re-slicing rewrites the tile files, so their sizes and mtimes change and
+    the stage keys that include them go stale without hashing every tile.
+
+    Parameters:
+    paths (list): Files read by the stage.
+
+    Returns:
+    list: [file name, size, mtime_ns] per file, in the given order.
+    """
+    stats = []
+    for path in paths:
+        stat = os.stat(path)
+        stats.append([os.path.basename(path), stat.st_size, stat.st_mtime_ns])
+    return stats
+
+def stage_key(content_digest, params):
+    """
+    Combine a content digest with the stage parameters (tile size, thresholds, ...).
+
+    Parameters:
+    content_digest (str): Digest of the source tileset bytes.
+    params (dict): JSON-serializable stage parameters.
+
+    Returns:
+    str: Hex digest identifying this (content, parameters) pair.
+    """
+    payload = content_digest + json.dumps(params, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class IngestCache:
+    """
+    Content-addressed record of which derived artifacts exist for each tileset.
+
+    Each stage is stored under the tileset path with the key of the tileset
+    bytes plus the stage parameters, and the artifact paths it produced. A
+    stage is up to date when the key still matches and every artifact exists.
+    File digests are reused while a file's size and mtime are unchanged, so an
+    unchanged corpus is checked without re-reading every sheet.
+    """
+
+    def __init__(self, manifest_path=CACHE_MANIFEST):
+        self.manifest_path = manifest_path
+        self.entries = {}
+        if os.path.exists(manifest_path):
+            with open(manifest_path, "r") as f:
+                data = json.load(f)
+            if data.get("version") == CACHE_VERSION:
+                self.entries = data.get("entries", {})
+
+    def save(self):
+        save_json_atomic({"version": CACHE_VERSION, "entries": self.entries}, self.manifest_path)
+
+    def content_digest(self, source_path):
+        """
+        Get the digest of a source file, re-hashing only when its size or mtime changed.
+        """
+        source_key = os.path.abspath(source_path)
+        stat = os.stat(source_path)
+        entry = self.entries.setdefault(source_key, {"stages": {}})
+        if entry.get("size") != stat.st_size or entry.get("mtime_ns") != stat.st_mtime_ns:
+            entry["digest"] = file_digest(source_path)
+            entry["size"] = stat.st_size
+            entry["mtime_ns"] = stat.st_mtime_ns
+        return entry["digest"]
+
+    def is_fresh(self, source_path, stage, params):
+        """
+        Check whether a stage's artifacts for this tileset are up to date.
+
+        Parameters:
+        source_path (str): Path to the tileset image.
+        stage (str): Stage name, e.g. "slice", "segments", "connectivity".
+        params (dict): Stage parameters that affect the output.
+
+        Returns:
+        bool: True if the stage can be skipped.
+        """
+        key = stage_key(self.content_digest(source_path), params)
+        record = self.entries[os.path.abspath(source_path)]["stages"].get(stage)
+        if record is None or record["key"] != key:
+            return False
+        return all(os.path.exists(path) for path in record["artifacts"])
+
+    def record(self, source_path, stage, params, artifacts):
+        """
+        Record the artifacts a stage produced for a tileset.
+
+        Parameters:
+        source_path (str): Path to the tileset image.
+        stage (str): Stage name.
+        params (dict): Stage parameters that affect the output.
+        artifacts (list): Paths of the files or folders written by the stage.
+        """
+        key = stage_key(self.content_digest(source_path), params)
+        self.entries[os.path.abspath(source_path)]["stages"][stage] = {
+            "key": key,
+            "artifacts": list(artifacts),
+        }
@@ -1,6 +1,10 @@
 import os
 import json
+import numpy as np
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
 from CheckTileSimilarity import *
+from CheckTileSimilarity import EdgeDescriptors, EDGE_SIDES, load_rgba_array
 
 json_path = "Data/GameTile/small_SimilarityLabel_pairs_verify/"
 # image_pair_file = json_path + "output_image_pairs_"+str(index)+".json"
@@ -8,6 +12,9 @@ json_path = "Data/GameTile/small_SimilarityLabel_pairs_verify/"
 out_path = "Data/GameTile/small_SimilarityLabel_auto/"
 # out_file = out_path+"label_similarity_"+str(index)+".json"
 # print("result: ", out_file)
+MERGED_SUFFIX = "_merged.json"  # all labeled pairs of a run, written next to the output folder as <folder>_merged.json
+
+NUM_WORKERS = os.cpu_count() or 1
 
 import os
 import json
@@ -42,24 +49,99 @@ def calculate_similarity(image1, image2):
     # This is a placeholder for demonstration purposes
     return similarity
 
-def label_connections(image_pairs, threshold):
+def pair_side(image1, image2):
+    """
+    Edge of image1 that faces image2, as checkSimilarity decides it from the tile indices.
+
+    Returns:
+    int: Index into EDGE_SIDES, or None if the tiles do not share a row or column.
+    """
+    x1, y1 = map(int, Path(image1).stem.split("_")[-2:])
+    x2, y2 = map(int, Path(image2).stem.split("_")[-2:])
+    if x1 == x2 and y1 > y2:
+        return EDGE_SIDES.index("top")
+    if x1 == x2 and y1 < y2:
+        return EDGE_SIDES.index("down")
+    if x1 > x2 and y1 == y2:
+        return EDGE_SIDES.index("left")
+    if x1 < x2 and y1 == y2:
+        return EDGE_SIDES.index("right")
+    return None
+
+def compute_group_similarities(image_pairs):
+    """
+    checkSimilarity for a group of pairs, loading every image once and scoring all pairs as one batch.
+
+    Parameters:
+    image_pairs (list): Dictionaries with "image1" and "image2" paths, usually from one tileset.
+
+    Returns:
+    list: Similarity per pair; 0.0 for tiles that are not edge neighbours, False for size mismatches.
+    """
+    paths = list(dict.fromkeys(path for pair in image_pairs for path in (pair['image1'], pair['image2'])))
+    images = {path: load_rgba_array(path) for path in paths}
+
+    # one descriptor set per tile shape
+    rows = {}
+    by_shape = {}
+    for path, image in images.items():
+        members = by_shape.setdefault(image.shape, [])
+        rows[path] = len(members)
+        members.append(path)
+    descriptors = {shape: EdgeDescriptors(np.stack([images[path] for path in members])) for shape, members in by_shape.items()}
+
+    similarities = [0.0] * len(image_pairs)
+    batches = {}
+    for i, pair in enumerate(image_pairs):
+        shape_1, shape_2 = images[pair['image1']].shape, images[pair['image2']].shape
+        if shape_1[:2] != shape_2[:2]:
+            similarities[i] = False
+            continue
+        side = pair_side(pair['image1'], pair['image2'])
+        if side is None:
+            continue
+        batches.setdefault((shape_1, shape_2), []).append((i, rows[pair['image1']], rows[pair['image2']], side))
+
+    for (shape_1, shape_2), batch in batches.items():
+        index, rows_1, rows_2, sides = (np.array(column) for column in zip(*batch))
+        values = descriptors[shape_1].similarity_to(rows_1, descriptors[shape_2], rows_2, sides)
+        for i, value in zip(index.tolist(), values.tolist()):
+            similarities[i] = value
+    return similarities
+
+def label_connections(image_pairs, threshold, num_workers=1):
     """
     Label the connections based on similarity threshold.
 
+    Pairs are grouped by the folder (tileset) of image1; each group is scored
+    in one batch, and groups are spread over num_workers processes.
+
     Parameters:
     image_pairs (list): List of dictionaries containing image pairs.
     threshold (float): The similarity threshold for labeling connections.
+    num_workers (int): Number of worker processes; 1 labels in this process.
 
     Returns:
     list: A list of dictionaries with the connection labels.
     """
-    labeled_pairs = []
-    for pair in image_pairs:
-        similarity = calculate_similarity(pair['image1'], pair['image2'])
-        pair['similarity'] = similarity
-        pair['connected'] = bool(similarity >= threshold)  # Ensure conversion to Python bool
-        labeled_pairs.append(pair)
-    print(labeled_pairs)
+    groups = {}
+    for i, pair in enumerate(image_pairs):
+        groups.setdefault(os.path.dirname(pair['image1']), []).append(i)
+    group_pairs = [[image_pairs[i] for i in members] for members in groups.values()]
+
+    if num_workers > 1 and len(group_pairs) > 1:
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            group_similarities = list(executor.map(compute_group_similarities, group_pairs))
+    else:
+        group_similarities = [compute_group_similarities(pairs) for pairs in group_pairs]
+
+    labeled_pairs = list(image_pairs)
+    for members, similarities in zip(groups.values(), group_similarities):
+        for i, similarity in zip(members, similarities):
+            pair = dict(image_pairs[i])
+            pair['similarity'] = similarity
+            pair['connected'] = bool(similarity >= threshold)  # Ensure conversion to Python bool
+            labeled_pairs[i] = pair
     return labeled_pairs
 
 def save_labeled_pairs(labeled_pairs, output_path):
@@ -74,26 +156,39 @@ def save_labeled_pairs(labeled_pairs, output_path):
         json.dump(labeled_pairs, file, indent=4)
     print(f"Labeled image pairs saved to {output_path}")
 
-def process_files(input_folder, output_folder, threshold):
+def process_files(input_folder, output_folder, threshold, num_workers=NUM_WORKERS, merged_path=None):
     """
     Process all JSON files in the input folder and save the labeled pairs to the output folder.
 
+    The pairs of all files are labeled in one batch; each file's labels are
+    saved under its own name, and all of them together in merged_path. The
+    merged file is kept out of output_folder, whose *.json files are read as
+    one label file each by the statistics, comparison and sampling tools.
+
     Parameters:
     input_folder (str): Path to the folder containing input JSON files.
     output_folder (str): Path to the folder where output JSON files will be saved.
     threshold (float): The similarity threshold for labeling connections.
+    num_workers (int): Number of worker processes.
+    merged_path (str): Merged label file; defaults to <output_folder>_merged.json.
     """
+    merged_path = merged_path or os.path.normpath(output_folder) + MERGED_SUFFIX
     if not os.path.exists(output_folder):
         os.makedirs(output_folder)
 
-    for filename in os.listdir(input_folder):
-        if filename.endswith('.json'):
-            input_file_path = os.path.join(input_folder, filename)
-            output_file_path = os.path.join(output_folder, filename)
-
-            image_pairs = load_image_pairs(input_file_path)
-            labeled_pairs = label_connections(image_pairs, threshold)
-            save_labeled_pairs(labeled_pairs, output_file_path)
+    filenames = sorted(filename for filename in os.listdir(input_folder) if filename.endswith('.json'))
+    file_pairs = [load_image_pairs(os.path.join(input_folder, filename)) for filename in filenames]
+    all_pairs = [pair for image_pairs in file_pairs for pair in image_pairs]
+    labeled = label_connections(all_pairs, threshold, num_workers)
+
+    merged = []
+    start = 0
+    for filename, image_pairs in zip(filenames, file_pairs):
+        labeled_pairs = labeled[start:start + len(image_pairs)]
+        start += len(image_pairs)
+        save_labeled_pairs(labeled_pairs, os.path.join(output_folder, filename))
+        merged.extend(dict(pair, source=filename) for pair in labeled_pairs)
+    save_labeled_pairs(merged, merged_path)
 
 # Example usage
 if __name__ == "__main__":
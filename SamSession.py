@@ -0,0 +1,181 @@
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+import torch
+from segment_anything import sam_model_registry, SamAutomaticMaskGenerator, SamPredictor
+
+# A SamSession loads the SAM checkpoint once and keeps it for a whole batch of
+# tilesets. Image embeddings for prompted prediction are cached per image key
+# (the full image path), so prompting a tileset several times runs the image
+# encoder once.
+
+SAM_CHECKPOINT = "Data/sam_vit_h_4b8939.pth"
+EMBEDDING_CACHE_SIZE = 8            # tilesets whose embeddings are kept (ViT-H: ~4 MB each)
+PROMPT_BATCH = 64                   # point prompts decoded per mask decoder call
+
+# SamAutomaticMaskGenerator settings, from cheapest to most thorough.
+# "balanced" is the library default that the extraction scripts used so far.
+SAM_PRESETS = {
+    "fast": {"points_per_side": 16, "points_per_batch": 256, "crop_n_layers": 0,
+             "pred_iou_thresh": 0.88, "stability_score_thresh": 0.95},
+    "balanced": {"points_per_side": 32, "points_per_batch": 64, "crop_n_layers": 0},
+    "quality": {"points_per_side": 32, "points_per_batch": 64, "crop_n_layers": 1,
+                "crop_n_points_downscale_factor": 2, "min_mask_region_area": 16},
+}
+
+_sessions = {}
+
+
+def load_image_rgb(image_path):
+    """
+    Load a tileset image for SAM.
+
+    Returns:
+    tuple: (image as read by cv2 with IMREAD_UNCHANGED, RGB uint8 array), or (None, None) if it cannot be read.
+    """
+    image = cv2.imread(image_path, cv2.IMREAD_UNCHANGED)
+    if image is None:
+        return None, None
+    if image.ndim == 2:
+        return image, cv2.cvtColor(image, cv2.COLOR_GRAY2RGB)
+    if image.shape[2] == 4:
+        return image, cv2.cvtColor(image, cv2.COLOR_BGRA2RGB)
+    return image, cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+
+class SamSession:
+    """
+    Long-lived SAM model with an automatic mask generator and a prompt predictor.
+
+    Parameters:
+    checkpoint (str): SAM checkpoint file.
+    model_type (str): sam_model_registry key, e.g. "vit_h" or "vit_b".
+    preset (str): SAM_PRESETS entry for the automatic mask generator.
+    num_threads (int): torch CPU threads; None keeps the torch default.
+    device (str): "cuda" or "cpu"; defaults to cuda when available.
+    cache_size (int): Tilesets kept in the embedding cache.
+    generator_params: SamAutomaticMaskGenerator arguments overriding the preset.
+    """
+
+    def __init__(self, checkpoint=SAM_CHECKPOINT, model_type="vit_h", preset="balanced", num_threads=None,
+                 device=None, cache_size=EMBEDDING_CACHE_SIZE, **generator_params):
+        if num_threads:
+            torch.set_num_threads(num_threads)
+        self.device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+        self.model = sam_model_registry[model_type](checkpoint=checkpoint)
+        self.model.to(device=self.device)
+        self.model.eval()
+
+        self.generator_params = dict(SAM_PRESETS[preset], **generator_params)
+        self.mask_generator = SamAutomaticMaskGenerator(self.model, **self.generator_params)
+        self.predictor = SamPredictor(self.model)
+        self.cache_size = cache_size
+        self._embeddings = OrderedDict()
+        self._image_key = None
+
+    def generate(self, image_rgb):
+        """
+        Automatic masks of an image, as SamAutomaticMaskGenerator.generate returns them.
+
+        Parameters:
+        image_rgb (numpy.ndarray): RGB uint8 image.
+
+        Returns:
+        list: Mask records with "segmentation", "bbox", "predicted_iou", ...
+        """
+        with torch.inference_mode():
+            return self.mask_generator.generate(image_rgb)
+
+    def set_image(self, image_rgb, key=None):
+        """
+        Prepare the predictor for prompts on an image, reusing a cached embedding for a known key
+        (use the full image path, so sheets with the same name in different folders stay apart).
+        """
+        if key is not None and key == self._image_key and self.predictor.is_image_set:
+            return
+        if key is not None and key in self._embeddings:
+            features, original_size, input_size = self._embeddings[key]
+            self._embeddings.move_to_end(key)
+            self.predictor.features = features
+            self.predictor.original_size = original_size
+            self.predictor.input_size = input_size
+            self.predictor.is_image_set = True
+        else:
+            with torch.inference_mode():
+                self.predictor.set_image(image_rgb)
+            if key is not None:
+                self._embeddings[key] = (self.predictor.features, self.predictor.original_size, self.predictor.input_size)
+                while len(self._embeddings) > self.cache_size:
+                    self._embeddings.popitem(last=False)
+        self._image_key = key
+
+    def predict_points(self, points, batch_size=PROMPT_BATCH):
+        """
+        One mask per foreground point prompt on the image given to set_image.
+
+        Each point is decoded with multimask output and its highest-scoring
+        mask kept, as the automatic generator does for its grid points.
+
+        Parameters:
+        points (numpy.ndarray): (N, 2) x, y pixel coordinates.
+        batch_size (int): Points per decoder call.
+
+        Returns:
+        list: Mask records in the format of generate: "segmentation", "bbox" (x, y, w, h),
+        "predicted_iou" and "point_coords".
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        records = []
+        with torch.inference_mode():
+            for start in range(0, len(points), batch_size):
+                batch = points[start:start + batch_size]
+                coords = self.predictor.transform.apply_coords(batch, self.predictor.original_size)
+                coords = torch.as_tensor(coords, dtype=torch.float, device=self.device)[:, None, :]
+                labels = torch.ones(coords.shape[:2], dtype=torch.int, device=self.device)
+                masks, scores, _ = self.predictor.predict_torch(coords, labels, multimask_output=True)
+                best = scores.argmax(dim=1)
+                index = torch.arange(len(best), device=best.device)
+                masks = masks[index, best].cpu().numpy()
+                scores = scores[index, best].cpu().numpy()
+                for point, mask, score in zip(batch, masks, scores):
+                    records.append({
+                        "segmentation": mask,
+                        "bbox": list(cv2.boundingRect(mask.astype(np.uint8))),
+                        "predicted_iou": float(score),
+                        "point_coords": [point.tolist()],
+                    })
+        return records
+
+    def process_queue(self, image_paths, handler, segment=None):
+        """
+        Segment a queue of tileset images with the loaded model.
+
+        Parameters:
+        image_paths (iterable): Tileset image paths.
+        handler (callable): handler(image_path, image, masks) for each image, with image as read by cv2.
+        segment (callable): segment(image_path, image, image_rgb) returning the masks of an image,
+        e.g. with point prompts; defaults to the automatic mask generator.
+
+        Returns:
+        dict: Image path -> handler result.
+        """
+        results = {}
+        for image_path in image_paths:
+            image, image_rgb = load_image_rgb(image_path)
+            if image is None:
+                print(f"Error: Unable to load image at {image_path}")
+                continue
+            masks = segment(image_path, image, image_rgb) if segment is not None else self.generate(image_rgb)
+            results[image_path] = handler(image_path, image, masks)
+        return results
+
+
+def get_session(checkpoint=SAM_CHECKPOINT, model_type="vit_h", preset="balanced", num_threads=None, **generator_params):
+    """
+    Shared SamSession per configuration, so repeated calls in one process load the checkpoint once.
+    """
+    key = (checkpoint, model_type, preset, num_threads, tuple(sorted(generator_params.items())))
+    if key not in _sessions:
+        _sessions[key] = SamSession(checkpoint, model_type, preset, num_threads, **generator_params)
+    return _sessions[key]
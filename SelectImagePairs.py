@@ -1,9 +1,13 @@
 import os
 import json
-import random
+from FindNeighbors import NeighborGraph
+from TileSampler import ReservoirSampler, sample_neighbor_pairs, load_labeled_pairs
 
 json_path = "Data/GameTile/small_dataset_neighbors/"
+graph_path = "Data/GameTile/small_dataset_neighbor_graph"  # written by FindNeighbors; used instead of the JSON files when it exists
 image_data_path = "Data/GameTile/small_dataset/"
+labeled_path = "Data/GameTile/small_SimilarityLabel_verify/"  # pairs labeled here are not selected again
+seed = None  # set an int for reproducible batches
 
 out_path = "Data/GameTile/Json/"
 
@@ -32,36 +36,61 @@ def load_json_files(parent_folder):
                     image_data.update(data)
     return image_data
 
-def get_random_image_pairs(image_data, num_pairs):
+def get_random_image_pairs(image_data, num_pairs, seed=None, exclude=()):
     """
     Get a specified number of random image pairs from the image data.
 
+    Images with neighbours are reservoir-sampled in one pass, then each gets
+    one random neighbour, so no image is picked twice.
+
     Parameters:
     image_data (dict): Dictionary containing image data and their neighbors.
     num_pairs (int): Number of random image pairs to select.
+    seed (int): Random seed.
+    exclude (set): frozenset({image1, image2}) pairs that must not be selected, e.g. already labeled ones.
 
     Returns:
-    list: A list of tuples, each containing a pair of image filenames and their folder names.
+    list: A list of {"image1", "image2"} dictionaries with image paths.
     """
+    def image_path(image):
+        return image_data_path+image_data[image]["folder"]+"/"+image
+
+    def allowed_neighbors(image):
+        return [neighbor for neighbor in image_data[image]["neighbors"]
+                if frozenset((image_path(image), image_path(neighbor))) not in exclude]
+
+    sampler = ReservoirSampler(num_pairs, seed)
+    for image in image_data:
+        if allowed_neighbors(image):
+            sampler.add(image)
+
     pairs = []
-    images = list(image_data.keys())
-    
-    while len(pairs) < num_pairs and images:
-        image = random.choice(images)
-        neighbors = image_data[image]["neighbors"]
-        if neighbors:
-            neighbor = random.choice(neighbors)
-            folder = image_data[image]["folder"]
-            print("folder = ", folder)
-            neighbor_folder = image_data[neighbor]["folder"]
-            print("neighbor_folder = ", neighbor_folder)
-            pairs.append({"image1":image_data_path+folder+"/"+image, "image2":image_data_path+neighbor_folder+"/"+neighbor})
-            images.remove(image)  # Optionally remove to avoid reselection
-        else:
-            images.remove(image)  # Remove images with no neighbors
-    
+    for image in sampler.sample():
+        neighbors = allowed_neighbors(image)
+        neighbor = neighbors[int(sampler.rng.integers(len(neighbors)))]
+        pairs.append({"image1": image_path(image), "image2": image_path(neighbor)})
     return pairs
 
+def sample_graph_pairs(graph, num_pairs, seed=None, exclude=()):
+    """
+    Get a specified number of random neighbour pairs from a neighbour graph.
+
+    Pairs are drawn uniformly over all neighbouring tile pairs, each in O(1)
+    from the graph's edge arrays, without loading the neighbour lists of the
+    corpus into memory; excluded pairs are rejected and drawn again.
+
+    Parameters:
+    graph (NeighborGraph): Graph saved by FindNeighbors.process_subfolders.
+    num_pairs (int): Number of random image pairs to select.
+    seed (int): Random seed.
+    exclude (set): frozenset({image1, image2}) pairs that must not be selected, e.g. already labeled ones.
+
+    Returns:
+    list: A list of {"image1", "image2"} dictionaries with image paths.
+    """
+    return [{"image1": graph.node_path(source, image_data_path), "image2": graph.node_path(target, image_data_path)}
+            for source, target in sample_neighbor_pairs(graph, num_pairs, seed, exclude=exclude, image_root=image_data_path)]
+
 def save_image_pairs(pairs, output_path):
     """
     Save the selected image pairs to a JSON file.
@@ -80,8 +109,16 @@ if __name__ == "__main__":
     output_path = out_path+"output_image_pairs"  # Replace with the path to save the output JSON file
     num_pairs = 20  # Specify the number of image pairs you want
 
+    graph = NeighborGraph(graph_path) if os.path.exists(graph_path) else None
+    image_data = load_json_files(parent_folder) if graph is None else None
+    exclude = load_labeled_pairs(labeled_path)
     for i in range(10):
         new_out_file = output_path+"_"+str(i)+".json"
-        image_data = load_json_files(parent_folder)
-        pairs = get_random_image_pairs(image_data, num_pairs)
+        batch_seed = None if seed is None else seed + i
+        if graph is not None:
+            pairs = sample_graph_pairs(graph, num_pairs, batch_seed, exclude)
+        else:
+            pairs = get_random_image_pairs(image_data, num_pairs, batch_seed, exclude)
+        # keep the batches disjoint
+        exclude |= {frozenset((pair["image1"], pair["image2"])) for pair in pairs}
         save_image_pairs(pairs, new_out_file)
\ No newline at end of file
@@ -3,8 +3,10 @@ from PIL import Image
 import numpy as np
 import math
 from pathlib import Path
-from rembg import remove
+from rembg import remove, new_session
 from io import BytesIO
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 import matplotlib.pyplot as plt
 # from matplotlib.pyplot import imshow
@@ -13,12 +15,20 @@ import json
 from skimage.metrics import structural_similarity as ssim
 from CheckTileSimilarity import *
 from DisplayImage import *
+from IngestCache import IngestCache, CACHE_MANIFEST, save_json_atomic
+from TileStore import TileStoreWriter, merge_tile_stores
 
 
 TILE_SIZE = 32
 TILE_WIDTH = 32
 TITLE_HEIGHT = 64
 SIMILARITY_THRESHOLDS = 0.5 
+TRANSPARENCY_THRESHOLD = 0.95
+ALPHA_THRESHOLD = 10
+NUM_WORKERS = os.cpu_count() or 1
+CHECKPOINT_EVERY = 20        # save the manifest and ingest cache after this many finished tilesets
+WRITE_PNG = True            # one PNG per tile in <name>/, <name>_full/, <name>_black/, <name>_white/
+WRITE_TILE_STORE = False    # packed tile store in <name>_packed/ (see TileStore.py)
 
 # tileset_path = "Data/GameTile/Tilesets/"
 tileset_path = "Data/GameTile/small_Tilesets/"
@@ -134,121 +144,127 @@ def SliceTile(image_path, out_path, tile_width, tile_height, starting_index):
 
   
 
-### target: slice tiles with certain size, but label the file with x, y coordinate
-def SliceTileCoordinate(image_path, out_path, tile_size):
-    # Load the tile map image
-    tile_map_image = Image.open(image_path)
-    # plt.imshow(tile_map_image)    
-    # image_array = np.array(tile_map_image)
-    # # print(image_array.shape)
-    # # plt.imshow(image_array)
-    # # Customize the x-axis and y-axis labels
-    # tick_interval = 32
-    # # print(image_array.shape[1])
-    # ticks_x = np.arange(0, image_array.shape[1], tick_interval)
-    # ticks_y = np.arange(0, image_array.shape[0], tick_interval)
-    # labels_x = np.arange(len(ticks_x))
-    # labels_y = np.arange(len(ticks_y))
-    # print(labels_x)
-    # print(labels_y)
- 
-
-    # plt.xticks(ticks_x, labels_x)
-    # plt.yticks(ticks_y, labels_y)    
-    
-
-    # plt.show()
-
-    width, height = tile_map_image.size
-    # print(width)
-    # print(height)
-
-
-    # Define the item sizes in the tile map (x, y, width, height)
-    # tile_size = TILE_SIZE
-    # (x1, y1, x2, y2)
-    w_shift = 0
-    h_shift = 0
-    
-    items = []
-    while h_shift < height:
-        while w_shift < width:
-            x1 = w_shift
-            y1 = h_shift
-            items.append((x1, y1,  tile_size,  tile_size))
-            # print((x1, y1,  tile_size,  tile_size))
-
-            w_shift = w_shift +  tile_size
-        
-        w_shift = 0
-        h_shift = h_shift + tile_size
+@lru_cache(maxsize=None)
+def load_background_tile(background_path, tile_size):
+    """
+    Load a background image resized to one tile, cached per (path, size).
 
-    print("End record bounding boxes!  ", image_path)
+    Parameters:
+    background_path (str): Path to the background image file.
+    tile_size (int): Edge length of a square tile.
 
-    # Iterate through the defined items and extract each one
-    tiles = {}
-    tile_annotations = {}
-    for (x, y, width, height) in items:
-        x_index = math.floor(x/tile_size)
-        y_index = math.floor(y/tile_size)
-        tile_key = str(x_index) +"_"+ str(y_index)
-        tile = tile_map_image.crop((x, y, x + width, y + height))
-        # tiles[tile_key] = {}
-        tiles[tile_key] = tile
-        #tile_name	is_part	is_whole source	belong_to is_texture is_object	connection	object_class
-        tile_annotations[tile_key] = {}
-        tile_annotations[tile_key]["source"] = getImageName(image_path)
-        # tile_annotations[tile_key]["tile"] = tile
-        tile_annotations[tile_key]["x_index"] = x_index
-        tile_annotations[tile_key]["y_index"] = y_index
-        tile_annotations[tile_key]["name"] = "tiles_"+tile_key
+    Returns:
+    numpy.ndarray: Read-only uint8 RGBA array of shape (tile_size, tile_size, 4).
+    """
+    with Image.open(background_path) as background:
+        background = background.convert("RGBA").resize((tile_size, tile_size), Image.LANCZOS)
+        background_array = np.asarray(background)
+    background_array.flags.writeable = False
+    return background_array
+
+### Image.alpha_composite for a whole batch of tiles
+def composite_tiles(background, tiles):
+    """
+    Composite a stack of RGBA tiles over one RGBA background.
 
-    # Save or use the extracted tiles
-    directory = out_path + "/"+getImageName(image_path)
-    no_reduce_directory = out_path + "/"+getImageName(image_path)+"_full"
-    black_directory = out_path + "/"+getImageName(image_path)+"_black"
-    white_directory = out_path + "/"+getImageName(image_path)+"_white"
-    # print("Path:", directory, black_directory, white_directory)
-    
-    if not os.path.exists(directory):
-        os.makedirs(directory)
-    if not os.path.exists(no_reduce_directory):
-        os.makedirs(no_reduce_directory)        
-    if not os.path.exists(black_directory):
-        os.makedirs(black_directory)
+    Matches Image.alpha_composite(background, tile) for every tile.
 
-    if not os.path.exists(white_directory):
-        os.makedirs(white_directory)
+    Parameters:
+    background (numpy.ndarray): uint8 array of shape (T, T, 4).
+    tiles (numpy.ndarray): uint8 array of shape (N, T, T, 4).
 
-    for key in tile_annotations.keys():
-        new_path = directory+"/"+ tile_annotations[key]["name"]+".png"
-        new_no_reduce_path = no_reduce_directory+"/"+ tile_annotations[key]["name"]+".png"
-        new_black_path = black_directory+"/"+ tile_annotations[key]["name"]+".png"
-        new_white_path = white_directory+"/"+ tile_annotations[key]["name"]+".png"
+    Returns:
+    numpy.ndarray: uint8 array of shape (N, T, T, 4).
+    """
+    fg_alpha = tiles[..., 3:].astype(np.float32) / 255.0
+    bg_alpha = background[..., 3:].astype(np.float32) / 255.0
+    bg_weight = bg_alpha * (1.0 - fg_alpha)
+    out_alpha = fg_alpha + bg_weight
 
-        tiles[key].save(new_path)
-        tiles[key].save(new_no_reduce_path)
+    out_rgb = tiles[..., :3] * fg_alpha + background[..., :3] * bg_weight
+    out_rgb /= np.where(out_alpha == 0, 1.0, out_alpha)
 
-        # if is_image_mostly_blank(new_path):
-        if is_almost_transparent(new_path):
-        
-            # if an blank image
-            os.remove(new_path)
-            # if not os.path.exists(new_path):
-            #     print(" Succeful remove: ", new_path)
-        else:
-            # not blank
-            overlay_images(black_back_image, new_path, new_black_path)
-            overlay_images(white_back_image, new_path, new_white_path)
+    combined = np.empty(tiles.shape, dtype=np.uint8)
+    combined[..., :3] = np.rint(out_rgb)
+    combined[..., 3:] = np.rint(out_alpha * 255.0)
+    return combined
 
+### target: slice tiles with certain size, but label the file with x, y coordinate
+def SliceTileCoordinate(image_path, out_path, tile_size, write_png=True, write_store=False):
+    """
+    Slice a tileset into tiles named by their x, y grid coordinate.
 
+    The tileset is decoded once; transparency and the black/white composites are
+    computed for all tiles in one batch, and files are only written at the end.
+    PNG output is <name>/ (non-transparent tiles), <name>_full/ (all tiles),
+    <name>_black/ and <name>_white/ (composites of the non-transparent tiles).
+    Store output is one packed tile store in <name>_packed/ holding the full
+    grid with the transparency flag set.
 
+    Parameters:
+    image_path (str): Path to the tileset image.
+    out_path (str): Output folder.
+    tile_size (int): Edge length of a square tile.
+    write_png (bool): Write the per-tile PNG folders.
+    write_store (bool): Write the packed tile store.
 
+    Returns:
+    dict: Tile annotations keyed by "x_y".
+    """
+    tiles = tile_grid_view(load_rgba_array(image_path), tile_size)
+    rows, cols = tiles.shape[:2]
+    print("End record bounding boxes!  ", image_path)
 
+    image_name = getImageName(image_path)
+    tile_annotations = {}
+    for y_index in range(rows):
+        for x_index in range(cols):
+            tile_key = str(x_index) +"_"+ str(y_index)
+            #tile_name	is_part	is_whole source	belong_to is_texture is_object	connection	object_class
+            tile_annotations[tile_key] = {}
+            tile_annotations[tile_key]["source"] = image_name
+            tile_annotations[tile_key]["x_index"] = x_index
+            tile_annotations[tile_key]["y_index"] = y_index
+            tile_annotations[tile_key]["name"] = "tiles_"+tile_key
+
+    transparent = is_almost_transparent_batch(tiles, TRANSPARENCY_THRESHOLD, ALPHA_THRESHOLD)
+
+    if write_store:
+        with TileStoreWriter(out_path + "/"+image_name+"_packed", tile_size, append=False) as store:
+            store.add_tileset(image_name, tiles, transparent)
+
+    if not write_png:
+        return tile_annotations
+
+    # batch composites for the kept tiles
+    kept_y, kept_x = np.nonzero(~transparent)
+    kept_tiles = tiles[kept_y, kept_x]
+    black_tiles = composite_tiles(load_background_tile(black_back_image, tile_size), kept_tiles)
+    white_tiles = composite_tiles(load_background_tile(white_back_image, tile_size), kept_tiles)
 
-    # for index, tile in enumerate(tiles):
-    #     # new_image_path = 'Data/GameTile/dataset/tile_{index}.png'
-    #     tile.save(directory+"/tiles_"+str(starting_index + index)+".png")
+    # Save or use the extracted tiles
+    directory = out_path + "/"+image_name
+    no_reduce_directory = out_path + "/"+image_name+"_full"
+    black_directory = out_path + "/"+image_name+"_black"
+    white_directory = out_path + "/"+image_name+"_white"
+    for folder in (directory, no_reduce_directory, black_directory, white_directory):
+        os.makedirs(folder, exist_ok=True)
+
+    for y_index in range(rows):
+        for x_index in range(cols):
+            file_name = "tiles_"+str(x_index)+"_"+str(y_index)+".png"
+            Image.fromarray(tiles[y_index, x_index], "RGBA").save(no_reduce_directory+"/"+file_name)
+            if transparent[y_index, x_index]:
+                # drop a blank tile left over from an earlier run
+                stale_path = directory+"/"+file_name
+                if os.path.exists(stale_path):
+                    os.remove(stale_path)
+
+    for index, (y_index, x_index) in enumerate(zip(kept_y, kept_x)):
+        file_name = "tiles_"+str(x_index)+"_"+str(y_index)+".png"
+        Image.fromarray(tiles[y_index, x_index], "RGBA").save(directory+"/"+file_name)
+        Image.fromarray(black_tiles[index], "RGBA").save(black_directory+"/"+file_name)
+        Image.fromarray(white_tiles[index], "RGBA").save(white_directory+"/"+file_name)
 
     return tile_annotations
 
@@ -281,6 +297,20 @@ def get_file_list(folder_path):
     return file_list
 
 ## remove backgroud if the tileset has background
+_rembg_session = None
+
+def get_rembg_session():
+    """
+    Create the rembg model session once per process and reuse it.
+
+    Returns:
+    rembg session object.
+    """
+    global _rembg_session
+    if _rembg_session is None:
+        _rembg_session = new_session()
+    return _rembg_session
+
 def remove_background(image_path):
     """
     Remove the background from an image using rembg library.
@@ -294,60 +324,95 @@ def remove_background(image_path):
     with open(image_path, 'rb') as image_file:
         input_image = image_file.read()
     
-    output_image = remove(input_image)
+    output_image = remove(input_image, session=get_rembg_session())
     img = Image.open(BytesIO(output_image))
     return img
 
-def convert_to_png_remove_back(folder_path):
+def convert_file_to_png(file_path, remove_back=False):
     """
-    Convert images in a folder to PNG format and remove background for non-PNG images.
+    Convert one image to PNG next to the original, optionally removing its background.
+
+    Parameters:
+    file_path (str): Path to the image file.
+    remove_back (bool): Run rembg background removal before saving.
+
+    Returns:
+    str: Path of the saved PNG, or None if it failed.
+    """
+    file_name, file_ext = os.path.splitext(file_path)
+    png_path = f"{file_name}.png"
+    try:
+        if remove_back:
+            print("current file is ", file_ext)
+            image = remove_background(file_path)
+        else:
+            image = Image.open(file_path)
+        image.save(png_path, "PNG")
+        print(f"Converted and saved: {png_path}")
+        return png_path
+    except Exception as e:
+        print(f"Failed to process {file_path}: {e}")
+        return None
+
+def is_png_up_to_date(file_path):
+    """
+    Check whether the PNG converted from file_path exists and is newer than it.
+
+    Parameters:
+    file_path (str): Path to the non-PNG source image.
+
+    Returns:
+    bool: True if conversion can be skipped.
+    """
+    png_path = os.path.splitext(file_path)[0] + ".png"
+    return os.path.exists(png_path) and os.path.getmtime(png_path) >= os.path.getmtime(file_path)
+
+def convert_folder_to_png(folder_path, remove_back=False, num_workers=NUM_WORKERS):
+    """
+    Convert every non-PNG image in a folder to PNG, spread over worker processes.
 
     Parameters:
     folder_path (str): Path to the folder containing images.
+    remove_back (bool): Run rembg background removal before saving.
+    num_workers (int): Number of worker processes.
+
+    Returns:
+    list: Paths of the saved PNG files.
     """
     file_list = [entry.path for entry in os.scandir(folder_path) if entry.is_file()]
+    # Skip if already a PNG
+    file_list = [file_path for file_path in file_list if os.path.splitext(file_path)[1].lower() != '.png']
+    # Skip if converted PNG is already newer than the source
+    file_list = [file_path for file_path in file_list if not is_png_up_to_date(file_path)]
+    if not file_list:
+        return []
+
+    if num_workers <= 1:
+        results = [convert_file_to_png(file_path, remove_back) for file_path in file_list]
+    else:
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            results = list(executor.map(convert_file_to_png, file_list, [remove_back] * len(file_list)))
+    return [png_path for png_path in results if png_path is not None]
+
+def convert_to_png_remove_back(folder_path, num_workers=NUM_WORKERS):
+    """
+    Convert images in a folder to PNG format and remove background for non-PNG images.
 
-    for file_path in file_list:
-        file_name, file_ext = os.path.splitext(file_path)
-        
-        # Skip if already a PNG
-        if file_ext.lower() == '.png':
-            continue
-        
-        # Remove background for non-PNG images
-        print("current file is ", file_ext)
-        image = remove_background(file_path)
-        
-        if image:
-            png_path = f"{file_name}.png"
-            image.save(png_path, "PNG")
-            print(f"Converted and saved: {png_path}")
-        else:
-            print(f"Failed to process: {file_path}")
+    Parameters:
+    folder_path (str): Path to the folder containing images.
+    num_workers (int): Number of worker processes.
+    """
+    return convert_folder_to_png(folder_path, remove_back=True, num_workers=num_workers)
 
-def convert_to_png_only(folder_path):
+def convert_to_png_only(folder_path, num_workers=NUM_WORKERS):
     """
     Convert all images in the specified folder to PNG format.
 
     Parameters:
     folder_path (str): Path to the folder containing images.
+    num_workers (int): Number of worker processes.
     """
-    file_list = [entry.path for entry in os.scandir(folder_path) if entry.is_file()]
-
-    for file_path in file_list:
-        file_name, file_ext = os.path.splitext(file_path)
-        
-        # Skip if already a PNG
-        if file_ext.lower() == '.png':
-            continue
-        
-        try:
-            image = Image.open(file_path)
-            png_path = f"{file_name}.png"
-            image.save(png_path, "PNG")
-            print(f"Converted and saved: {png_path}")
-        except Exception as e:
-            print(f"Failed to process {file_path}: {e}")
+    return convert_folder_to_png(folder_path, remove_back=False, num_workers=num_workers)
 
 # overlap images
 def overlay_images(background_path, foreground_path, output_path):
@@ -373,6 +438,147 @@ def overlay_images(background_path, foreground_path, output_path):
     combined.save(output_path)
     # print(f"Image saved to {output_path}")
 
+## batch ingest: slice many tilesets over a process pool
+def get_sheet_area(image_path):
+    """
+    Get the pixel area of an image from its header, without decoding it.
+
+    Parameters:
+    image_path (str): Path to the image file.
+
+    Returns:
+    int: width * height.
+    """
+    with Image.open(image_path) as image:
+        width, height = image.size
+    return width * height
+
+def slice_tileset_task(image_path, out_path, tile_size, write_png=True, write_store=False):
+    """
+    Worker task: slice one tileset.
+
+    Parameters:
+    image_path (str): Path to the tileset image.
+    out_path (str): Output folder.
+    tile_size (int): Edge length of a square tile.
+    write_png (bool): Write the per-tile PNG folders.
+    write_store (bool): Write the packed tile store.
+
+    Returns:
+    tuple: (image_name, tile_annotations)
+    """
+    return getImageName(image_path), SliceTileCoordinate(image_path, out_path, tile_size, write_png, write_store)
+
+def get_slice_params(tile_size, write_png=True, write_store=False):
+    """
+    Parameters that change the slicing output, used as part of the ingest cache key.
+    """
+    return {"tile_size": tile_size, "threshold": TRANSPARENCY_THRESHOLD, "alpha_threshold": ALPHA_THRESHOLD,
+            "write_png": write_png, "write_store": write_store}
+
+def get_slice_artifacts(image_path, out_path, write_png=True, write_store=False):
+    """
+    Folders written by SliceTileCoordinate for one tileset.
+    """
+    image_name = getImageName(image_path)
+    suffixes = []
+    if write_png:
+        suffixes += ["", "_full", "_black", "_white"]
+    if write_store:
+        suffixes.append("_packed")
+    return [out_path + "/" + image_name + suffix for suffix in suffixes]
+
+def batch_ingest(folder_path, out_path, tile_size, manifest_path, num_workers=NUM_WORKERS, remove_back=False, cache_path=CACHE_MANIFEST,
+                 write_png=WRITE_PNG, write_store=WRITE_TILE_STORE, corpus_store_path=None):
+    """
+    Convert and slice every tileset in a folder over a process pool.
+
+    Tilesets are submitted one at a time, largest first (by pixel area), so the
+    biggest sheets start first on separate workers. The annotations of all
+    sheets are merged into one manifest; it and the ingest cache are saved
+    atomically every CHECKPOINT_EVERY finished sheets and at the end, and a
+    sheet that fails is reported and left out, so the next run retries only it.
+    With a cache_path, sheets whose bytes and slicing parameters are unchanged
+    since the last run are skipped and keep their annotations from the
+    previous manifest.
+
+    Parameters:
+    folder_path (str): Folder with the tileset images.
+    out_path (str): Output folder for the sliced tiles.
+    tile_size (int): Edge length of a square tile.
+    manifest_path (str): Path of the merged annotation JSON.
+    num_workers (int): Number of worker processes.
+    remove_back (bool): Use rembg background removal when converting non-PNG images.
+    cache_path (str): Ingest cache manifest, or None to re-slice everything.
+    write_png (bool): Write the per-tile PNG folders.
+    write_store (bool): Write one packed tile store per tileset.
+    corpus_store_path (str): If set (with write_store), also merge all per-tileset stores into this store.
+
+    Returns:
+    dict: Tile annotations keyed by tileset name.
+    """
+    convert_folder_to_png(folder_path, remove_back=remove_back, num_workers=num_workers)
+
+    file_list = [file_path for file_path in get_file_list(folder_path) if file_path.lower().endswith(".png")]
+
+    manifest = {}
+    params = get_slice_params(tile_size, write_png, write_store)
+    cache = IngestCache(cache_path) if cache_path else None
+    if cache is not None and os.path.exists(manifest_path):
+        with open(manifest_path, "r") as f:
+            previous_manifest = json.load(f)
+        dirty_list = []
+        for image_path in file_list:
+            image_name = getImageName(image_path)
+            if image_name in previous_manifest and cache.is_fresh(image_path, "slice", params):
+                manifest[image_name] = previous_manifest[image_name]
+            else:
+                dirty_list.append(image_path)
+        file_list = dirty_list
+
+    file_list.sort(key=get_sheet_area, reverse=True)
+    print(f"Slicing {len(file_list)} tilesets with {num_workers} workers ({len(manifest)} up to date)")
+
+    def checkpoint():
+        save_json_atomic(manifest, manifest_path)
+        if cache is not None:
+            cache.save()
+
+    def finish(image_path, task):
+        try:
+            image_name, tile_annotations = task()
+        except Exception as e:
+            print(f"Error slicing {image_path}: {e}")
+            return
+        manifest[image_name] = tile_annotations
+        if cache is not None:
+            cache.record(image_path, "slice", params, get_slice_artifacts(image_path, out_path, write_png, write_store))
+        finished.append(image_path)
+        if len(finished) % CHECKPOINT_EVERY == 0:
+            checkpoint()
+
+    finished = []
+    try:
+        if num_workers <= 1:
+            for image_path in file_list:
+                finish(image_path, lambda: slice_tileset_task(image_path, out_path, tile_size, write_png, write_store))
+        else:
+            with ProcessPoolExecutor(max_workers=num_workers) as executor:
+                # submitted largest first, one sheet per task
+                futures = {executor.submit(slice_tileset_task, image_path, out_path, tile_size, write_png, write_store): image_path
+                           for image_path in file_list}
+                for future in as_completed(futures):
+                    finish(futures[future], future.result)
+    finally:
+        checkpoint()
+    print(f"Annotation manifest saved to {manifest_path} ({len(finished)} of {len(file_list)} tilesets sliced)")
+
+    if write_store and corpus_store_path:
+        store_paths = [out_path + "/" + image_name + "_packed" for image_name in sorted(manifest)]
+        merge_tile_stores(store_paths, corpus_store_path)
+        print(f"Corpus tile store saved to {corpus_store_path}")
+    return manifest
+
 if __name__ == "__main__":
 
     print("This script slice the tile sets")
@@ -393,31 +599,8 @@ if __name__ == "__main__":
 
 
     folder_path = tileset_path  # Replace with your folder path
-    convert_to_png_only(folder_path)
-
-
-    folder_path = tileset_path  # Replace with your folder path
-    files = get_file_list(folder_path)
-    print(f"Files in '{folder_path}':")
-    file_list = []
-    for file in files:
-        if file not in file_list:
-            file_list.append(file)
-            # print(file)
-
-    print(json.dumps(file_list, indent=4))
-
-
-
-
-
-    index = 0
-    for image_path in file_list:
-        image_source_name = getImageName(image_path)
-        # DisplayImage(image_path, TILE_SIZE)
-        tileset_annotations = SliceTileCoordinate(image_path, out_path, TILE_SIZE)
-        with open(out_path+image_source_name+"_step_"+str(index)+".json", "w") as f:
-            json.dump(tileset_annotations, f)
+    manifest_path = out_path+"tileset_annotations.json"
+    batch_ingest(folder_path, out_path, TILE_SIZE, manifest_path, num_workers=NUM_WORKERS)
 
     #     # Find adjacent
 
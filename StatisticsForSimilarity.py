@@ -2,10 +2,245 @@ import os
 import json
 import numpy as np
 import scipy.stats as stats
+from concurrent.futures import ProcessPoolExecutor
 
 json_path = "Data/GameTile/small_SimilarityLabel/"
 out_path = "Data/GameTile/Json/"
 
+NUM_WORKERS = os.cpu_count() or 1
+SKETCH_K = 2048             # quantile sketch size; rank error is roughly 1.7 / SKETCH_K ** 0.9
+
+
+class MomentAccumulator:
+    """
+    Count, min, max and central moments up to the 4th, updated in batches and
+    mergeable (Welford / Chan-Pebay pairwise updates), so the statistics of
+    calculate_statistics come out without keeping the values.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.m3 = 0.0
+        self.m4 = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+
+    @classmethod
+    def from_values(cls, values):
+        moments = cls()
+        values = np.asarray(values, dtype=np.float64)
+        if values.size:
+            deviation = values - values.mean()
+            moments.count = values.size
+            moments.mean = float(values.mean())
+            moments.m2 = float(np.sum(deviation ** 2))
+            moments.m3 = float(np.sum(deviation ** 3))
+            moments.m4 = float(np.sum(deviation ** 4))
+            moments.min = float(values.min())
+            moments.max = float(values.max())
+        return moments
+
+    def update(self, values):
+        self.merge(MomentAccumulator.from_values(values))
+
+    def merge(self, other):
+        """
+        Add the values summarized by other.
+        """
+        if other.count == 0:
+            return
+        if self.count == 0:
+            self.__dict__.update(other.__dict__)
+            return
+        n_a, n_b = self.count, other.count
+        n = n_a + n_b
+        delta = other.mean - self.mean
+        m2 = self.m2 + other.m2 + delta ** 2 * n_a * n_b / n
+        m3 = (self.m3 + other.m3 + delta ** 3 * n_a * n_b * (n_a - n_b) / n ** 2
+              + 3 * delta * (n_a * other.m2 - n_b * self.m2) / n)
+        m4 = (self.m4 + other.m4 + delta ** 4 * n_a * n_b * (n_a ** 2 - n_a * n_b + n_b ** 2) / n ** 3
+              + 6 * delta ** 2 * (n_a ** 2 * other.m2 + n_b ** 2 * self.m2) / n ** 2
+              + 4 * delta * (n_a * other.m3 - n_b * self.m3) / n)
+        self.count, self.mean, self.m2, self.m3, self.m4 = n, self.mean + delta * n_b / n, m2, m3, m4
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def subtract(self, other):
+        """
+        Remove the values summarized by other (a subset of the values added); the inverse of merge.
+        min and max are left for the caller to fix.
+        """
+        n, n_b = self.count, other.count
+        n_a = n - n_b
+        if n_a <= 0:
+            self.__init__()
+            return
+        mean_a = (n * self.mean - n_b * other.mean) / n_a
+        delta = other.mean - mean_a
+        m2_a = self.m2 - other.m2 - delta ** 2 * n_a * n_b / n
+        m3_a = (self.m3 - other.m3 - delta ** 3 * n_a * n_b * (n_a - n_b) / n ** 2
+                - 3 * delta * (n_a * other.m2 - n_b * m2_a) / n)
+        m4_a = (self.m4 - other.m4 - delta ** 4 * n_a * n_b * (n_a ** 2 - n_a * n_b + n_b ** 2) / n ** 3
+                - 6 * delta ** 2 * (n_a ** 2 * other.m2 + n_b ** 2 * m2_a) / n ** 2
+                - 4 * delta * (n_a * other.m3 - n_b * m3_a) / n)
+        self.count, self.mean, self.m2, self.m3, self.m4 = n_a, mean_a, max(m2_a, 0.0), m3_a, max(m4_a, 0.0)
+
+    def statistics(self):
+        """
+        min, max, mean, std, variance, kurtosis (Fisher) and skewness, biased as in numpy / scipy defaults.
+        """
+        variance = self.m2 / self.count
+        return {
+            "min": self.min,
+            "max": self.max,
+            "mean": self.mean,
+            "std": variance ** 0.5,
+            "variance": variance,
+            "kurtosis": self.count * self.m4 / self.m2 ** 2 - 3.0 if self.m2 > 0 else float("nan"),
+            "skewness": self.count ** 0.5 * self.m3 / self.m2 ** 1.5 if self.m2 > 0 else float("nan"),
+        }
+
+
+class QuantileSketch:
+    """
+    KLL quantile sketch: level h holds items of weight 2**h; a level that
+    outgrows its capacity is sorted and every other item (random offset) is
+    promoted to the next level. Sketches merge level by level.
+    """
+
+    def __init__(self, k=SKETCH_K, seed=None):
+        self.k = k
+        self.rng = np.random.default_rng(seed)
+        self.levels = [np.empty(0)]
+        self.count = 0
+
+    def capacity(self, level):
+        return max(2, int(self.k * (2 / 3) ** (len(self.levels) - 1 - level)))
+
+    def compress(self):
+        level = 0
+        while level < len(self.levels):
+            items = self.levels[level]
+            if len(items) > self.capacity(level):
+                if level + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                items = np.sort(items)
+                # an odd item out stays at this level
+                keep = items[:len(items) % 2]
+                paired = items[len(items) % 2:]
+                promoted = paired[self.rng.integers(2)::2]
+                self.levels[level] = keep
+                self.levels[level + 1] = np.concatenate((self.levels[level + 1], promoted))
+            level += 1
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64).ravel()
+        self.levels[0] = np.concatenate((self.levels[0], values))
+        self.count += values.size
+        self.compress()
+
+    def merge(self, other):
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0))
+        for level, items in enumerate(other.levels):
+            self.levels[level] = np.concatenate((self.levels[level], items))
+        self.count += other.count
+        self.compress()
+
+    def quantile(self, q):
+        """
+        Approximate value at quantile q (0..1) of the values added.
+        """
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(level), 2.0 ** h) for h, level in enumerate(self.levels)])
+        order = np.argsort(items, kind="stable")
+        cumulative = np.cumsum(weights[order])
+        # midpoint ranks, interpolated like np.quantile
+        ranks = (cumulative - weights[order] / 2) / cumulative[-1]
+        return float(np.interp(q, ranks, items[order]))
+
+
+class SimilarityStatistics:
+    """
+    Streaming statistics of similarity values: moments, a quantile sketch and
+    the num_smallest + 1 smallest values, which make the statistics after
+    remove_outliers exact (except the median).
+    """
+
+    def __init__(self, num_smallest=0, k=SKETCH_K, seed=None):
+        self.num_smallest = num_smallest
+        self.moments = MomentAccumulator()
+        self.sketch = QuantileSketch(k, seed)
+        self.smallest = np.empty(0)
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        if values.size == 0:
+            return
+        self.moments.update(values)
+        self.sketch.update(values)
+        self.keep_smallest(values)
+
+    def keep_smallest(self, values):
+        candidates = np.concatenate((self.smallest, values))
+        keep = self.num_smallest + 1
+        if len(candidates) > keep:
+            candidates = np.partition(candidates, keep - 1)[:keep]
+        self.smallest = np.sort(candidates)
+
+    def merge(self, other):
+        self.moments.merge(other.moments)
+        self.sketch.merge(other.sketch)
+        self.keep_smallest(other.smallest)
+
+    def statistics(self, num_to_remove=0):
+        """
+        Statistics in the format of calculate_statistics, after dropping the num_to_remove lowest values.
+
+        Parameters:
+        num_to_remove (int): Lowest values to drop, at most num_smallest.
+
+        Returns:
+        dict: Statistical values; "median" is approximate.
+        """
+        if num_to_remove > self.num_smallest:
+            raise ValueError(f"only the {self.num_smallest} smallest values were tracked")
+        count = self.moments.count
+        num_to_remove = min(num_to_remove, count)
+        moments = MomentAccumulator()
+        moments.merge(self.moments)
+        if num_to_remove:
+            moments.subtract(MomentAccumulator.from_values(self.smallest[:num_to_remove]))
+            moments.min = float(self.smallest[num_to_remove]) if num_to_remove < len(self.smallest) else moments.min
+        if moments.count == 0:
+            return {"count": 0}
+        statistics = moments.statistics()
+        # median of the remaining values: quantile 0.5 of them, on the rank scale of all values
+        statistics["median"] = self.sketch.quantile((num_to_remove + 0.5 * (count - num_to_remove)) / count)
+        statistics["count"] = moments.count
+        return statistics
+
+
+def iter_similarity_values(folder_path):
+    """
+    Yield the similarity values of connected image pairs one label file at a time.
+
+    Parameters:
+    folder_path (str): Path to the folder containing JSON files.
+
+    Yields:
+    numpy.ndarray: float64 similarity values of one file.
+    """
+    for filename in sorted(os.listdir(folder_path)):
+        if filename.endswith('.json'):
+            yield load_file_similarity_values(os.path.join(folder_path, filename))
+
+def load_file_similarity_values(file_path):
+    with open(file_path, 'r') as file:
+        data = json.load(file)
+    return np.array([entry["similarity"] for entry in data if entry["connected"]], dtype=np.float64)
 
 def load_similarity_values(folder_path):
     """
@@ -18,15 +253,50 @@ def load_similarity_values(folder_path):
     list: A list of similarity values for connected image pairs.
     """
     similarity_values = []
-    for filename in os.listdir(folder_path):
-        if filename.endswith('.json'):
-            with open(os.path.join(folder_path, filename), 'r') as file:
-                data = json.load(file)
-                for entry in data:
-                    if entry["connected"]:
-                        similarity_values.append(entry["similarity"])
+    for values in iter_similarity_values(folder_path):
+        similarity_values.extend(values.tolist())
     return similarity_values
 
+def accumulate_files(file_paths, num_smallest, seed=None):
+    """
+    Streaming statistics of the connected similarity values in some label files.
+
+    Returns:
+    SimilarityStatistics: Partial result, to be merged with those of other workers.
+    """
+    accumulator = SimilarityStatistics(num_smallest, seed=seed)
+    for file_path in file_paths:
+        accumulator.update(load_file_similarity_values(file_path))
+    return accumulator
+
+def stream_similarity_statistics(folder_path, num_smallest=0, num_workers=NUM_WORKERS, seed=None):
+    """
+    Streaming statistics of all label files in a folder; files are split over worker processes
+    and the partial results merged.
+
+    Parameters:
+    folder_path (str): Path to the folder containing JSON files.
+    num_smallest (int): Lowest values that may later be removed as outliers.
+    num_workers (int): Number of worker processes; 1 reads the files in this process.
+    seed (int): Seed of the quantile sketches.
+
+    Returns:
+    SimilarityStatistics: Merged result.
+    """
+    file_paths = [os.path.join(folder_path, filename) for filename in sorted(os.listdir(folder_path))
+                  if filename.endswith('.json')]
+    if num_workers <= 1 or len(file_paths) <= 1:
+        return accumulate_files(file_paths, num_smallest, seed)
+
+    chunks = [file_paths[i::num_workers] for i in range(min(num_workers, len(file_paths)))]
+    seeds = np.random.SeedSequence(seed).spawn(len(chunks))
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        partials = list(executor.map(accumulate_files, chunks, [num_smallest] * len(chunks), seeds))
+    accumulator = partials[0]
+    for partial in partials[1:]:
+        accumulator.merge(partial)
+    return accumulator
+
 def calculate_statistics(values):
     """
     Calculate statistical values for the given list of values.
@@ -80,15 +350,14 @@ def save_statistics_to_json(original_stats, cleaned_stats, output_path):
         json.dump(results, file, indent=4)
     print(f"Statistics saved to {output_path}")
 
-def main(folder_path, num_outliers_to_remove, output_path):
-    similarity_values = load_similarity_values(folder_path)
+def main(folder_path, num_outliers_to_remove, output_path, num_workers=NUM_WORKERS):
+    accumulator = stream_similarity_statistics(folder_path, num_outliers_to_remove, num_workers)
     
     # Calculate original statistics
-    original_stats = calculate_statistics(similarity_values)
+    original_stats = accumulator.statistics()
     
     # Remove outliers and calculate new statistics
-    cleaned_values = remove_outliers(similarity_values, num_outliers_to_remove)
-    cleaned_stats = calculate_statistics(cleaned_values)
+    cleaned_stats = accumulator.statistics(num_outliers_to_remove)
     
     # Save the results to a JSON file
     save_statistics_to_json(original_stats, cleaned_stats, output_path)
@@ -1,9 +1,16 @@
 import os
 import csv
+import json
+import numpy as np
+import torch
+from concurrent.futures import ProcessPoolExecutor
+from numpy.lib.format import open_memmap
 from torch.utils.data import Dataset
 from PIL import Image
 import torchvision.transforms as transforms
 
+from IngestCache import file_digest, save_json_atomic
+
 # === Input directories ===
 ROOT_FOLDERS = [
     "Data/GameTile/complete_labels_output_model",
@@ -11,6 +18,13 @@ ROOT_FOLDERS = [
 ]
 OUTPUT_CSV = "Data/GameTile/tile_classification_dataset.csv"
 
+# === Decoded-tensor cache ===
+# <csv>.tensors/ holds images.npy, the (N, 3, 64, 64) uint8 pixels after Resize((64, 64)),
+# labels.npy and meta.json with the CSV digest; it is rebuilt when the CSV changes.
+IMAGE_SIZE = 64
+CACHE_SUFFIX = ".tensors"
+DECODE_WORKERS = os.cpu_count() or 1
+
 def collect_image_paths():
     rows = []
     for root in ROOT_FOLDERS:
@@ -39,25 +53,108 @@ def save_to_csv(rows, output_path):
         writer.writerows(rows)
     print(f"Saved dataset to: {output_path}")
 
+def read_dataset_csv(csv_file):
+    data = []
+    with open(csv_file, "r") as f:
+        next(f)  # skip header
+        for line in f:
+            path, label = line.strip().split(",")
+            data.append((path, int(label)))
+    return data
+
+def decode_image(image_path, size=IMAGE_SIZE):
+    """
+    The pixels Resize((size, size)) gives for an image, as a uint8 (3, size, size) array.
+    """
+    with Image.open(image_path) as image:
+        image = image.convert("RGB").resize((size, size), Image.BILINEAR)
+    return np.asarray(image).transpose(2, 0, 1)
+
+def tensor_cache_path(csv_file):
+    return csv_file + CACHE_SUFFIX
+
+def is_cache_fresh(csv_file, cache_dir=None, size=IMAGE_SIZE):
+    """
+    Whether the tensor cache exists and was built from the current CSV at this size.
+    """
+    cache_dir = cache_dir or tensor_cache_path(csv_file)
+    meta_path = os.path.join(cache_dir, "meta.json")
+    if not os.path.exists(meta_path):
+        return False
+    with open(meta_path, "r") as f:
+        meta = json.load(f)
+    return meta.get("csv_digest") == file_digest(csv_file) and meta.get("size") == size
+
+def build_tensor_cache(csv_file, cache_dir=None, size=IMAGE_SIZE, num_workers=DECODE_WORKERS):
+    """
+    Decode and resize every image of a dataset CSV once into a uint8 memmap.
+
+    Parameters:
+    csv_file (str): CSV with image_path and label columns.
+    cache_dir (str): Output folder; defaults to <csv_file>.tensors.
+    size (int): Side length after resizing.
+    num_workers (int): Decoding processes.
+    """
+    cache_dir = cache_dir or tensor_cache_path(csv_file)
+    os.makedirs(cache_dir, exist_ok=True)
+    meta_path = os.path.join(cache_dir, "meta.json")
+    if os.path.exists(meta_path):
+        os.remove(meta_path)  # the cache is incomplete until meta.json is written again
+
+    data = read_dataset_csv(csv_file)
+    paths = [path for path, _ in data]
+    images = open_memmap(os.path.join(cache_dir, "images.npy"), mode="w+", dtype=np.uint8, shape=(len(data), 3, size, size))
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        for i, pixels in enumerate(executor.map(decode_image, paths, [size] * len(paths), chunksize=64)):
+            images[i] = pixels
+    images.flush()
+    del images
+    np.save(os.path.join(cache_dir, "labels.npy"), np.array([label for _, label in data], dtype=np.int64))
+    save_json_atomic({"csv_digest": file_digest(csv_file), "count": len(data), "size": size}, meta_path)
+    print(f"Cached {len(data)} decoded tiles in: {cache_dir}")
+
 # === PyTorch Dataset ===
 class TileDataset(Dataset):
-    def __init__(self, csv_file, transform=None):
-        self.data = []
-        with open(csv_file, "r") as f:
-            next(f)  # skip header
-            for line in f:
-                path, label = line.strip().split(",")
-                self.data.append((path, int(label)))
+    """
+    Tiles and labels of a dataset CSV.
 
+    With cached=True the images come from the decoded-tensor cache (built or
+    rebuilt on first use) as float tensors in [0, 1], the same values
+    Resize((64, 64)) + ToTensor() give; transform is then applied to those
+    tensors, so it should only hold tensor augmentations. Otherwise every item
+    is decoded from its PNG and transform defaults to Resize + ToTensor.
+    """
+
+    def __init__(self, csv_file, transform=None, cached=False, cache_dir=None):
+        self.cached = cached
+        if cached:
+            self.cache_dir = cache_dir or tensor_cache_path(csv_file)
+            if not is_cache_fresh(csv_file, self.cache_dir):
+                build_tensor_cache(csv_file, self.cache_dir)
+            self.labels = np.load(os.path.join(self.cache_dir, "labels.npy"))
+            self.images = None  # mapped on first access, so each DataLoader worker maps it itself
+            self.transform = transform
+            return
+
+        self.data = read_dataset_csv(csv_file)
         self.transform = transform or transforms.Compose([
             transforms.Resize((64, 64)),
             transforms.ToTensor()
         ])
 
     def __len__(self):
-        return len(self.data)
+        return len(self.labels) if self.cached else len(self.data)
 
     def __getitem__(self, idx):
+        if self.cached:
+            if self.images is None:
+                # copy-on-write map: slices are zero-copy and torch accepts them as writable
+                self.images = np.load(os.path.join(self.cache_dir, "images.npy"), mmap_mode="c")
+            image = torch.from_numpy(self.images[idx]).float().div_(255)
+            if self.transform is not None:
+                image = self.transform(image)
+            return image, int(self.labels[idx])
+
         image_path, label = self.data[idx]
         image = Image.open(image_path).convert("RGB")
         return self.transform(image), label
@@ -69,5 +166,5 @@ if __name__ == "__main__":
 
     # Optional example:
     # from torch.utils.data import DataLoader
-    # dataset = TileDataset(OUTPUT_CSV)
+    # dataset = TileDataset(OUTPUT_CSV, cached=True)
     # loader = DataLoader(dataset, batch_size=32, shuffle=True)
@@ -1,33 +1,14 @@
 import torch
 from torch import nn, optim
 from torchvision import models
-from torchvision.transforms import Compose, Resize, ToTensor
-from torch.utils.data import DataLoader, Dataset
-from PIL import Image
+from torch.utils.data import DataLoader
 import matplotlib.pyplot as plt
-import csv
-
-class TileDataset(Dataset):
-    def __init__(self, csv_file, transform=None):
-        self.data = []
-        with open(csv_file, "r") as f:
-            next(f)
-            for line in f:
-                path, label = line.strip().split(",")
-                self.data.append((path, int(label)))
-
-        self.transform = transform or Compose([
-            Resize((64, 64)),
-            ToTensor()
-        ])
-
-    def __len__(self):
-        return len(self.data)
-
-    def __getitem__(self, idx):
-        path, label = self.data[idx]
-        img = Image.open(path).convert("RGB")
-        return self.transform(img), label
+import os
+
+from Task_Completeness_data import TileDataset
+
+CACHE_TENSORS = True  # read pre-decoded 64x64 tensors instead of decoding every PNG each epoch
+LOADER_WORKERS = min(4, os.cpu_count() or 1)
 
 def evaluate_model(model, loader, device):
     model.eval()
@@ -41,12 +22,14 @@ def evaluate_model(model, loader, device):
             correct += preds.eq(labels).sum().item()
     return correct / total
 
-def train_model(train_csv, val_csv, test_csv, num_epochs=15, batch_size=32, lr=1e-3, patience=3):
+def train_model(train_csv, val_csv, test_csv, num_epochs=15, batch_size=32, lr=1e-3, patience=3, cached=CACHE_TENSORS):
     device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
     
-    train_loader = DataLoader(TileDataset(train_csv), batch_size=batch_size, shuffle=True)
-    val_loader = DataLoader(TileDataset(val_csv), batch_size=batch_size)
-    test_loader = DataLoader(TileDataset(test_csv), batch_size=batch_size)
+    # decoded tiles are cheap to read, so a couple of workers keep up with the model
+    workers = LOADER_WORKERS if not cached else min(LOADER_WORKERS, 2)
+    train_loader = DataLoader(TileDataset(train_csv, cached=cached), batch_size=batch_size, shuffle=True, num_workers=workers)
+    val_loader = DataLoader(TileDataset(val_csv, cached=cached), batch_size=batch_size, num_workers=workers)
+    test_loader = DataLoader(TileDataset(test_csv, cached=cached), batch_size=batch_size, num_workers=workers)
 
     model = models.mobilenet_v2(pretrained=True)
     model.classifier[1] = nn.Linear(model.last_channel, 2)
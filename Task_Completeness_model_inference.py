@@ -1,26 +1,213 @@
+import os
+import csv
+import json
+import numpy as np
 import torch
+from torch.utils.data import Dataset, DataLoader
 from torchvision import models, transforms
 from PIL import Image
 
-# === Load model
-model = models.mobilenet_v2(pretrained=False)
-model.classifier[1] = torch.nn.Linear(model.last_channel, 2)
-model.load_state_dict(torch.load("Data/GameTile/best_completeness_model.pth"))
-model.eval()
+from TileStore import TileStore, TILES_FILE, INDEX_FILE, META_FILE
+
+# === Configuration
+MODEL_PATH = "Data/GameTile/best_completeness_model.pth"
+INPUT_SOURCE = "Data/GameTile/small_Segmenets_model"   # folder of PNGs, CSV with an image_path column, or a packed tile store
+OUTPUT_FILE = "Data/GameTile/completeness_predictions.jsonl"  # .jsonl or .parquet (needs pyarrow)
+BATCH_SIZE = 256
+NUM_WORKERS = os.cpu_count() or 1   # DataLoader worker processes decoding images
+QUANTIZE = False                    # dynamic int8 quantisation of the linear layers, CPU only
+EXPORT = None                       # "torchscript" or "onnx" to also export the prepared model
+EXPORT_PATH = "Data/GameTile/completeness_model"  # extension is added per export format
+
+LABELS = {0: "part", 1: "complete"}
 
-# === Inference example
 transform = transforms.Compose([
     transforms.Resize((64, 64)),
     transforms.ToTensor()
 ])
 
-image_path = "path_to_some_tile.png"
-image = Image.open(image_path).convert("RGB")
-input_tensor = transform(image).unsqueeze(0)  # shape: [1, 3, 64, 64]
 
-with torch.no_grad():
-    output = model(input_tensor)
-    _, predicted = output.max(1)
-    label = predicted.item()
+class ImageFileDataset(Dataset):
+    """
+    Images from a list of paths; items are (tensor, path).
+    """
+
+    def __init__(self, image_paths, transform=transform):
+        self.image_paths = list(image_paths)
+        self.transform = transform
+
+    def __len__(self):
+        return len(self.image_paths)
+
+    def __getitem__(self, idx):
+        image_path = self.image_paths[idx]
+        return self.transform(Image.open(image_path).convert("RGB")), image_path
+
+
+class TileStoreDataset(Dataset):
+    """
+    Every tileset of a packed tile store as one image, e.g. the object crops
+    ExtractObject packs with OBJECT_STORE; items are (tensor, tileset name).
+    The store is opened lazily so that each DataLoader worker maps it itself.
+    """
+
+    def __init__(self, store_path, transform=transform):
+        self.store_path = store_path
+        self.transform = transform
+        self.names = TileStore(store_path).tileset_names
+        self.store = None
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, idx):
+        if self.store is None:
+            self.store = TileStore(self.store_path)
+        name = self.names[idx]
+        grid = self.store.get_tileset(name)
+        rows, cols, tile_size = grid.shape[0], grid.shape[1], grid.shape[2]
+        pixels = np.ascontiguousarray(grid.transpose(0, 2, 1, 3, 4)).reshape(rows * tile_size, cols * tile_size, 4)
+        return self.transform(Image.fromarray(pixels, "RGBA").convert("RGB")), name
+
+
+def make_dataset(source):
+    """
+    Dataset for a folder (all PNGs below it), a CSV with an image_path column, or a tile store folder.
+    """
+    # connectivity stores have a meta.json too, so check for the tile store columns as well
+    if os.path.isdir(source) and all(os.path.exists(os.path.join(source, name)) for name in (TILES_FILE, INDEX_FILE, META_FILE)):
+        return TileStoreDataset(source)
+    if source.lower().endswith(".csv"):
+        with open(source, newline="") as f:
+            return ImageFileDataset(row["image_path"] for row in csv.DictReader(f))
+    image_paths = []
+    for folder, _, files in sorted(os.walk(source)):
+        image_paths.extend(os.path.join(folder, file) for file in sorted(files) if file.lower().endswith(".png"))
+    return ImageFileDataset(image_paths)
+
+def load_model(model_path=MODEL_PATH):
+    model = models.mobilenet_v2(pretrained=False)
+    model.classifier[1] = torch.nn.Linear(model.last_channel, 2)
+    model.load_state_dict(torch.load(model_path, map_location="cpu"))
+    model.eval()
+    return model
+
+def prepare_model(model, device, quantize=QUANTIZE):
+    """
+    Inference copy of the model: channels_last, optionally dynamic int8 (CPU only).
+
+    Dynamic quantisation covers the linear classifier; MobileNetV2's
+    convolutions stay in float.
+    """
+    model = model.to(device, memory_format=torch.channels_last).eval()
+    if quantize and device.type == "cpu":
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return model
+
+def export_model(model, kind, export_path=EXPORT_PATH):
+    """
+    Save the model as TorchScript (.pt) or ONNX (.onnx) with a dynamic batch axis.
+
+    The ONNX exporter rejects dynamically quantized modules, so export the float model.
+    """
+    if kind == "onnx" and any(type(module).__module__.startswith("torch.ao.nn.quantized") for module in model.modules()):
+        raise ValueError("cannot export a dynamically quantized model to ONNX; export before quantizing")
+    example = torch.zeros(1, 3, 64, 64).to(memory_format=torch.channels_last)
+    if kind == "torchscript":
+        path = export_path + ".pt"
+        with torch.inference_mode():
+            torch.jit.trace(model, example).save(path)
+    elif kind == "onnx":
+        path = export_path + ".onnx"
+        torch.onnx.export(model, example, path, input_names=["image"], output_names=["logits"],
+                          dynamic_axes={"image": {0: "batch"}, "logits": {0: "batch"}})
+    else:
+        raise ValueError(f"unknown export format {kind}")
+    print(f"[SAVE] {kind} model → {path}")
+    return path
+
+
+class PredictionWriter:
+    """
+    Append prediction batches to a JSONL file, or to a Parquet file when the path ends in .parquet.
+    """
+
+    def __init__(self, output_path):
+        self.output_path = output_path
+        os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+        self.parquet = output_path.lower().endswith(".parquet")
+        self.writer = None
+        self.file = None if self.parquet else open(output_path, "w")
+
+    def write(self, keys, predicted, prob_complete):
+        if self.parquet:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            table = pa.table({"image": list(keys), "label": [LABELS[int(p)] for p in predicted],
+                              "predicted": np.asarray(predicted, dtype=np.int8),
+                              "prob_complete": np.asarray(prob_complete, dtype=np.float32)})
+            if self.writer is None:
+                self.writer = pq.ParquetWriter(self.output_path, table.schema)
+            self.writer.write_table(table)
+            return
+        for key, p, prob in zip(keys, predicted, prob_complete):
+            self.file.write(json.dumps({"image": key, "label": LABELS[int(p)], "predicted": int(p),
+                                        "prob_complete": round(float(prob), 6)}) + "\n")
+        self.file.flush()
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        if self.file is not None:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def run_batch_inference(source=INPUT_SOURCE, output_path=OUTPUT_FILE, model_path=MODEL_PATH, batch_size=BATCH_SIZE,
+                        num_workers=NUM_WORKERS, quantize=QUANTIZE, export=EXPORT):
+    """
+    Classify every image of a folder, CSV or tile store and write the predictions as they are made.
+
+    Returns:
+    int: Number of images scored.
+    """
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    model = prepare_model(load_model(model_path), device, quantize=False)
+    if export:
+        export_model(model, export)  # the float model, before any quantisation
+    if quantize:
+        model = prepare_model(model, device, quantize)
+
+    dataset = make_dataset(source)
+    loader = DataLoader(dataset, batch_size=batch_size, num_workers=num_workers,
+                        pin_memory=device.type == "cuda", persistent_workers=num_workers > 0)
+    print(f"[INFO] Scoring {len(dataset)} images from {source}")
+
+    count = 0
+    with PredictionWriter(output_path) as writer, torch.inference_mode():
+        for images, keys in loader:
+            images = images.to(device, memory_format=torch.channels_last, non_blocking=True)
+            probs = torch.softmax(model(images), dim=1)
+            predicted = probs.argmax(dim=1)
+            writer.write(keys, predicted.cpu().numpy(), probs[:, 1].cpu().numpy())
+            count += len(keys)
+    print(f"[SAVE] {count} predictions → {output_path}")
+    return count
+
+def classify_image(model, image_path):
+    """
+    Label of a single image, "complete" or "part".
+    """
+    input_tensor = transform(Image.open(image_path).convert("RGB")).unsqueeze(0)  # shape: [1, 3, 64, 64]
+    with torch.inference_mode():
+        _, predicted = model(input_tensor).max(1)
+    return LABELS[predicted.item()]
+
 
-print(f"Predicted label: {'complete' if label == 1 else 'part'}")
+if __name__ == "__main__":
+    run_batch_inference()
@@ -1,20 +1,47 @@
 import os
 import json
+from ConnectivityStore import ConnectivityStore, DIRECTIONS
+from EdgeProfile import transparent_sections
 
 # === Input and output folders ===
 INPUT_FOLDER = "Data/GameTile/connectivity_results_smart"
+INPUT_STORE = "Data/GameTile/connectivity_results_smart_packed"  # read instead of INPUT_FOLDER when it exists
 OUTPUT_FOLDER = "Data/GameTile/connectivity_cleaned"
-os.makedirs(OUTPUT_FOLDER, exist_ok=True)
 
-# === Process all JSON files ===
-for fname in os.listdir(INPUT_FOLDER):
-    if not fname.endswith(".json"):
-        continue
+# re-derive edge transparency from the store's edge profiles with these settings;
+# None keeps the transparency flags FindConnectivity_4 stored
+TRANSPARENCY_THRESHOLD = None
+EDGE_CHECK_ROWS = 4
+TILE_SIZE = 32
+os.makedirs(OUTPUT_FOLDER, exist_ok=True)
 
-    input_path = os.path.join(INPUT_FOLDER, fname)
-    with open(input_path, "r") as f:
-        tiles = json.load(f)
+def load_connectivity_files():
+    """
+    Yield (file name, tile records) for every tileset, from the packed store if there is one.
+    """
+    if os.path.exists(INPUT_STORE):
+        store = ConnectivityStore(INPUT_STORE)
+        rederive = TRANSPARENCY_THRESHOLD is not None
+        if rederive and store.profile is None:
+            raise ValueError(f"{INPUT_STORE} has no edge profiles; rebuild it with FindConnectivity_4")
+        for tileset_id in store.tileset_names:
+            tiles = store.to_records(tileset_id)
+            if rederive:
+                start, stop = store.tileset_rows(tileset_id)
+                transparent = transparent_sections(store.profile[start:stop], True, TRANSPARENCY_THRESHOLD,
+                                                   EDGE_CHECK_ROWS, TILE_SIZE)
+                for tile, flags in zip(tiles, transparent):
+                    tile["edge_transparency"] = {d: bool(flags[DIRECTIONS.index(d)]) for d in tile["edge_transparency"]}
+            yield f"tile_connectivity-{tileset_id}.json", tiles
+        return
+    for fname in os.listdir(INPUT_FOLDER):
+        if not fname.endswith(".json"):
+            continue
+        with open(os.path.join(INPUT_FOLDER, fname), "r") as f:
+            yield fname, json.load(f)
 
+# === Process all tilesets ===
+for fname, tiles in load_connectivity_files():
     # Update connectivity based on non-transparent edges
     for tile in tiles:
         tile["connectivity"] = [
@@ -1,28 +1,40 @@
 import os
-import random
 import json
-
-def sample_tiles_from_folders(root_dir, sample_size, output_file):
-    all_tiles = []
-
-    # Walk through all subfolders
-    for subdir in sorted(os.listdir(root_dir)):
-        subdir_path = os.path.join(root_dir, subdir)
-        if not os.path.isdir(subdir_path):
-            continue
-
-        # Collect .png files
-        for fname in sorted(os.listdir(subdir_path)):
-            if fname.lower().endswith(".png"):
-                relative_path = os.path.join(subdir, fname)
-                all_tiles.append(relative_path)
-
-    print(f"Found {len(all_tiles)} tiles.")
-
-    # Sample without replacement (use min if fewer tiles than requested)
-    sampled = random.sample(all_tiles, min(sample_size, len(all_tiles)))
-
-    # Save output
+from TileSampler import sample_tile_paths, sample_store_tiles, load_labeled_tiles
+
+def sample_tiles_from_folders(root_dir, sample_size, output_file, seed=None, exclude_file=None, stratify=False):
+    """
+    Reservoir-sample tiles while walking root_dir, without listing the corpus in memory.
+
+    Parameters:
+    root_dir (str): Folder of tileset subfolders.
+    sample_size (int): Number of tiles to sample.
+    output_file (str): Output JSON list of "<subfolder>/<file>.png" paths.
+    seed (int): Random seed for a reproducible sample.
+    exclude_file (str): Label JSON whose tiles must not be sampled again.
+    stratify (bool): Share the sample equally between tilesets.
+    """
+    exclude = load_labeled_tiles(exclude_file) if exclude_file else set()
+    sampled = sample_tile_paths(root_dir, sample_size, seed, stratify, exclude)
+    save_sampled_tiles(sampled, output_file)
+
+def sample_tiles_from_store(store_path, sample_size, output_file, seed=None, exclude_file=None, stratify=()):
+    """
+    Sample tiles from a packed connectivity store, stratified by tileset, edge class and/or transparency.
+
+    Parameters:
+    store_path (str): ConnectivityStore folder written by FindConnectivity_4.
+    sample_size (int): Number of tiles to sample.
+    output_file (str): Output JSON list of "<tileset>/tiles_<x>_<y>.png" paths.
+    seed (int): Random seed for a reproducible sample.
+    exclude_file (str): Label JSON whose tiles must not be sampled again.
+    stratify (tuple): Subset of TileSampler.STRATA.
+    """
+    exclude = load_labeled_tiles(exclude_file) if exclude_file else set()
+    sampled = sample_store_tiles(store_path, sample_size, seed, stratify, exclude)
+    save_sampled_tiles(sampled, output_file)
+
+def save_sampled_tiles(sampled, output_file):
     with open(output_file, "w") as f:
         json.dump(sampled, f, indent=4)
 
@@ -30,8 +42,15 @@ def sample_tiles_from_folders(root_dir, sample_size, output_file):
 
 # ==== USER CONFIG ====
 tile_folder = "Data/GameTile/small_dataset/Tiles"
+connectivity_store = "Data/GameTile/connectivity_results_smart_packed"  # sampled instead of tile_folder when it exists
 num_samples = 200  # Change this to how many tiles you want to sample
 output_json = "Data/GameTile/connectivity_sampled_tiles.json"
+labeled_json = "Data/GameTile/labeled_connectivity_manual.json"  # tiles labeled here are not sampled again
+seed = None  # set an int for a reproducible sample
+stratify = ("edge_class", "transparency")  # strata for store sampling, see TileSampler.STRATA
 
 # ==== RUN ====
-sample_tiles_from_folders(tile_folder, num_samples, output_json)
+if os.path.exists(connectivity_store):
+    sample_tiles_from_store(connectivity_store, num_samples, output_json, seed, labeled_json, stratify)
+else:
+    sample_tiles_from_folders(tile_folder, num_samples, output_json, seed, labeled_json)
@@ -0,0 +1,310 @@
+import os
+import json
+import heapq
+import numpy as np
+
+from ConnectivityStore import ConnectivityStore, CONNECTED_SHIFT, TRANSPARENT_SHIFT
+
+# Streaming samplers for annotation batches. Every item gets a uniform random
+# priority and each stratum keeps the k lowest, so a sample of any size is
+# drawn in one pass with O(k) memory per stratum, and the same seed over the
+# same stream gives the same sample.
+
+# tile strata available from a connectivity store
+STRATA = ("tileset", "edge_class", "transparency")
+
+EDGE_BATCH = 1 << 20                # graph edges scored per step
+
+
+class ReservoirSampler:
+    """
+    Bottom-k reservoir sampler with optional strata.
+
+    With balanced=False the sample is uniform over all items added; with
+    balanced=True the k slots are shared equally between strata (strata with
+    fewer items give their slots to the others).
+    """
+
+    def __init__(self, k, seed=None, balanced=False, exclude=()):
+        self.k = k
+        self.rng = np.random.default_rng(seed)
+        self.balanced = balanced
+        self.exclude = exclude
+        self.reservoirs = {}
+        self.count = 0
+
+    def _offer(self, priority, item, stratum):
+        reservoir = self.reservoirs.setdefault(stratum, [])
+        # max-heap on priority; the counter keeps ties away from comparing items
+        entry = (-priority, self.count, item)
+        self.count += 1
+        if len(reservoir) < self.k:
+            heapq.heappush(reservoir, entry)
+        elif priority < -reservoir[0][0]:
+            heapq.heapreplace(reservoir, entry)
+
+    def add(self, item, stratum=None):
+        """
+        Offer one item, skipping it if it is in the exclude set.
+        """
+        if item in self.exclude:
+            return
+        self._offer(self.rng.random(), item, stratum)
+
+    def add_batch(self, items, strata=None):
+        """
+        Offer an array of items at once; only the k best of each stratum in the batch reach the heaps.
+
+        Parameters:
+        items (numpy.ndarray): Items, e.g. row ids.
+        strata (numpy.ndarray): Stratum of each item, or None.
+        """
+        priorities = self.rng.random(len(items))
+        if strata is None:
+            groups = [(None, np.arange(len(items)))]
+        else:
+            values, inverse = np.unique(strata, return_inverse=True)
+            order = np.argsort(inverse, kind="stable")
+            bounds = np.cumsum(np.bincount(inverse, minlength=len(values)))[:-1]
+            groups = zip(values.tolist(), np.split(order, bounds))
+        for stratum, members in groups:
+            if len(members) > self.k:
+                members = members[np.argpartition(priorities[members], self.k - 1)[:self.k]]
+            for i in members:
+                self._offer(float(priorities[i]), items[i], stratum)
+
+    def sample(self):
+        """
+        Return the sampled items, in random order.
+        """
+        # entries hold -priority, so reverse order is lowest priority first
+        ranked = {stratum: sorted(reservoir, reverse=True) for stratum, reservoir in self.reservoirs.items()}
+        if not self.balanced:
+            merged = heapq.merge(*ranked.values(), reverse=True)
+            return [item for _, _, item in merged][:self.k]
+        ranked = {stratum: [item for _, _, item in reservoir] for stratum, reservoir in ranked.items()}
+
+        # round robin over strata in a fixed order
+        sample = []
+        strata = sorted(ranked, key=repr)
+        depth = 0
+        while len(sample) < self.k and any(depth < len(ranked[stratum]) for stratum in strata):
+            for stratum in strata:
+                if depth < len(ranked[stratum]) and len(sample) < self.k:
+                    sample.append(ranked[stratum][depth])
+            depth += 1
+        return sample
+
+
+def iter_tile_paths(root_dir):
+    """
+    Walk the tileset subfolders of root_dir and yield "<subfolder>/<file>.png" paths one at a time.
+    """
+    for subdir in sorted(os.listdir(root_dir)):
+        subdir_path = os.path.join(root_dir, subdir)
+        if not os.path.isdir(subdir_path):
+            continue
+        with os.scandir(subdir_path) as entries:
+            names = sorted(entry.name for entry in entries if entry.name.lower().endswith(".png"))
+        for fname in names:
+            yield os.path.join(subdir, fname)
+
+def normalize_tile_path(path):
+    return path.replace("\\", "/")
+
+def load_labeled_tiles(label_file):
+    """
+    Tile paths already labeled in a {tile path: labels} JSON such as labeled_connectivity_manual.json.
+
+    Returns:
+    set: Paths with "/" separators; empty if the file does not exist.
+    """
+    if not os.path.exists(label_file):
+        return set()
+    with open(label_file, "r") as f:
+        return {normalize_tile_path(path) for path in json.load(f)}
+
+def load_labeled_pairs(label_folder):
+    """
+    Image pairs already labeled in a folder of [{"image1", "image2", ...}] JSON files.
+
+    Returns:
+    set: frozenset({image1, image2}) per pair; empty if the folder does not exist.
+    """
+    pairs = set()
+    if not os.path.isdir(label_folder):
+        return pairs
+    for filename in os.listdir(label_folder):
+        if filename.endswith(".json"):
+            with open(os.path.join(label_folder, filename), "r") as f:
+                for pair in json.load(f):
+                    pairs.add(frozenset((pair["image1"], pair["image2"])))
+    return pairs
+
+def sample_tile_paths(root_dir, k, seed=None, stratify=False, exclude=()):
+    """
+    Sample tile paths from a directory walk without listing the corpus in memory.
+
+    Parameters:
+    root_dir (str): Folder of tileset subfolders.
+    k (int): Sample size.
+    seed (int): Random seed.
+    stratify (bool): Share the sample equally between tilesets.
+    exclude (set): Paths ("/" separators) that must not be sampled, e.g. load_labeled_tiles().
+
+    Returns:
+    list: "<subfolder>/<file>.png" paths.
+    """
+    sampler = ReservoirSampler(k, seed, balanced=stratify)
+    for path in iter_tile_paths(root_dir):
+        if normalize_tile_path(path) in exclude:
+            continue
+        sampler.add(path, path.split(os.sep)[0] if stratify else None)
+    return sampler.sample()
+
+def tile_strata(tileset_ids, masks, stratify):
+    """
+    Stratum code of every tile of a connectivity store.
+
+    edge_class is the number of connected directions (0-8); transparency is
+    0 for no transparent edge section, 1 for some and 2 for all.
+
+    Parameters:
+    tileset_ids (numpy.ndarray): Tileset index of every tile.
+    masks (numpy.ndarray): ConnectivityStore masks.
+    stratify (tuple): Subset of STRATA.
+
+    Returns:
+    numpy.ndarray: int64 codes, equal for tiles in the same stratum.
+    """
+    masks = np.asarray(masks, dtype=np.uint32)
+    connected = (masks >> CONNECTED_SHIFT) & 0xFF
+    transparent = (masks >> TRANSPARENT_SHIFT) & 0xFF
+    edge_class = np.unpackbits(connected.astype(np.uint8)[:, np.newaxis], axis=1).sum(axis=1)
+    transparency = np.where(transparent == 0, 0, np.where(transparent == 0xFF, 2, 1))
+
+    codes = np.zeros(len(masks), dtype=np.int64)
+    if "tileset" in stratify:
+        codes = codes * (1 << 32) + tileset_ids
+    if "edge_class" in stratify:
+        codes = codes * 9 + edge_class
+    if "transparency" in stratify:
+        codes = codes * 3 + transparency
+    return codes
+
+def parse_tile_path(path):
+    """
+    (tileset, x, y) of a "<tileset>/tiles_<x>_<y>.png" path, or None.
+    """
+    parts = normalize_tile_path(path).split("/")
+    fields = os.path.splitext(parts[-1])[0].split("_")
+    if len(parts) < 2 or len(fields) != 3:
+        return None
+    return parts[-2], int(fields[1]), int(fields[2])
+
+def sample_store_tiles(store_path, k, seed=None, stratify=(), exclude=()):
+    """
+    Sample tiles from a packed connectivity store, optionally stratified.
+
+    Parameters:
+    store_path (str): ConnectivityStore folder.
+    k (int): Sample size.
+    seed (int): Random seed.
+    stratify (tuple): Subset of STRATA; the sample is shared equally between strata.
+    exclude (set): "<tileset>/tiles_<x>_<y>.png" paths that must not be sampled.
+
+    Returns:
+    list: "<tileset>/tiles_<x>_<y>.png" paths.
+    """
+    store = ConnectivityStore(store_path)
+    excluded = {}
+    for path in exclude:
+        key = parse_tile_path(path)
+        if key is not None:
+            excluded.setdefault(key[0], []).append(key[1:])
+
+    sampler = ReservoirSampler(k, seed, balanced=bool(stratify))
+    row_names = []
+    for tileset_id, name in enumerate(store.tileset_names):
+        start, stop = store.tileset_rows(name)
+        keep = np.ones(stop - start, dtype=bool)
+        if name in excluded:
+            xs, ys = zip(*excluded[name])
+            rows = store.get_rows(name, xs, ys)
+            keep[rows[rows >= 0] - start] = False
+        rows = np.arange(start, stop)[keep]
+        strata = tile_strata(np.full(len(rows), tileset_id), store.mask[rows], stratify) if stratify else None
+        sampler.add_batch(rows, strata)
+        row_names.append((start, name))
+
+    # tileset of a row: the live tileset whose range starts last at or before it
+    row_names.sort()
+    starts = [start for start, _ in row_names]
+    paths = []
+    for row in sampler.sample():
+        name = row_names[np.searchsorted(starts, row, side="right") - 1][1]
+        paths.append(f"{name}/tiles_{store.x[row]}_{store.y[row]}.png")
+    return paths
+
+def excluded_node_pairs(graph, exclude, image_root=""):
+    """
+    Neighbour pairs of a graph that are in an exclude set of labeled image pairs.
+
+    Parameters:
+    graph (NeighborGraph): Neighbour graph.
+    exclude (set): frozenset({image1, image2}) paths, see load_labeled_pairs.
+    image_root (str): Prefix of the image paths, as used in the labeled pair files.
+
+    Returns:
+    set: (min node, max node) tuples of the excluded pairs that are graph edges.
+    """
+    pairs = set()
+    if not exclude:
+        return pairs
+    # map the excluded paths to node ids through the few names involved
+    excluded_names = {os.path.basename(path) for pair in exclude for path in pair}
+    candidates = np.nonzero(np.isin(graph.names, list(excluded_names)))[0]
+    node_of_path = {graph.node_path(node, image_root): int(node) for node in candidates}
+    for pair in exclude:
+        nodes = [node_of_path.get(path) for path in pair]
+        if len(nodes) == 2 and None not in nodes:
+            source, target = min(nodes), max(nodes)
+            if target in graph.neighbors_of(source):
+                pairs.add((source, target))
+    return pairs
+
+def sample_neighbor_pairs(graph, k, seed=None, stratify=False, exclude=(), image_root=""):
+    """
+    Sample distinct neighbour pairs from a FindNeighbors.NeighborGraph.
+
+    Uniform samples are drawn edge by edge with NeighborGraph.sample_pairs,
+    rejecting the excluded pairs; a stratified sample needs every folder's
+    pairs, so it takes one reservoir pass over the edges instead.
+
+    Parameters:
+    graph (NeighborGraph): Neighbour graph.
+    k (int): Number of pairs.
+    seed (int): Random seed.
+    stratify (bool): Share the sample equally between folders (tilesets).
+    exclude (set): frozenset({image1, image2}) paths already labeled, see load_labeled_pairs.
+    image_root (str): Prefix of the image paths, as used in the labeled pair files.
+
+    Returns:
+    list: (node, neighbour) id tuples.
+    """
+    excluded_pairs = excluded_node_pairs(graph, exclude, image_root)
+    if not stratify:
+        return graph.sample_pairs(k, np.random.default_rng(seed), excluded_pairs)
+
+    excluded_edges = np.array(sorted(source * len(graph) + target for source, target in excluded_pairs), dtype=np.int64)
+    sampler = ReservoirSampler(k, seed, balanced=True)
+    for start in range(0, graph.edge_count, EDGE_BATCH):
+        sources = np.asarray(graph.sources[start:start + EDGE_BATCH], dtype=np.int64)
+        targets = np.asarray(graph.neighbors[start:start + EDGE_BATCH], dtype=np.int64)
+        # each unordered pair appears as two directed edges; keep one
+        keep = sources < targets
+        if len(excluded_edges):
+            keep &= ~np.isin(sources * len(graph) + targets, excluded_edges)
+        edges = np.nonzero(keep)[0] + start
+        sampler.add_batch(edges, np.asarray(graph.folder_index)[sources[keep]])
+    return [(int(graph.sources[edge]), int(graph.neighbors[edge])) for edge in sampler.sample()]
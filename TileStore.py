@@ -0,0 +1,211 @@
+import os
+import json
+import numpy as np
+
+# A packed tile store is a folder holding
+#   tiles.u8      raw uint8 pixels, memory-mapped as (N, T, T, 4) RGBA
+#   index.npy     one (tileset_id, x, y, flags) record per tile
+#   meta.json     tile size, tile count and the tileset table
+# Every tileset is stored as its full grid in row-major order (tiles_x_y is
+# row start + y * cols + x), so a tileset is one contiguous slice of tiles.u8.
+
+TILES_FILE = "tiles.u8"
+INDEX_FILE = "index.npy"
+META_FILE = "meta.json"
+
+# flags bits
+FLAG_TRANSPARENT = 1
+
+INDEX_DTYPE = np.dtype([("tileset_id", "<i4"), ("x", "<i2"), ("y", "<i2"), ("flags", "u1")])
+
+
+def load_store_meta(store_path):
+    """
+    Read the meta.json of a tile store.
+
+    Parameters:
+    store_path (str): Store folder.
+
+    Returns:
+    dict: {"tile_size", "count", "tilesets": [{"name", "start", "rows", "cols"}, ...]}
+    """
+    with open(os.path.join(store_path, META_FILE), "r") as f:
+        return json.load(f)
+
+
+class TileStoreWriter:
+    """
+    Append tilesets to a packed tile store.
+
+    Pixels are streamed to tiles.u8 as each tileset is added; the index and
+    meta.json are written on close(). With append=True an existing store is
+    extended (re-adding a tileset name shadows its earlier rows); otherwise it
+    is overwritten.
+    """
+
+    def __init__(self, store_path, tile_size, append=True):
+        self.store_path = store_path
+        self.tile_size = tile_size
+        os.makedirs(store_path, exist_ok=True)
+
+        if append and os.path.exists(os.path.join(store_path, META_FILE)):
+            meta = load_store_meta(store_path)
+            if meta["tile_size"] != tile_size:
+                raise ValueError(f"store {store_path} has tile size {meta['tile_size']}, not {tile_size}")
+            self.tilesets = meta["tilesets"]
+            self.count = meta["count"]
+            self.index_parts = [np.load(os.path.join(store_path, INDEX_FILE))]
+        else:
+            self.tilesets = []
+            self.count = 0
+            self.index_parts = []
+
+        self.tiles_file = open(os.path.join(store_path, TILES_FILE), "r+b" if self.count else "wb")
+        self.tiles_file.seek(self.count * tile_size * tile_size * 4)
+        self.tiles_file.truncate()
+
+    def add_tileset(self, name, tiles, transparent=None):
+        """
+        Append one tileset.
+
+        Parameters:
+        name (str): Tileset name (image stem).
+        tiles (numpy.ndarray): uint8 tile grid of shape (rows, cols, T, T, 4).
+        transparent (numpy.ndarray): Optional boolean mask of shape (rows, cols).
+        """
+        rows, cols = tiles.shape[:2]
+        if tiles.shape[2:] != (self.tile_size, self.tile_size, 4):
+            raise ValueError(f"expected tiles of shape (rows, cols, {self.tile_size}, {self.tile_size}, 4), got {tiles.shape}")
+
+        self.tiles_file.write(np.ascontiguousarray(tiles, dtype=np.uint8).tobytes())
+
+        index = np.empty(rows * cols, dtype=INDEX_DTYPE)
+        index["tileset_id"] = len(self.tilesets)
+        index["y"], index["x"] = np.divmod(np.arange(rows * cols), cols)
+        index["flags"] = 0
+        if transparent is not None:
+            index["flags"][np.ravel(transparent)] |= FLAG_TRANSPARENT
+        self.index_parts.append(index)
+
+        self.tilesets.append({"name": name, "start": self.count, "rows": rows, "cols": cols})
+        self.count += rows * cols
+
+    def close(self):
+        self.tiles_file.close()
+        index = np.concatenate(self.index_parts) if self.index_parts else np.empty(0, dtype=INDEX_DTYPE)
+        np.save(os.path.join(self.store_path, INDEX_FILE), index)
+        meta = {"tile_size": self.tile_size, "count": self.count, "tilesets": self.tilesets}
+        with open(os.path.join(self.store_path, META_FILE), "w") as f:
+            json.dump(meta, f)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class TileStore:
+    """
+    Read-only, memory-mapped view of a packed tile store.
+
+    Single tiles, whole tilesets and row ranges come back as views of the
+    memory map (no copy); get_batch() gathers arbitrary keys into a new array.
+    """
+
+    def __init__(self, store_path):
+        self.store_path = store_path
+        meta = load_store_meta(store_path)
+        self.tile_size = meta["tile_size"]
+        self.count = meta["count"]
+        # later entries shadow earlier ones with the same name
+        self.tilesets = {tileset["name"]: tileset for tileset in meta["tilesets"]}
+        self.tileset_names = list(self.tilesets)
+        self.index = np.load(os.path.join(store_path, INDEX_FILE), mmap_mode="r")
+        if self.count:
+            self.tiles = np.memmap(os.path.join(store_path, TILES_FILE), dtype=np.uint8, mode="r",
+                                   shape=(self.count, self.tile_size, self.tile_size, 4))
+        else:
+            self.tiles = np.empty((0, self.tile_size, self.tile_size, 4), dtype=np.uint8)
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, name):
+        return name in self.tilesets
+
+    def get_row(self, name, x, y):
+        """
+        Row number of tile (x, y) of a tileset, or None if it is outside the grid.
+        """
+        tileset = self.tilesets[name]
+        if not (0 <= x < tileset["cols"] and 0 <= y < tileset["rows"]):
+            return None
+        return tileset["start"] + y * tileset["cols"] + x
+
+    def get(self, name, x, y):
+        """
+        Get one tile as a (T, T, 4) RGBA view, or None if (x, y) is outside the tileset.
+        """
+        row = self.get_row(name, x, y)
+        if row is None:
+            return None
+        return self.tiles[row]
+
+    def get_tileset(self, name):
+        """
+        Get a whole tileset as a (rows, cols, T, T, 4) view.
+        """
+        tileset = self.tilesets[name]
+        start = tileset["start"]
+        stop = start + tileset["rows"] * tileset["cols"]
+        return self.tiles[start:stop].reshape(tileset["rows"], tileset["cols"], self.tile_size, self.tile_size, 4)
+
+    def get_flags(self, name):
+        """
+        Get the flags of a tileset as a (rows, cols) array.
+        """
+        tileset = self.tilesets[name]
+        start = tileset["start"]
+        stop = start + tileset["rows"] * tileset["cols"]
+        return self.index["flags"][start:stop].reshape(tileset["rows"], tileset["cols"])
+
+    def get_range(self, start, stop):
+        """
+        Get rows [start, stop) as an (n, T, T, 4) view, for batched streaming.
+        """
+        return self.tiles[start:stop]
+
+    def get_batch(self, keys):
+        """
+        Gather tiles for a list of (tileset, x, y) keys into a new (n, T, T, 4) array.
+
+        Raises KeyError naming the first key outside its tileset grid, or the unknown tileset.
+        """
+        rows = []
+        for name, x, y in keys:
+            row = self.get_row(name, x, y)
+            if row is None:
+                raise KeyError(f"tile {(name, x, y)} is outside the tileset grid")
+            rows.append(row)
+        return self.tiles[np.array(rows, dtype=np.int64)]
+
+
+def merge_tile_stores(store_paths, corpus_path):
+    """
+    Merge per-tileset stores into one corpus store, one tileset at a time.
+
+    Parameters:
+    store_paths (list): Store folders to merge.
+    corpus_path (str): Output store folder.
+    """
+    writer = None
+    for store_path in store_paths:
+        store = TileStore(store_path)
+        if writer is None:
+            writer = TileStoreWriter(corpus_path, store.tile_size, append=False)
+        for name in store.tileset_names:
+            writer.add_tileset(name, store.get_tileset(name),
+                               (store.get_flags(name) & FLAG_TRANSPARENT) != 0)
+    if writer is not None:
+        writer.close()
@@ -0,0 +1,82 @@
+import os
+import sys
+
+import cv2
+import numpy as np
+import pytest
+from skimage.metrics import structural_similarity
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from BatchSimilarity import batch_ssim, batch_edge_score, batch_mse_similarity
+
+TOLERANCE = 1e-10
+
+
+def reference_mse(imageA, imageB):
+    # the per-pair mse() of FindConnectivity_2/3/4 before batching
+    err = np.sum((imageA.astype("float") - imageB.astype("float")) ** 2)
+    err /= float(imageA.shape[0] * imageA.shape[1])
+    return 1 - (err / 255.0)
+
+def reference_edge_score(edge1_gray, edge2_gray):
+    # the per-pair scoring tail of compare_edges before batching
+    win_size = min(7, min(edge1_gray.shape[0], edge1_gray.shape[1]))
+    if win_size % 2 == 0:
+        win_size -= 1
+    if win_size < 3:
+        return reference_mse(edge1_gray, edge2_gray)
+    return structural_similarity(edge1_gray, edge2_gray, win_size=win_size, channel_axis=None)
+
+def strip_pairs(shape, seed=0):
+    rng = np.random.default_rng(seed)
+    images_1 = rng.integers(0, 256, shape, dtype=np.uint8)
+    images_2 = np.clip(images_1 + rng.integers(-40, 40, shape), 0, 255).astype(np.uint8)
+    # identical and constant pairs hit the c1 / c2 terms on their own
+    images_2[0] = images_1[0]
+    images_1[1] = images_2[1] = 128
+    return images_1, images_2
+
+
+@pytest.mark.parametrize("win_size", [3, 5, 7])
+@pytest.mark.parametrize("spatial_shape", [(7, 16), (16, 16), (32,)])
+def test_batch_ssim_matches_skimage(win_size, spatial_shape):
+    images_1, images_2 = strip_pairs((200,) + spatial_shape)
+    reference = [structural_similarity(a, b, win_size=win_size) for a, b in zip(images_1, images_2)]
+    assert np.allclose(batch_ssim(images_1, images_2, win_size=win_size), reference, rtol=0, atol=TOLERANCE)
+
+@pytest.mark.parametrize("shape", [(200, 1, 16), (200, 16, 1), (200, 2, 16)])
+def test_thin_strips_match_baseline_mse(shape):
+    images_1, images_2 = strip_pairs(shape)
+    reference = [reference_mse(a, b) for a, b in zip(images_1, images_2)]
+    assert np.allclose(batch_mse_similarity(images_1, images_2), reference, rtol=0, atol=TOLERANCE)
+    assert np.allclose(batch_edge_score(images_1, images_2), reference, rtol=0, atol=TOLERANCE)
+
+@pytest.mark.parametrize("rows", [3, 4, 5, 6, 7, 8, 16])
+def test_batch_edge_score_picks_compare_edges_window(rows):
+    images_1, images_2 = strip_pairs((100, rows, 16))
+    reference = [reference_edge_score(a, b) for a, b in zip(images_1, images_2)]
+    assert np.allclose(batch_edge_score(images_1, images_2), reference, rtol=0, atol=TOLERANCE)
+
+def test_compare_edges_strips_match_baseline():
+    # compare_edges turns a (16, 4) half edge into a (1, 16) gray strip, so every direction is scored with mse
+    from FindConnectivity_4 import compare_edges, DIRECTION_OFFSETS, TILE_SIZE
+    rng = np.random.default_rng(1)
+    half = TILE_SIZE // 2
+    for _ in range(20):
+        tile1 = rng.integers(0, 256, (TILE_SIZE, TILE_SIZE, 4), dtype=np.uint8)
+        tile2 = rng.integers(0, 256, (TILE_SIZE, TILE_SIZE, 4), dtype=np.uint8)
+        for direction in DIRECTION_OFFSETS:
+            part = slice(None, half) if direction.endswith(("_top", "_left")) else slice(half, None)
+            if direction.startswith("right"):
+                edge1, edge2 = tile1[part, -1], tile2[part, 0]
+            elif direction.startswith("left"):
+                # left_down compares with the neighbour's top half, as compare_edges always did
+                edge1, edge2 = tile1[part, 0], tile2[:half, -1]
+            elif direction.startswith("top"):
+                edge1, edge2 = tile1[0, part], tile2[-1, part]
+            else:
+                edge1, edge2 = tile1[-1, part], tile2[0, part]
+            gray1 = cv2.cvtColor(np.expand_dims(edge1, axis=0), cv2.COLOR_BGR2GRAY)
+            gray2 = cv2.cvtColor(np.expand_dims(edge2, axis=0), cv2.COLOR_BGR2GRAY)
+            assert abs(compare_edges(tile1, tile2, direction) - reference_edge_score(gray1, gray2)) < TOLERANCE, direction